@@ -0,0 +1,77 @@
+import argparse
+import os
+import sys
+import time
+import numpy as np
+
+# checks are run from the source tree
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dnb_tool import kernels  # noqa: E402
+from dnb_tool.datasets import HP_model, May_model, saddle_node_model  # noqa: E402
+from dnb_tool.timeseries.dnb_ts import CPDotsu, sliding_lambda_max  # noqa: E402
+
+
+# cross-check of the compiled kernels (backend "numba") against the NumPy implementations.
+# the first call of each kernel includes the compilation, so the times are of the second call.
+
+
+def timed_call(func, *args, **kwargs):
+    func(*args, **kwargs)
+    time_s = time.perf_counter()
+    ret = func(*args, **kwargs)
+    return ret, time.perf_counter() - time_s
+
+
+def checks():
+    # yields (name, func), where `func(backend=...)` returns values to be compared
+    rng = np.random.default_rng(0)
+    for T, d, w in [(2000, 1, 100), (5000, 4, 200), (5000, 25, 100), (3000, 100, 300)]:
+        x = rng.standard_normal((T, d)).cumsum(0) * 0.01 + rng.standard_normal((T, d))
+        yield f"sliding_lambda_max[T={T},d={d},w={w}]", \
+            lambda backend, x=x, w=w: sliding_lambda_max(x, w, backend=backend)
+    for length in [1000, 10000]:
+        ews = np.abs(rng.standard_normal(length)).cumsum()
+        yield f"CPDotsu[length={length}]", \
+            lambda backend, ews=ews: np.array([CPDotsu(ews, backend=backend)])
+    yield "May_model", lambda backend: May_model.get_data(backend=backend)[1]
+    yield "saddle_node_model", lambda backend: saddle_node_model.get_data(backend=backend)[1]
+    yield "HP_model[n=5]", lambda backend: HP_model.get_data(n=5, backend=backend)[1]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Check that the numba kernels give the same results as the NumPy implementations.',
+        add_help=True
+    )
+    parser.add_argument('--rtol',
+                        type=float,
+                        default=1e-8,
+                        help='relative tolerance of the values (default: %(default)s)')
+    args = parser.parse_args()
+
+    if not kernels.has_numba():
+        print("numba is not installed; nothing to check")
+        return
+
+    failed = []
+    for name, func in checks():
+        ref, t_ref = timed_call(func, backend="numpy")
+        ret, t_ret = timed_call(func, backend="numba")
+        if ret.shape != ref.shape:
+            ok, err = False, np.inf
+        else:
+            ok = np.allclose(ret, ref, rtol=args.rtol, atol=0)
+            err = np.max(np.abs(ret - ref) / np.maximum(np.abs(ref), 1e-300))
+        if not ok:
+            failed.append(name)
+        print(f"{name}: {'ok' if ok else 'MISMATCH'} (max relative error {err:.2e}), "
+              f"numpy {t_ref:.4f} sec, numba {t_ret:.4f} sec", flush=True)
+
+    if failed:
+        print(f"{len(failed)} checks failed")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+import argparse
+import json
+import sys
+
+
+# compare two results of `run.py`, e.g. before and after a change
+
+
+def load(filename):
+    with open(filename, "r") as f:
+        d = json.load(f)
+    return d, {r["id"]: r for r in d["results"]}
+
+
+def label(d):
+    commit = (d["commit"] or "unknown")[:10]
+    return commit + (" (dirty)" if d["dirty"] else "")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Compare two benchmark results written by `run.py`. The ratio is new / old of the minimum time; a ratio above 1 is slower.',
+        add_help=True
+    )
+    parser.add_argument('old', help='JSON file of the baseline')
+    parser.add_argument('new', help='JSON file to be compared')
+    parser.add_argument('--threshold',
+                        type=float,
+                        default=0.1,
+                        help='cases slower by more than this fraction are reported as regressions (default: %(default)s)')
+    parser.add_argument('--fail',
+                        action='store_true',
+                        help='exit with status 1 if there is a regression')
+    args = parser.parse_args()
+
+    d_old, old = load(args.old)
+    d_new, new = load(args.new)
+    print(f"old: {label(d_old)}, new: {label(d_new)}")
+    if d_old["machine"] != d_new["machine"]:
+        print("warning: the results are measured on different machines")
+
+    regressions = []
+    width = max([len(k) for k in new] + [4])
+    print(f"{'case':<{width}}  {'old [s]':>10}  {'new [s]':>10}  {'ratio':>6}  {'memory ratio':>12}")
+    for cid, r in new.items():
+        if cid not in old:
+            print(f"{cid:<{width}}  {'-':>10}  {r['min']:>10.4f}")
+            continue
+        ratio = r["min"] / old[cid]["min"]
+        mem_ratio = r["peak_memory_mb"] / max(old[cid]["peak_memory_mb"], 1e-6)
+        mark = ""
+        if ratio > 1 + args.threshold:
+            mark = "  slower"
+            regressions.append(cid)
+        elif ratio < 1 / (1 + args.threshold):
+            mark = "  faster"
+        print(f"{cid:<{width}}  {old[cid]['min']:>10.4f}  {r['min']:>10.4f}  {ratio:>6.2f}  {mem_ratio:>12.2f}{mark}")
+
+    if regressions:
+        print(f"{len(regressions)} cases are slower by more than {args.threshold:.0%}")
+        if args.fail:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,227 @@
+import argparse
+import datetime
+import json
+import os
+import platform
+import re
+import subprocess
+import sys
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+import scipy
+
+# benchmarks are run from the source tree
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dnb_tool import kernels  # noqa: E402
+from dnb_tool.tabular.core import two_step, clustering, mad  # noqa: E402
+from dnb_tool.tabular.dnb import set_auto_params  # noqa: E402
+from dnb_tool.timeseries.dnb_ts import EWS_DNB, CPDotsu, CPD_EWS  # noqa: E402
+from synthetic import make_expression, make_hp_series, make_may_series  # noqa: E402
+
+
+# sizes of inputs for each preset
+# tables: (genes, samples in each group)
+# clustering: genes fed into `clustering` (all of them are clustered)
+# hp: grid size n of HP model (n * n features)
+# may: channels of May model
+# otsu: length of EWS
+# cpd: scope_range of CPD_EWS
+PRESETS = {
+    "quick": {
+        "tables": [(1000, 20), (5000, 100)],
+        "clustering": [500, 2000],
+        "hp": [5, 10],
+        "may": [4],
+        "otsu": [1000, 10000],
+        "cpd": [500],
+    },
+    "full": {
+        "tables": [(1000, 20), (10000, 20), (10000, 200), (50000, 200), (50000, 1000)],
+        "clustering": [500, 2000, 5000, 10000],
+        "hp": [5, 10, 20],
+        "may": [4, 16],
+        "otsu": [1000, 10000, 100000],
+        "cpd": [500, 1000],
+    },
+}
+
+
+# inputs are generated once and shared among cases
+_inputs = {}
+
+
+def cached(key, func, *args):
+    if key not in _inputs:
+        _inputs[key] = func(*args)
+    return _inputs[key]
+
+
+def cases(preset):
+    # yields (name, params, setup, func), where `func(*setup())` is timed
+    sizes = PRESETS[preset]
+    params_DNB = set_auto_params({})
+
+    for n_genes, n_samples in sizes["tables"]:
+        def setup(n_genes=n_genes, n_samples=n_samples):
+            return cached(("table", n_genes, n_samples), make_expression, n_genes, n_samples)
+        p = {"n_genes": n_genes, "n_samples": n_samples}
+        yield "mad", p, lambda setup=setup: (setup()[0],), mad
+        yield "two_step", p, setup, lambda e, c: two_step(e, c, **params_DNB)
+
+    for n_genes in sizes["clustering"]:
+        def setup(n_genes=n_genes):
+            return (cached(("table", n_genes, 20), make_expression, n_genes, 20)[0],)
+        yield "clustering", {"n_genes": n_genes, "n_samples": 20}, setup, \
+            lambda e: clustering(e, **params_DNB)
+
+    for n in sizes["hp"]:
+        def setup(n=n):
+            return (cached(("hp", n), make_hp_series, n),)
+        yield "EWS_DNB", {"model": "HP", "n_features": n * n, "window_size": 100}, setup, \
+            lambda x: EWS_DNB(x, window_size=100)
+        yield "EWS_DNB", {"model": "HP", "n_features": n * n, "window_size": 100,
+                          "estimator": "spearman"}, setup, \
+            lambda x: EWS_DNB(x, window_size=100, estimator="spearman")
+
+    for d in sizes["may"]:
+        def setup(d=d):
+            return (cached(("may", d), make_may_series, d),)
+        yield "EWS_DNB", {"model": "May", "n_features": d, "window_size": 1000}, setup, \
+            lambda x: EWS_DNB(x, window_size=1000)
+
+    # EWS of the smallest HP model, which is tiled to the length
+    def ews_hp():
+        x = cached(("hp", sizes["hp"][0]), make_hp_series, sizes["hp"][0])
+        return cached(("ews", sizes["hp"][0]), EWS_DNB, x, 100)
+
+    for length in sizes["otsu"]:
+        def setup(length=length):
+            return (np.resize(ews_hp(), length),)
+        yield "CPDotsu", {"length": length}, setup, CPDotsu
+
+    for scope_range in sizes["cpd"]:
+        for cfg in [{"type": "ohtsu"}, {"type": "linear"}, {"type": "ar", "dim": 2}]:
+            yield "CPD_EWS", {"scope_range": scope_range, **cfg}, lambda: (ews_hp(),), \
+                lambda ews, cfg=cfg, scope_range=scope_range: CPD_EWS(
+                    ews, cfg=cfg, scope_range=scope_range)
+
+
+def case_id(name, params):
+    return name + "[" + ",".join(f"{k}={v}" for k, v in params.items()) + "]"
+
+
+def measure(func, args, repeat, max_time):
+    # elapsed times of `repeat` runs (fewer if they exceed `max_time` seconds in total),
+    # and the peak memory allocated during a separate run.
+    # memory is traced in its own run because tracing slows down the computation.
+    times = []
+    for _ in range(repeat):
+        time_s = time.perf_counter()
+        func(*args)
+        times.append(time.perf_counter() - time_s)
+        if sum(times) > max_time:
+            break
+    tracemalloc.start()
+    func(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return times, peak / 1e6
+
+
+def git_commit():
+    # commit of the source tree, and whether it has uncommitted changes
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=root, capture_output=True,
+                                text=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=root,
+                               capture_output=True, text=True, check=True).stdout.strip() != ""
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+    return commit, dirty
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmarks of the tabular and time-series pipelines on synthetic data. Results are written to a JSON file, which is compared with another one by `compare.py`.',
+        add_help=True
+    )
+    parser.add_argument('--preset',
+                        default="quick",
+                        choices=list(PRESETS),
+                        help='sizes of the inputs (default: %(default)s)')
+    parser.add_argument('--filter',
+                        default=None,
+                        help='run only the cases whose id (e.g. "two_step[n_genes=1000,n_samples=20]") matches this regular expression')
+    parser.add_argument('--repeat',
+                        type=int,
+                        default=5,
+                        help='the number of runs of each case (default: %(default)s)')
+    parser.add_argument('--max_time',
+                        type=float,
+                        default=10,
+                        help='stop repeating a case after this many seconds (default: %(default)s)')
+    parser.add_argument('--backend',
+                        default="numpy",
+                        choices=["numpy", "numba", "auto"],
+                        help='backend of the time-series kernels, set as DNB_BACKEND (default: %(default)s)')
+    parser.add_argument('--output',
+                        default=None,
+                        help='output JSON file (default: benchmarks/results/{commit}.json)')
+    args = parser.parse_args()
+    # functions called without `backend=` use the environment variable
+    os.environ[kernels.BACKEND_ENV] = args.backend
+
+    commit, dirty = git_commit()
+    results = []
+    for name, params, setup, func in cases(args.preset):
+        cid = case_id(name, params)
+        if args.filter is not None and re.search(args.filter, cid) is None:
+            continue
+        times, peak = measure(func, setup(), args.repeat, args.max_time)
+        results.append({
+            "id": cid,
+            "name": name,
+            "params": params,
+            "times": times,
+            "min": min(times),
+            "median": float(np.median(times)),
+            "peak_memory_mb": peak,
+        })
+        print(f"{cid}: {min(times):.4f} sec (min of {len(times)}), {peak:.1f} MB", flush=True)
+
+    output = args.output
+    if output is None:
+        dirname = os.path.join(os.path.dirname(
+            os.path.abspath(__file__)), "results")
+        os.makedirs(dirname, exist_ok=True)
+        output = os.path.join(dirname, f"{(commit or 'unknown')[:10]}.json")
+    with open(output, "w") as f:
+        json.dump({
+            "commit": commit,
+            "dirty": dirty,
+            "date": datetime.datetime.now().isoformat(timespec="seconds"),
+            "preset": args.preset,
+            "backend": kernels.resolve_backend(args.backend),
+            "machine": {
+                "platform": platform.platform(),
+                "processor": platform.processor(),
+                "cpu_count": os.cpu_count(),
+            },
+            "versions": {
+                "python": platform.python_version(),
+                "numpy": np.__version__,
+                "pandas": pd.__version__,
+                "scipy": scipy.__version__,
+                "numba": kernels.numba.__version__ if kernels.has_numba() else None,
+            },
+            "results": results,
+        }, f, indent=2)
+    print(f"Output file is \"{output}\"")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,41 @@
+import numpy as np
+import pandas as pd
+
+from dnb_tool.datasets import HP_model, May_model
+
+
+# synthetic inputs for benchmarks
+
+
+def make_expression(n_genes, n_samples, n_clusters=3, cluster_size=50, seed=0):
+    # expression tables of the control and the experimental groups (genes x samples).
+    # all genes are standard normal noise, except for `n_clusters` planted DNB clusters
+    # of `cluster_size` genes, which fluctuate together with a large amplitude
+    # in the experimental group.
+    # returns df_expr, df_ctrl
+    rng = np.random.default_rng(seed)
+    ctrl = rng.standard_normal((n_genes, n_samples))
+    expr = rng.standard_normal((n_genes, n_samples))
+    genes = rng.permutation(n_genes)[:n_clusters * cluster_size]
+    for rows in genes.reshape(n_clusters, cluster_size):
+        # a common factor for the cluster, plus noise of each gene
+        factor = 4 * rng.standard_normal(n_samples)
+        expr[rows] += factor[None, :] + \
+            0.5 * rng.standard_normal((len(rows), n_samples))
+    index = pd.Index([f"gene_{i:06d}" for i in range(n_genes)], name="Symbol")
+    df_expr = pd.DataFrame(expr, index=index,
+                           columns=[f"expr_{i}" for i in range(n_samples)])
+    df_ctrl = pd.DataFrame(ctrl, index=index,
+                           columns=[f"ctrl_{i}" for i in range(n_samples)])
+    return df_expr, df_ctrl
+
+
+def make_hp_series(n, seed=0):
+    # spatial harvested population model on n x n grid, (10000, n * n) array
+    _, x, _ = HP_model.get_data(n=n, sigma=0.1, seed=seed)
+    return x
+
+
+def make_may_series(d, seed=0):
+    # `d` independent realizations of the May model as channels, (100000, d) array
+    return np.stack([May_model.get_data(seed=seed + i)[1] for i in range(d)], axis=1)
@@ -2,7 +2,11 @@
 # van Nes, Egbert H., and Marten Scheffer. "Implications of spatial heterogeneity for catastrophic regime shifts in ecosystems." Ecology 86.7 (2005): 1797-1807.
 import numpy as np
 import matplotlib.pyplot as plt
-import tqdm
+
+from .. import kernels
+from ..instrument import get_logger, progress
+
+logger = get_logger(__name__)
 
 
 def f(x, c):
@@ -14,7 +18,8 @@ def ddx(X, dx):
     return dx*(np.roll(X, 1, axis=0) + np.roll(X, 1, axis=1) + np.roll(X, -1, axis=0) + np.roll(X, -1, axis=1) - 4 * X)
 
 
-def get_data(n=20, sigma=0.1, seed=0):
+def get_data(n=20, sigma=0.1, seed=0, backend=None):
+    # backend: "numpy", "numba" or "auto" (see `kernels`)
     np.random.seed(seed)
 
     dt = 0.1
@@ -34,11 +39,14 @@ def get_data(n=20, sigma=0.1, seed=0):
         x0[x0 < 0] = 0
 
     x[0] = x0
-    print('Generating time-series data of a harvested_population model')
-    for k in tqdm.tqdm(range(times.shape[0]-1)):
-        x[k+1] = x[k] + dt * (f(x[k], c[k]) + ddx(x[k], dx)
-                              ) + np.sqrt(dt)*omega[k]
-        x[k+1, x[k+1] < 0] = 0
+    logger.info('Generating time-series data of a harvested_population model')
+    if kernels.resolve_backend(backend) == "numba":
+        x = kernels.simulate_hp(x0, c, omega, dt, dx)
+    else:
+        for k in progress(range(times.shape[0]-1)):
+            x[k+1] = x[k] + dt * (f(x[k], c[k]) + ddx(x[k], dx)
+                                  ) + np.sqrt(dt)*omega[k]
+            x[k+1, x[k+1] < 0] = 0
 
     y = np.zeros(times.shape[0])
     y[c > 2.604] = 1
@@ -2,7 +2,11 @@
 # May, Robert M. "Thresholds and breakpoints in ecosystems with a multiplicity of stable states." Nature 269.5628 (1977): 471-477.
 import numpy as np
 import matplotlib.pyplot as plt
-import tqdm
+
+from .. import kernels
+from ..instrument import get_logger, progress
+
+logger = get_logger(__name__)
 
 
 def f(x, p):
@@ -10,7 +14,8 @@ def f(x, p):
     return x*(1 - x/K) - p*(x**2)/(x**2 + 1)
 
 
-def get_data(sigma=0.01, seed=0):
+def get_data(sigma=0.01, seed=0, backend=None):
+    # backend: "numpy", "numba" or "auto" (see `kernels`)
     np.random.seed(seed)
     T = 1000
     dt = 0.01
@@ -26,13 +31,16 @@ def get_data(sigma=0.01, seed=0):
         if x0 < 0:
             x0 = 0
 
-    x = np.zeros((times.shape[0]))
-    x[0] = x0
-    print('Generating time-series data of the May model')
-    for t in tqdm.tqdm(range(times.shape[0] - 1)):
-        x[t+1] = x[t] + dt * (f(x[t], p[t])) + np.sqrt(dt)*omega[t]
-        if x[t+1] < 0:
-            x[t+1] = 0
+    logger.info('Generating time-series data of the May model')
+    if kernels.resolve_backend(backend) == "numba":
+        x = kernels.simulate_may(x0, p, omega, dt)
+    else:
+        x = np.zeros((times.shape[0]))
+        x[0] = x0
+        for t in progress(range(times.shape[0] - 1)):
+            x[t+1] = x[t] + dt * (f(x[t], p[t])) + np.sqrt(dt)*omega[t]
+            if x[t+1] < 0:
+                x[t+1] = 0
 
     y = np.zeros(x.shape[:2])
     y[p > 2.604] = 1
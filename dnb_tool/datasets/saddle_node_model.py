@@ -1,12 +1,17 @@
 import numpy as np
-import tqdm
+
+from .. import kernels
+from ..instrument import get_logger, progress
+
+logger = get_logger(__name__)
 
 
 def f(x, p):
     return x - 1/3 * (x**3) + p
 
 
-def get_data(sigma=0.01, seed=0):
+def get_data(sigma=0.01, seed=0, backend=None):
+    # backend: "numpy", "numba" or "auto" (see `kernels`)
     np.random.seed(seed)
 
     T = 1000
@@ -21,12 +26,14 @@ def get_data(sigma=0.01, seed=0):
     for t in range(times.shape[0]//10):
         x0 = x0 + dt * (f(x0, p[0]))
 
-    x = np.zeros((times.shape[0]))
-    x[0] = x0
-
-    print('Generating time-series data of a simple saddle node model.')
-    for t in tqdm.tqdm(range(times.shape[0] - 1)):
-        x[t+1] = x[t] + dt * (f(x[t], p[t])) + np.sqrt(dt)*omega[t]
+    logger.info('Generating time-series data of a simple saddle node model.')
+    if kernels.resolve_backend(backend) == "numba":
+        x = kernels.simulate_saddle_node(x0, p, omega, dt)
+    else:
+        x = np.zeros((times.shape[0]))
+        x[0] = x0
+        for t in progress(range(times.shape[0] - 1)):
+            x[t+1] = x[t] + dt * (f(x[t], p[t])) + np.sqrt(dt)*omega[t]
 
     y = np.zeros(x.shape[:2])
     y[p > 2/3] = 1
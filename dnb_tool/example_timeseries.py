@@ -7,6 +7,7 @@ import os
 from dnb_tool.datasets import saddle_node_model
 from dnb_tool.datasets import May_model
 from dnb_tool.datasets import HP_model
+from dnb_tool.instrument import setup_logging
 
 
 def main():
@@ -27,6 +28,8 @@ def main():
                         action="store_true",
                         help='A spatial harvested population model')
     args = parser.parse_args()
+    # show messages and progress bars of data generation
+    setup_logging()
 
     model = None
     if args.saddle_node:
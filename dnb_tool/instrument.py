@@ -0,0 +1,186 @@
+import contextlib
+import contextvars
+import functools
+import json
+import logging
+import sys
+import threading
+import time
+import pandas as pd
+import tqdm
+
+
+# instrumentation of the analysis.
+#
+# messages are written with `logging` under the "dnb_tool" logger.
+# library calls are quiet by default (a `NullHandler` is attached),
+# and the command line tools configure a handler by `setup_logging`.
+#
+# metrics (timings of stages, peak memory and counts such as the number of genes)
+# are collected by a `Recorder` activated by `set_recorder`.
+# without an active recorder, nothing is recorded.
+
+logger = logging.getLogger("dnb_tool")
+logger.addHandler(logging.NullHandler())
+
+
+# whether messages below warnings and metrics are suppressed in the current context (`quiet`).
+# a context variable, so that a block of a thread (or a task) does not silence the others.
+_quiet = contextvars.ContextVar("dnb_tool_quiet", default=False)
+
+
+class QuietFilter(logging.Filter):
+    # drops messages below warnings in `quiet` blocks
+    def filter(self, record):
+        return record.levelno >= logging.WARNING or not _quiet.get()
+
+
+_quiet_filter = QuietFilter()
+logger.addFilter(_quiet_filter)
+
+
+def get_logger(name):
+    # logger of a module, e.g. get_logger(__name__)
+    ret = logging.getLogger(name)
+    # filters of a logger apply only to its own messages, so each logger has one
+    if _quiet_filter not in ret.filters:
+        ret.addFilter(_quiet_filter)
+    return ret
+
+
+def setup_logging(quiet=False, verbose=False):
+    # write messages of "dnb_tool" to stderr (used by the command line tools)
+    # quiet: only warnings and errors
+    # verbose: also debug messages (e.g. timings of each stage)
+    level = logging.WARNING if quiet else logging.DEBUG if verbose else logging.INFO
+    handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(handler)
+    logger.setLevel(level)
+    return handler
+
+
+def peak_memory_mb():
+    # peak resident set size of this process in MB.
+    # None where it is not available (the `resource` module is only on Unix)
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kilobytes on Linux
+    return rss / 1e6 if sys.platform == "darwin" else rss / 1e3
+
+
+class Recorder:
+    # collects metrics as records (dictionaries).
+    # each record has "event" and "time" (seconds from the start of the recorder),
+    # the fields given by `context`, and the values of the event.
+    #
+    # callbacks: functions called with each record, e.g. to send metrics to a monitoring system
+
+    def __init__(self, callbacks=None):
+        self.records = []
+        self.callbacks = list(callbacks or [])
+        self.start = time.perf_counter()
+        self.lock = threading.Lock()
+
+    def add_callback(self, callback):
+        self.callbacks.append(callback)
+
+    def record(self, event, **values):
+        rec = {"event": event,
+               "time": time.perf_counter() - self.start}
+        rec.update(_context.get())
+        rec.update(values)
+        with self.lock:
+            self.records.append(rec)
+        for callback in self.callbacks:
+            callback(rec)
+        return rec
+
+    def to_frame(self):
+        return pd.DataFrame(self.records)
+
+    def write(self, filename):
+        # write records to ".json" (a list of records) or ".csv" (a row for each record)
+        if filename.endswith(".json"):
+            with open(filename, "w") as f:
+                json.dump(self.records, f, indent=2, default=str)
+        else:
+            self.to_frame().to_csv(filename, index=False)
+
+
+# the active recorder and the fields added to records
+_recorder = None
+_context = contextvars.ContextVar("dnb_tool_context", default={})
+
+
+def set_recorder(recorder):
+    # activate `recorder` (None to deactivate) and return the previous one
+    global _recorder
+    prev, _recorder = _recorder, recorder
+    return prev
+
+
+def get_recorder():
+    return _recorder
+
+
+def record(event, **values):
+    # record values of an event (e.g. counts) to the active recorder
+    if _recorder is not None and not _quiet.get():
+        _recorder.record(event, **values)
+
+
+@contextlib.contextmanager
+def context(**fields):
+    # fields added to the records in this block, e.g. context(time_point=k)
+    token = _context.set({**_context.get(), **fields})
+    try:
+        yield
+    finally:
+        _context.reset(token)
+
+
+@contextlib.contextmanager
+def stage(name, **values):
+    # measure the elapsed time of a stage.
+    # the record has "elapsed" (seconds) and "peak_memory_mb" (peak of the process so far, None if unknown).
+    if _quiet.get() or (_recorder is None and not logger.isEnabledFor(logging.DEBUG)):
+        yield
+        return
+    time_s = time.perf_counter()
+    yield
+    elapsed = time.perf_counter() - time_s
+    logger.debug(f"{name}: {elapsed:.3f} sec")
+    record(name, elapsed=elapsed, peak_memory_mb=peak_memory_mb(), **values)
+
+
+def timed(name):
+    # decorator version of `stage`
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+@contextlib.contextmanager
+def quiet():
+    # suppress messages below warnings and metrics in this block,
+    # e.g. for the repeated calls in bootstrap and in worker processes.
+    # only the current thread (or task) is affected.
+    token = _quiet.set(True)
+    try:
+        yield
+    finally:
+        _quiet.reset(token)
+
+
+def progress(iterable, **kwargs):
+    # progress bar shown only when messages are enabled
+    disable = _quiet.get() or not logger.isEnabledFor(logging.INFO)
+    return tqdm.tqdm(iterable, disable=disable, **kwargs)
@@ -0,0 +1,175 @@
+import os
+import numpy as np
+
+from .instrument import get_logger
+
+logger = get_logger(__name__)
+
+
+# compiled kernels of the inner loops (requires numba).
+# the backend is selected by `backend=` argument of the functions that use the kernels,
+# or by the environment variable DNB_BACKEND when the argument is None:
+#   "numpy": pure NumPy implementations (reference)
+#   "numba": kernels compiled by numba; windows (or thresholds) are processed in parallel
+#   "auto": "numba" if numba is installed, otherwise "numpy"
+# the kernels compute the same values as the NumPy implementations up to rounding errors,
+# which is checked by `tests/test_backends.py` and `benchmarks/check_backends.py`.
+BACKENDS = ("numpy", "numba", "auto")
+BACKEND_ENV = "DNB_BACKEND"
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+
+def has_numba():
+    return numba is not None
+
+
+def resolve_backend(backend=None):
+    # returns "numpy" or "numba"
+    if backend is None:
+        backend = os.environ.get(BACKEND_ENV, "numpy")
+    if backend not in BACKENDS:
+        raise NameError('select \'numpy\', \'numba\', or \'auto\' as backend')
+    if backend == "auto":
+        return "numba" if has_numba() else "numpy"
+    if backend == "numba" and not has_numba():
+        raise ImportError(
+            'numba is required for backend \'numba\'. Install numba, or select \'numpy\' or \'auto\'.')
+    return backend
+
+
+if numba is not None:
+
+    ########
+    #### sliding statistics ####
+    ########
+
+    @numba.njit(parallel=True, cache=True)
+    def sliding_lambda_max(x, window_size, block_size):
+        # the same as `dnb_ts.sliding_lambda_max` for 2 dim input.
+        # blocks of windows are processed in parallel; in each block, the sums and the cross products
+        # of the first window are updated by the entering and the leaving samples, as `dnb_ts.block_cov`.
+        T, d = x.shape
+        n = T - window_size + 1
+        n_blocks = (n + block_size - 1) // block_size
+        ret = np.zeros(n)
+        for b in numba.prange(n_blocks):
+            s = b * block_size
+            e = min(n, s + block_size)
+            # segment shifted by its mean
+            seg = x[s:e + window_size - 1].copy()
+            mu = np.zeros(d)
+            for t in range(seg.shape[0]):
+                mu += seg[t]
+            mu /= seg.shape[0]
+            for t in range(seg.shape[0]):
+                seg[t] -= mu
+            S = np.zeros(d)
+            P = np.zeros((d, d))
+            for t in range(window_size):
+                for i in range(d):
+                    S[i] += seg[t, i]
+                    for j in range(d):
+                        P[i, j] += seg[t, i] * seg[t, j]
+            cov = np.empty((d, d))
+            for k in range(e - s):
+                if k > 0:
+                    a = k + window_size - 1
+                    r = k - 1
+                    for i in range(d):
+                        S[i] += seg[a, i] - seg[r, i]
+                        for j in range(d):
+                            P[i, j] += seg[a, i] * seg[a, j] - \
+                                seg[r, i] * seg[r, j]
+                for i in range(d):
+                    for j in range(d):
+                        cov[i, j] = (P[i, j] - S[i] * S[j] /
+                                     window_size) / (window_size - 1)
+                ret[s + k] = np.linalg.eigvalsh(cov)[-1]
+        return ret
+
+    ########
+    #### Otsu's method ####
+    ########
+
+    @numba.njit(parallel=True, cache=True)
+    def otsu_scores(data, ths):
+        # between-class variance of `data` for each threshold, as `OtsuScore` of `dnb_ts.CPDotsu`
+        n = data.shape[0]
+        mean_all = data.mean()
+        scores = np.zeros(ths.shape[0])
+        for i in numba.prange(ths.shape[0]):
+            n_0 = 0
+            sum_0 = 0.0
+            sum_1 = 0.0
+            for t in range(n):
+                if data[t] <= ths[i]:
+                    n_0 += 1
+                    sum_0 += data[t]
+                else:
+                    sum_1 += data[t]
+            n_1 = n - n_0
+            # check ideal case
+            if n_0 == 0 or n_1 == 0:
+                continue
+            scores[i] = n_0 / n * (sum_0 / n_0 - mean_all) ** 2 + \
+                n_1 / n * (sum_1 / n_1 - mean_all) ** 2
+        return scores
+
+    ########
+    #### simulators ####
+    ########
+
+    # the models are written again here, since the kernels cannot call the Python functions
+    # of the `datasets` modules
+
+    @numba.njit(cache=True)
+    def simulate_may(x0, p, omega, dt):
+        # `datasets.May_model`, x[t+1] = x[t] + dt * f(x[t], p[t]) + sqrt(dt) * omega[t] (clipped at 0)
+        K = 10
+        x = np.zeros(p.shape[0])
+        x[0] = x0
+        for t in range(p.shape[0] - 1):
+            v = x[t] + dt * (x[t] * (1 - x[t] / K) - p[t] * (x[t] ** 2) /
+                             (x[t] ** 2 + 1)) + np.sqrt(dt) * omega[t]
+            x[t + 1] = v if v > 0 else 0.0
+        return x
+
+    @numba.njit(cache=True)
+    def simulate_saddle_node(x0, p, omega, dt):
+        # `datasets.saddle_node_model`, x[t+1] = x[t] + dt * f(x[t], p[t]) + sqrt(dt) * omega[t]
+        x = np.zeros(p.shape[0])
+        x[0] = x0
+        for t in range(p.shape[0] - 1):
+            x[t + 1] = x[t] + dt * (x[t] - 1 / 3 * (x[t] ** 3) + p[t]) + \
+                np.sqrt(dt) * omega[t]
+        return x
+
+    @numba.njit(parallel=True, cache=True)
+    def simulate_hp(x0, c, omega, dt, dx):
+        # `datasets.HP_model` on n x n periodic grid; rows of the grid are updated in parallel
+        K = 10
+        T = c.shape[0]
+        n = x0.shape[0]
+        x = np.zeros((T, n, n))
+        x[0] = x0
+        for k in range(T - 1):
+            for i in numba.prange(n):
+                for j in range(n):
+                    v = x[k, i, j]
+                    lap = x[k, (i - 1) % n, j] + x[k, i, (j - 1) % n] + \
+                        x[k, (i + 1) % n, j] + x[k, i, (j + 1) % n] - 4 * v
+                    v = v + dt * (v * (1 - v / K) - c[k] * (v ** 2) / (1 + v ** 2) + dx * lap) + \
+                        np.sqrt(dt) * omega[k, i, j]
+                    x[k + 1, i, j] = v if v > 0 else 0.0
+        return x
+
+
+def numba_block_size(n):
+    # blocks of windows for the parallel kernels: several blocks for each thread,
+    # and not too long, since the updates of each block accumulate rounding errors
+    n_threads = numba.get_num_threads() if numba is not None else 1
+    return max(1, min(1024, -(-n // (4 * n_threads))))
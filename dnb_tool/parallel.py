@@ -0,0 +1,47 @@
+import numpy as np
+from multiprocessing import shared_memory
+
+
+# arrays shared with worker processes through shared memory
+
+
+class SharedArray:
+    # a copy of array in shared memory, which is attached by worker processes without copying
+    def __init__(self, arr):
+        arr = np.ascontiguousarray(arr, dtype=float)
+        self.shm = shared_memory.SharedMemory(
+            create=True, size=max(arr.nbytes, 1))
+        self.shape, self.dtype = arr.shape, arr.dtype
+        np.ndarray(self.shape, dtype=self.dtype, buffer=self.shm.buf)[:] = arr
+
+    def spec(self):
+        # picklable description passed to workers
+        return self.shm.name, self.shape, self.dtype.str
+
+    def close(self):
+        self.shm.close()
+        self.shm.unlink()
+
+
+# arrays attached in this process
+_attached = {}
+
+
+def attach(specs):
+    # initializer of worker processes
+    # specs: dictionary of key -> `SharedArray.spec()`
+    for key, (name, shape, dtype) in specs.items():
+        shm = shared_memory.SharedMemory(name=name)
+        _attached[key] = (shm, np.ndarray(
+            shape, dtype=np.dtype(dtype), buffer=shm.buf))
+
+
+def get_attached(key):
+    return _attached[key][1]
+
+
+def detach(keys):
+    for key in keys:
+        shm, _ = _attached.pop(key, (None, None))
+        if shm is not None:
+            shm.close()
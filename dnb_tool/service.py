@@ -0,0 +1,379 @@
+import argparse
+import asyncio
+import collections
+import json
+import socket
+import threading
+import time
+import numpy as np
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+
+from .instrument import get_logger, setup_logging
+from .tabular.core import cut_tree, deviation_array, linkage_array, preprocess, select_clusters
+from .tabular.dnb import set_auto_params
+from .tabular.read_files import read_csv_and_select, read_csv_and_split
+from .timeseries.dnb_ts import CPD_EWS, normalize, pad_ews, sliding_lambda_max
+
+logger = get_logger("dnb_tool.service")
+
+
+# a long-running service that keeps datasets in memory and answers DNB/EWS queries.
+#
+# the protocol is JSON lines: each request is a JSON object in a line,
+# {"op": ..., "id": ..., parameters...}, and the response is
+# {"id": ..., "ok": true, "result": ..., "elapsed": seconds} or {"id": ..., "ok": false, "error": message}.
+# requests are processed concurrently by a thread pool (numpy and scipy release the GIL),
+# so responses of a connection may come in a different order than the requests.
+#
+# intermediate products are cached for each dataset:
+# tabular: deviations, preprocessed values (ranks), Step 1 selections and linkage trees,
+#   so that changing linkage_threshold or thres_cluster_selection only cuts the cached tree.
+# time series: the maximum eigenvalue of sliding covariance for each window size and normalization.
+# at most `memo_size` intermediate products are kept for each dataset, and the least recently used
+# ones are dropped, so that queries with many different parameters do not grow the memory without bound.
+
+DEFAULT_ADDRESS = "127.0.0.1:8765"
+# the default number of intermediate products kept for each dataset
+MEMO_SIZE = 16
+
+
+def parse_address(address):
+    # "unix:/path/to/socket" or "host:port"
+    if address.startswith("unix:"):
+        return "unix", address[len("unix:"):]
+    host, port = address.rsplit(":", 1)
+    return "tcp", (host, int(port))
+
+
+class Memo:
+    # values computed once for each key, even when they are requested concurrently.
+    # max_size: the number of values kept. when exceeded, the least recently used values are dropped
+    #   and computed again when they are requested. if None, all values are kept.
+
+    def __init__(self, max_size=None):
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.values = collections.OrderedDict()
+        self.locks = {}
+
+    def lookup(self, key):
+        # (True, value) if the value is kept, otherwise (False, None). called with `self.lock`
+        if key not in self.values:
+            return False, None
+        self.values.move_to_end(key)
+        return True, self.values[key]
+
+    def get(self, key, func):
+        with self.lock:
+            found, value = self.lookup(key)
+            if found:
+                return value
+            lock = self.locks.setdefault(key, threading.Lock())
+        with lock:
+            with self.lock:
+                found, value = self.lookup(key)
+                if found:
+                    return value
+            value = func()
+            with self.lock:
+                self.values[key] = value
+                self.locks.pop(key, None)
+                while self.max_size is not None and len(self.values) > self.max_size:
+                    self.values.popitem(last=False)
+        return value
+
+
+def frame_to_json(df):
+    return {"columns": list(df.columns), "data": df.to_numpy().tolist()}
+
+
+def frame_from_json(d):
+    return pd.DataFrame(d["data"], columns=d["columns"])
+
+
+class TableDataset:
+    # control and experimental groups of a tabular dataset
+    # memo_size: the number of intermediate products kept (see `Memo`)
+
+    def __init__(self, df_e, df_c, memo_size=MEMO_SIZE):
+        # the minimum number of measurement is 4, as in `two_step`
+        if df_e.shape[1] < 4:
+            raise ValueError(
+                'experimental group has less than 4 samples. Check the input files and settings.')
+        if df_c.shape[1] < 4:
+            raise ValueError(
+                'control group has less than 4 samples. Check the input files and settings.')
+        self.index = df_e.index
+        self.arr_e = df_e.to_numpy(dtype=float)
+        self.arr_c = df_c.reindex(df_e.index).to_numpy(dtype=float)
+        self.memo = Memo(memo_size)
+
+    def info(self):
+        return {"type": "table", "n_genes": self.arr_e.shape[0],
+                "n_experimental": self.arr_e.shape[1], "n_control": self.arr_c.shape[1]}
+
+    def deviations(self, metric):
+        return self.memo.get(("deviation", metric), lambda: (
+            deviation_array(self.arr_e, metric), deviation_array(self.arr_c, metric)))
+
+    def preprocessed(self, linkage_metric):
+        # ranks are calculated for each row, so those of all genes are shared by any selection
+        return self.memo.get(("preprocess", linkage_metric), lambda: preprocess(
+            self.arr_e, linkage_metric=linkage_metric))
+
+    def tree(self, params):
+        # positions of genes that passed the 1st step, their linkage tree and preprocessed values
+        key = ("tree", params["deviation_metric"], params["thres_gene_filtering"],
+               params["linkage_metric"], params["linkage_method"], params["min_overlap"])
+
+        def func():
+            dev_e, dev_c = self.deviations(params["deviation_metric"])
+            sub_pos = np.flatnonzero(
+                dev_e > params["thres_gene_filtering"] * dev_c)
+            if len(sub_pos) < 2:
+                return sub_pos, None, None
+            arr_x = self.preprocessed(params["linkage_metric"])[sub_pos]
+            return sub_pos, linkage_array(arr_x, **params), arr_x
+        return self.memo.get(key, func)
+
+    def dnb(self, params):
+        # the same result as `two_step`
+        params = set_auto_params(dict(params))
+        sub_pos, Z, arr_x = self.tree(params)
+        if Z is None:
+            df_ret = pd.DataFrame([], columns=["dnb", "cluster",
+                                  "clustersize", "dev_expr", "dev_ctrl"])
+        else:
+            dev_e, dev_c = self.deviations(params["deviation_metric"])
+            label_arr = cut_tree(Z, **params)
+            df_ret, _ = select_clusters(self.index[sub_pos], label_arr, arr_x,
+                                        dev_e[sub_pos], dev_c[sub_pos], **params)
+        if not params["output_metrics"]:
+            df_ret = df_ret[["dnb"]]
+        return df_ret
+
+
+class SeriesDataset:
+    # a multivariate time series (steps x features)
+    # memo_size: the number of intermediate products kept (see `Memo`)
+
+    def __init__(self, x, memo_size=MEMO_SIZE):
+        self.x = np.asarray(x, dtype=float)
+        self.memo = Memo(memo_size)
+
+    def info(self):
+        x = self.x.reshape(self.x.shape[0], -1)
+        return {"type": "series", "n_steps": x.shape[0], "n_features": x.shape[1]}
+
+    def ews(self, window_size, padding="online", normalization="straight"):
+        # the same result as `EWS_DNB`
+        cov_time_tmp = self.memo.get(("lambda_max", window_size, normalization), lambda: sliding_lambda_max(
+            normalize(self.x, normalization), window_size))
+        return pad_ews(cov_time_tmp, self.x.shape[0], window_size, padding)
+
+
+class DNBService:
+    # max_workers: the number of threads that process requests
+    # memo_size: the number of intermediate products kept for each dataset (see `Memo`)
+
+    def __init__(self, max_workers=None, memo_size=MEMO_SIZE):
+        self.datasets = {}
+        self.memo_size = memo_size
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    def dataset(self, name, cls):
+        if name not in self.datasets:
+            raise KeyError(f"dataset \"{name}\" is not loaded")
+        if not isinstance(self.datasets[name], cls):
+            raise TypeError(f"dataset \"{name}\" is not {cls.__name__}")
+        return self.datasets[name]
+
+    #### operations ####
+
+    def op_ping(self):
+        return "pong"
+
+    def op_list(self):
+        return {name: d.info() for name, d in self.datasets.items()}
+
+    def op_load_table(self, name, filename, key_control, key_experimental,
+                      control_filename=None, orientation=None, conversion_cache=False):
+        # load an input file of `dnb_tabular`
+        if control_filename is not None:
+            df_c = read_csv_and_select(control_filename, key_control,
+                                       conversion_cache=conversion_cache)
+            df_e = read_csv_and_select(filename, key_experimental,
+                                       conversion_cache=conversion_cache, orientation=orientation)
+        else:
+            df_c, df_e = read_csv_and_split(filename, key_control, key_experimental,
+                                            conversion_cache=conversion_cache, orientation=orientation)
+        self.datasets[name] = TableDataset(df_e, df_c, memo_size=self.memo_size)
+        return self.datasets[name].info()
+
+    def op_load_series(self, name, filename):
+        # load an input file of `dnb_timeseries`
+        # (the 1st column is the index, the 2nd is time, and the rest are features)
+        x = pd.read_csv(filename, index_col=0).values[:, 1:]
+        self.datasets[name] = SeriesDataset(x, memo_size=self.memo_size)
+        return self.datasets[name].info()
+
+    def op_unload(self, name):
+        self.datasets.pop(name, None)
+        return None
+
+    def op_dnb(self, name, **params):
+        # parameters of `two_step`
+        return frame_to_json(self.dataset(name, TableDataset).dnb(params))
+
+    def op_ews(self, name, window_size, padding="online", normalization="straight",
+               cfg=None, scope_range=None, return_ews=True):
+        # EWS and, if `cfg` is given, the change point by `CPD_EWS`
+        ews = self.dataset(name, SeriesDataset).ews(
+            window_size, padding=padding, normalization=normalization)
+        ret = {}
+        if return_ews:
+            ret["ews"] = ews.tolist()
+        if cfg is not None:
+            ret["change_point"] = int(CPD_EWS(
+                ews, cfg=cfg, scope_range=np.inf if scope_range is None else scope_range))
+        return ret
+
+    def handle(self, request):
+        op = request.pop("op", None)
+        func = getattr(self, f"op_{op}", None)
+        if func is None:
+            raise ValueError(f"unknown operation \"{op}\"")
+        return func(**request)
+
+    #### server ####
+
+    async def process(self, line, writer, write_lock):
+        time_s = time.perf_counter()
+        response = {"id": None}
+        try:
+            request = json.loads(line)
+            response["id"] = request.pop("id", None)
+            result = await asyncio.get_running_loop().run_in_executor(
+                self.executor, self.handle, request)
+            response.update(ok=True, result=result)
+        except Exception as e:
+            response.update(ok=False, error=f"{type(e).__name__}: {e}")
+        response["elapsed"] = time.perf_counter() - time_s
+        async with write_lock:
+            writer.write((json.dumps(response, default=str) + "\n").encode())
+            await writer.drain()
+
+    async def serve_client(self, reader, writer):
+        write_lock = asyncio.Lock()
+        tasks = set()
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                task = asyncio.create_task(
+                    self.process(line, writer, write_lock))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            await asyncio.gather(*tasks)
+        finally:
+            writer.close()
+
+    async def serve(self, address=DEFAULT_ADDRESS):
+        kind, addr = parse_address(address)
+        # requests may contain long lists of parameters
+        limit = 1 << 24
+        if kind == "unix":
+            server = await asyncio.start_unix_server(self.serve_client, path=addr, limit=limit)
+        else:
+            server = await asyncio.start_server(self.serve_client, *addr, limit=limit)
+        logger.info(f"DNB service is listening on {address}")
+        async with server:
+            await server.serve_forever()
+
+
+class DNBClient:
+    # a client of `DNBService`
+    # e.g.
+    #   with DNBClient() as client:
+    #       client.load_table("t1", "input/sample_data_1.csv", "ctrl", "expr")
+    #       df = client.dnb("t1", linkage_threshold=0.8)
+
+    def __init__(self, address=DEFAULT_ADDRESS, timeout=None):
+        kind, addr = parse_address(address)
+        if kind == "unix":
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        else:
+            self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.settimeout(timeout)
+        self.sock.connect(addr)
+        self.file = self.sock.makefile("rwb")
+
+    def request(self, op, **params):
+        # send a request and wait for its response
+        self.file.write((json.dumps({"op": op, **params}) + "\n").encode())
+        self.file.flush()
+        response = json.loads(self.file.readline())
+        if not response["ok"]:
+            raise RuntimeError(response["error"])
+        return response["result"]
+
+    def load_table(self, name, filename, key_control, key_experimental, **kwargs):
+        return self.request("load_table", name=name, filename=filename,
+                            key_control=key_control, key_experimental=key_experimental, **kwargs)
+
+    def load_series(self, name, filename):
+        return self.request("load_series", name=name, filename=filename)
+
+    def dnb(self, name, **params):
+        return frame_from_json(self.request("dnb", name=name, **params))
+
+    def ews(self, name, window_size, **kwargs):
+        ret = self.request("ews", name=name, window_size=window_size, **kwargs)
+        if "ews" in ret:
+            ret["ews"] = np.array(ret["ews"])
+        return ret
+
+    def close(self):
+        self.file.close()
+        self.sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='This script runs a service that keeps datasets in memory and answers DNB and EWS queries (JSON lines over a socket).',
+        add_help=True
+    )
+    parser.add_argument('--address',
+                        default=DEFAULT_ADDRESS,
+                        help='"host:port" or "unix:/path/to/socket" (default: %(default)s)')
+    parser.add_argument('--workers',
+                        type=int,
+                        default=None,
+                        help='the number of threads that process requests (default: the number of CPUs + 4, up to 32)')
+    parser.add_argument('--memo_size',
+                        type=int,
+                        default=MEMO_SIZE,
+                        help='the number of intermediate products (e.g. linkage trees) kept for each dataset. the least recently used ones are dropped (default: %(default)s)')
+    parser.add_argument('--quiet',
+                        action='store_true',
+                        help='show only warnings and errors')
+    args = parser.parse_args()
+    setup_logging(quiet=args.quiet)
+
+    service = DNBService(max_workers=args.workers, memo_size=args.memo_size)
+    try:
+        asyncio.run(service.serve(args.address))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,287 @@
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+import pandas as pd
+
+from .instrument import get_logger
+from .tabular.output import write_json
+
+logger = get_logger(__name__)
+
+
+# sharded execution through a work directory shared by worker processes (possibly on several machines).
+# each input file is a work unit, and a unit is claimed by creating its lock file exclusively
+# (O_CREAT | O_EXCL is atomic also on NFS v3 and later), so any number of workers can cooperate
+# without a scheduler. the result of each unit is written to the work directory,
+# and the outputs are assembled in key order by the merge step.
+#
+# layout of the work directory:
+#   plan.json: the units (keys and filenames) and the parameters shared by all workers
+#   locks/{unit}.lock: claimed units, containing the worker id
+#   results/{unit}.{csv,json}: results of finished units
+#   merge.lock, merged.json: the merge step
+#
+# a claimed unit is kept alive by updating the modification time of its lock file.
+# a lock not updated for `lock_timeout` seconds (e.g. its worker crashed) is taken over by another worker.
+# the workers stay until the results are merged (`ShardDirectory.run`), polling the units
+# processed by the others, so that the unit (or the merge) of a crashed worker is taken over
+# by a live one.
+
+PLAN_FILENAME = "plan.json"
+
+
+def worker_name():
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+def create_exclusive(filename, content):
+    # create the file only if it does not exist. returns False if it already exists.
+    try:
+        fd = os.open(filename, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        return False
+    with os.fdopen(fd, "w") as f:
+        f.write(content)
+    return True
+
+
+class ShardDirectory:
+    # work_dir: directory shared by the workers
+    # keys, filenames: work units in key order
+    # params: parameters of the analysis. workers with different units or parameters are rejected.
+    # lock_timeout: seconds after which the lock of a unit not updated by its worker is taken over
+
+    def __init__(self, work_dir, keys, filenames, params, lock_timeout=600):
+        self.work_dir = work_dir
+        self.keys = list(keys)
+        self.filenames = list(filenames)
+        self.lock_timeout = lock_timeout
+        self.worker = worker_name()
+        for d in ["locks", "results"]:
+            os.makedirs(os.path.join(work_dir, d), exist_ok=True)
+        self.units = {str(k): f"{i:06d}" for i, k in enumerate(self.keys)}
+        self._check_plan(params)
+
+        self.held = set()
+        self.lock = threading.Lock()
+        self.stop = threading.Event()
+        self.heartbeat = threading.Thread(target=self._heartbeat, daemon=True)
+        self.heartbeat.start()
+
+    def _check_plan(self, params):
+        plan = {
+            "units": [{"key": str(k), "filename": f} for k, f in zip(self.keys, self.filenames)],
+            "params": json.loads(json.dumps(params, default=str)),
+        }
+        filename = os.path.join(self.work_dir, PLAN_FILENAME)
+        # the first worker writes the plan. it is written to a temporary file and linked,
+        # so that other workers never read a partial plan.
+        tmp = f"{filename}.{uuid.uuid4().hex}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(plan, f, indent=2)
+        try:
+            os.link(tmp, filename)
+            logger.info(
+                f"shard plan of {len(self.keys)} units is written to \"{filename}\"")
+            return
+        except FileExistsError:
+            pass
+        finally:
+            os.remove(tmp)
+        with open(filename, "r") as f:
+            existing = json.load(f)
+        if existing != plan:
+            raise ValueError(
+                f"the units or the parameters are different from the plan \"{filename}\". Use another work directory.")
+
+    def lock_path(self, key):
+        return os.path.join(self.work_dir, "locks", self.units[str(key)] + ".lock")
+
+    def result_path(self, key, suffix):
+        return os.path.join(self.work_dir, "results", self.units[str(key)] + suffix)
+
+    def is_done(self, key, suffix):
+        return os.path.exists(self.result_path(key, suffix))
+
+    def pending(self, suffix):
+        # keys of units whose results are not written yet
+        return [k for k in self.keys if not self.is_done(k, suffix)]
+
+    def claim(self, key, suffix):
+        # returns True if this worker is to process the unit
+        if self.is_done(key, suffix):
+            return False
+        lock = self.lock_path(key)
+        info = json.dumps({"worker": self.worker, "time": time.time()})
+        if not create_exclusive(lock, info):
+            if not self._take_over(lock):
+                return False
+            if not create_exclusive(lock, info):
+                return False
+        # the unit may have been finished between the check and the lock
+        if self.is_done(key, suffix):
+            return False
+        with self.lock:
+            self.held.add(lock)
+        return True
+
+    def _take_over(self, lock):
+        # remove a stale lock. only one worker succeeds in renaming it.
+        try:
+            age = time.time() - os.path.getmtime(lock)
+        except FileNotFoundError:
+            return True
+        if self.lock_timeout is None or age < self.lock_timeout:
+            return False
+        stale = f"{lock}.{uuid.uuid4().hex}.stale"
+        try:
+            os.rename(lock, stale)
+        except FileNotFoundError:
+            return False
+        # the lock may have been renewed just before it was renamed.
+        # it is restored only if no other worker has created a new lock in the meantime.
+        if time.time() - os.path.getmtime(stale) < self.lock_timeout:
+            try:
+                os.link(stale, lock)
+            except FileExistsError:
+                pass
+            os.remove(stale)
+            return False
+        os.remove(stale)
+        logger.warning(f"stale lock \"{lock}\" is taken over")
+        return True
+
+    def _heartbeat(self):
+        interval = 60 if self.lock_timeout is None else max(
+            1, self.lock_timeout / 4)
+        while not self.stop.wait(interval):
+            with self.lock:
+                held = list(self.held)
+            for lock in held:
+                try:
+                    os.utime(lock)
+                except FileNotFoundError:
+                    pass
+
+    def save(self, key, suffix, write):
+        # write the result of a claimed unit by `write(filename)`, then release the unit.
+        # the result is written to a temporary file and renamed, so that a result is always complete.
+        path = self.result_path(key, suffix)
+        tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+        write(tmp)
+        os.replace(tmp, path)
+        with self.lock:
+            self.held.discard(self.lock_path(key))
+
+    def is_merged(self):
+        return os.path.exists(os.path.join(self.work_dir, "merged.json"))
+
+    def claim_merge(self):
+        # returns True if this worker is to merge the results (only once in the work directory).
+        # the merge lock is kept alive as the locks of the units, and taken over when it is stale.
+        if self.is_merged():
+            return False
+        lock = os.path.join(self.work_dir, "merge.lock")
+        info = json.dumps({"worker": self.worker, "time": time.time()})
+        if not create_exclusive(lock, info):
+            if not self._take_over(lock) or not create_exclusive(lock, info):
+                return False
+        # the merge may have been finished between the check and the lock
+        if self.is_merged():
+            return False
+        with self.lock:
+            self.held.add(lock)
+        return True
+
+    def finish_merge(self, outputs):
+        write_json(os.path.join(self.work_dir, "merged.json"),
+                   {"worker": self.worker, "time": time.time(), "outputs": outputs})
+        with self.lock:
+            self.held.discard(os.path.join(self.work_dir, "merge.lock"))
+
+    def poll_interval(self):
+        # seconds between the checks of the units processed by the other workers
+        if self.lock_timeout is None:
+            return 10
+        return max(0.1, min(10, self.lock_timeout / 4))
+
+    def run(self, suffix, work, merge):
+        # process the units until all of them are finished, then merge the results.
+        # work(keys): processes (and saves) the units of `keys` claimed by this worker
+        # merge(): merges the results, returns the list of output filenames.
+        #   called by only one worker, after all units are finished.
+        # the worker polls the units processed by the others, and takes over those of crashed workers,
+        # until the results are merged (by this worker or another).
+        # returns True if this worker merged the results.
+        waiting = None
+        while True:
+            pending = self.pending(suffix)
+            if len(pending) > 0:
+                work(pending)
+                pending = self.pending(suffix)
+            if len(pending) == 0:
+                if self.claim_merge():
+                    logger.info(f"merge the results in \"{self.work_dir}\"")
+                    self.finish_merge(merge())
+                    return True
+                if self.is_merged():
+                    return False
+            if waiting != len(pending):
+                waiting = len(pending)
+                if waiting > 0:
+                    logger.info(
+                        f"{waiting} units are being processed by other workers in \"{self.work_dir}\"")
+                else:
+                    logger.info(
+                        f"the results are being merged by another worker in \"{self.work_dir}\"")
+            time.sleep(self.poll_interval())
+
+    def close(self):
+        self.stop.set()
+        self.heartbeat.join()
+
+
+class ShardWriter:
+    # the writer of `dnb_tb_iterate` in shard mode.
+    # a timepoint is processed only when it is claimed, and its result is written to the work directory.
+    # the results are assembled by `merge`, e.g.
+    #   shard = ShardWriter(ShardDirectory(work_dir, keys, filenames, params), columns)
+    #   shard.directory.run(shard.suffix,
+    #                       lambda pending: dnb_tb_iterate(pending, ..., writer=shard),
+    #                       lambda: shard.merge(ResultWriter(output_filename, params)))
+    #   shard.directory.close()
+
+    suffix = ".csv"
+
+    def __init__(self, directory, columns):
+        self.directory = directory
+        self.columns = columns
+
+    def claim(self, key):
+        return self.directory.claim(key, self.suffix)
+
+    def write(self, key, df):
+        df = df.reindex(columns=self.columns)
+        self.directory.save(key, self.suffix,
+                            lambda filename: df.to_csv(filename, index=False))
+
+    def pending(self):
+        return self.directory.pending(self.suffix)
+
+    def close(self):
+        # the result of each timepoint is already saved,
+        # and the directory is closed by its owner after `ShardDirectory.run`
+        pass
+
+    def merge(self, writer):
+        # write the results of all timepoints to `writer` (`ResultWriter`) in key order.
+        # returns the list of output filenames.
+        for key in self.directory.keys:
+            df = pd.read_csv(self.directory.result_path(key, self.suffix),
+                             dtype={"dnb": str, "time_point": str}, float_precision="round_trip")
+            writer.write(key, df)
+        writer.close()
+        return [writer.output_filename]
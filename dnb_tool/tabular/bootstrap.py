@@ -0,0 +1,160 @@
+import os
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from scipy import sparse
+
+from ..instrument import get_logger, quiet, stage
+from ..parallel import SharedArray, attach, detach, get_attached
+from .core import two_step
+from .dnb import set_auto_params
+from .read_files import read_csv_and_split, read_csv_and_select
+
+logger = get_logger(__name__)
+
+
+########
+#### bootstrap ####
+########
+
+def resample_two_step(seeds, kwargs_DNB):
+    # run `two_step` on bootstrap resamples of experimental and control samples
+    # seeds: `np.random.SeedSequence` for each resample (independent random streams)
+    # returns the list of (positions of DNB variables, cluster labels) for each resample
+    arr_e = get_attached("expr")
+    arr_c = get_attached("ctrl")
+    # variables are identified by their positions
+    index = pd.RangeIndex(arr_e.shape[0])
+    ret = []
+    for seed in seeds:
+        rng = np.random.default_rng(seed)
+        cols_e = rng.integers(0, arr_e.shape[1], arr_e.shape[1])
+        cols_c = rng.integers(0, arr_c.shape[1], arr_c.shape[1])
+        df_e = pd.DataFrame(arr_e[:, cols_e], index=index)
+        df_c = pd.DataFrame(arr_c[:, cols_c], index=index)
+        # ranks and correlations are calculated once in each resample and shared
+        # by clustering and the post analysis in `two_step`
+        with quiet():
+            dnb, _, _ = two_step(df_e, df_c, **kwargs_DNB)
+        ret.append((dnb["dnb"].to_numpy(dtype=int),
+                    dnb["cluster"].to_numpy(dtype=int)))
+    return ret
+
+
+def bootstrap_two_step(df_expr, df_ctrl, n_boot=100, n_jobs=1, seed=0, batch_size=None, **kwargs_DNB):
+    # stability of DNB variables by bootstrap.
+    # experimental and control samples are resampled with replacement `n_boot` times,
+    # and Step 1 and Step 2 of `two_step` are performed for each resample.
+    #
+    # n_jobs: the number of worker processes. the input matrices are shared with them
+    #   through shared memory. if None or 0, all CPUs are used.
+    # seed: seed of random streams. the result does not depend on `n_jobs`.
+    # batch_size: the number of resamples processed in a task
+    #
+    # returns
+    # df_freq: selection frequency of each variable selected at least once
+    # df_pairs: co-clustering frequency of the pairs of these variables,
+    #   the fraction of resamples in which both are in the same DNB cluster,
+    #   with columns "dnb_a", "dnb_b" and "cocluster_frequency" (upper triangle in the order of df_freq,
+    #   nonzero only)
+
+    kwargs_DNB = set_auto_params(dict(kwargs_DNB))
+    # cluster labels are necessary
+    kwargs_DNB["output_metrics"] = True
+
+    if n_jobs is None or n_jobs == 0:
+        n_jobs = os.cpu_count()
+    if batch_size is None:
+        batch_size = max(1, -(-n_boot // (4 * n_jobs)))
+    seeds = np.random.SeedSequence(seed).spawn(n_boot)
+    batches = [seeds[i:i+batch_size] for i in range(0, n_boot, batch_size)]
+
+    shared = {"expr": SharedArray(df_expr.values),
+              "ctrl": SharedArray(df_ctrl.values)}
+    specs = {k: v.spec() for k, v in shared.items()}
+    try:
+        if n_jobs == 1:
+            attach(specs)
+            results = [resample_two_step(b, kwargs_DNB) for b in batches]
+        else:
+            with ProcessPoolExecutor(max_workers=n_jobs, initializer=attach, initargs=(specs,)) as executor:
+                results = list(executor.map(
+                    resample_two_step, batches, [kwargs_DNB] * len(batches)))
+    finally:
+        detach(specs.keys())
+        for v in shared.values():
+            v.close()
+    results = [r for batch in results for r in batch]
+
+    return summarize_bootstrap(results, df_expr.index, n_boot)
+
+
+def summarize_bootstrap(results, index, n_boot):
+    # results: list of (positions of DNB variables, cluster labels) for each resample
+    # membership of (resample, cluster) x variable as a sparse indicator matrix
+    rows, cols = [], []
+    n_groups = 0
+    for positions, labels in results:
+        clusters, group = np.unique(labels, return_inverse=True)
+        rows.append(n_groups + group)
+        cols.append(positions)
+        n_groups += len(clusters)
+    rows = np.concatenate(rows + [np.zeros(0, dtype=int)])
+    cols = np.concatenate(cols + [np.zeros(0, dtype=int)])
+    M = sparse.csr_matrix((np.ones(len(rows)), (rows, cols)),
+                          shape=(n_groups, len(index)))
+
+    # variables selected at least once
+    count = np.asarray(M.sum(axis=0)).ravel()
+    selected = np.flatnonzero(count > 0)
+    selected = selected[np.argsort(-count[selected], kind="stable")]
+    df_freq = pd.DataFrame({"selection_frequency": count[selected] / n_boot},
+                           index=index[selected])
+
+    # co-clustering counts by a sparse product.
+    # only the pairs clustered together at least once are kept, so that
+    # the result is not quadratic in the number of selected variables.
+    M = M[:, selected]
+    co = sparse.triu(M.T @ M, k=1).tocoo()
+    order = np.lexsort((co.col, co.row))
+    i, j = co.row[order], co.col[order]
+    df_pairs = pd.DataFrame({
+        "dnb_a": index[selected][i],
+        "dnb_b": index[selected][j],
+        "cocluster_frequency": co.data[order] / n_boot,
+    })
+    return df_freq, df_pairs
+
+
+def bootstrap_iterate(keys, filenames, key_control, key_experimental, kwargs_DNB,
+                      n_boot=100, n_jobs=1, seed=0, control_filename=None, conversion_cache=False, orientation=None):
+    # bootstrap for each input file
+    # returns
+    # df_freq: selection frequencies with columns "dnb", "selection_frequency" and "time_point"
+    # df_pairs: co-clustering frequencies of pairs (upper triangle, nonzero only)
+    #   with columns "dnb_a", "dnb_b", "cocluster_frequency" and "time_point"
+    ret_freq, ret_pairs = [], []
+    if control_filename is not None:
+        df_c = read_csv_and_select(control_filename, key_control,
+                                   conversion_cache=conversion_cache)
+    for k, filename in zip(keys, filenames):
+        logger.info(f"bootstrap for \"{filename}\" ({n_boot} resamples)")
+        if control_filename is not None:
+            df_e = read_csv_and_select(filename, key_experimental,
+                                       conversion_cache=conversion_cache, orientation=orientation)
+            df_c_k = df_c.reindex(df_e.index)
+        else:
+            df_c_k, df_e = read_csv_and_split(filename, key_control, key_experimental,
+                                              conversion_cache=conversion_cache, orientation=orientation)
+        with stage("bootstrap", time_point=k, n_boot=n_boot):
+            df_freq, df_pairs = bootstrap_two_step(
+                df_e, df_c_k, n_boot=n_boot, n_jobs=n_jobs, seed=seed, **kwargs_DNB)
+
+        df_freq = df_freq.rename_axis("dnb").reset_index()
+        df_freq["time_point"] = k
+        ret_freq.append(df_freq)
+
+        df_pairs["time_point"] = k
+        ret_pairs.append(df_pairs)
+    return (pd.concat(ret_freq, axis=0).reset_index(drop=True),
+            pd.concat(ret_pairs, axis=0).reset_index(drop=True))
@@ -0,0 +1,116 @@
+import hashlib
+import json
+import os
+import numpy as np
+import pandas as pd
+
+
+# bump this when the format of cached results or the analysis changes
+CACHE_VERSION = 1
+
+
+def hash_file(filename, chunk_size=1 << 20):
+    # digest of the file content
+    h = hashlib.sha256()
+    with open(filename, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def params_for_key(params):
+    # parameters that affect the result.
+    # the plot options only change the figures, so they are excluded.
+    return {k: v for k, v in params.items() if not k.startswith("plot_")}
+
+
+class ResultCache:
+    # persistent cache of the result of each timepoint.
+    # the result is stored as a compressed .npz file (one array per column)
+    # whose name is the hash of the input file content and the parameters.
+    #
+    # cache_dir: directory where cached results are stored
+    # max_size: upper limit of the total size of the cache in bytes (optional).
+    #   when exceeded, the least recently used results are removed.
+
+    def __init__(self, cache_dir, max_size=None):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def make_key(self, filename, key_control, key_experimental, params, control_filename=None):
+        # params: parameters filled by `set_auto_params`
+        d = {
+            "version": CACHE_VERSION,
+            "input": hash_file(filename),
+            "control": None if control_filename is None else hash_file(control_filename),
+            "key_control": key_control,
+            "key_experimental": key_experimental,
+            "params": params_for_key(params),
+        }
+        s = json.dumps(d, sort_keys=True, default=str)
+        return hashlib.sha256(s.encode()).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, key + ".npz")
+
+    def load(self, key):
+        # return the cached result, or None if it is missing
+        path = self.path(key)
+        if not os.path.exists(path):
+            return None
+        with np.load(path, allow_pickle=False) as f:
+            columns = list(f["__columns__"])
+            df = pd.DataFrame({c: f[f"col_{i}"]
+                              for i, c in enumerate(columns)}, columns=columns)
+        # mark as recently used
+        os.utime(path)
+        return df
+
+    def save(self, key, df):
+        arrays = {"__columns__": np.array(df.columns, dtype=str)}
+        for i, c in enumerate(df.columns):
+            values = df[c].to_numpy()
+            if values.dtype == object:
+                values = values.astype(str)
+            arrays[f"col_{i}"] = values
+        # write to a temporary file first, so that a broken file is never loaded
+        path = self.path(key)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            np.savez_compressed(f, **arrays)
+        os.replace(tmp, path)
+        self.evict()
+
+    def remove(self, key):
+        # invalidate a cached result
+        path = self.path(key)
+        if os.path.exists(path):
+            os.remove(path)
+
+    def entries(self):
+        # list of (path, size, last used time) of cached results
+        ret = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(".npz"):
+                path = os.path.join(self.cache_dir, name)
+                st = os.stat(path)
+                ret.append((path, st.st_size, st.st_mtime))
+        return ret
+
+    def clear(self):
+        # invalidate all cached results
+        for path, _, _ in self.entries():
+            os.remove(path)
+
+    def evict(self):
+        # remove the least recently used results until the cache fits in `max_size`
+        if self.max_size is None:
+            return
+        entries = sorted(self.entries(), key=lambda e: e[2])
+        total = sum([size for _, size, _ in entries])
+        for path, size, _ in entries:
+            if total <= self.max_size:
+                break
+            os.remove(path)
+            total -= size
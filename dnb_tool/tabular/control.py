@@ -0,0 +1,54 @@
+import hashlib
+import pandas as pd
+
+from .core import deviation
+from .read_files import read_csv_and_select
+
+
+def hash_dataframe(df):
+    # digest of the values and the row labels of DataFrame.
+    # the deviation of each row does not depend on column labels,
+    # so they are not included.
+    h = hashlib.sha1()
+    h.update(str(df.shape).encode())
+    h.update(pd.util.hash_pandas_object(df, index=True).values.tobytes())
+    return h.hexdigest()
+
+
+class ControlCache:
+    # keeps the control group shared among timepoints,
+    # so that it is parsed and its deviation is calculated only once.
+    #
+    # control_filename: a separate file that contains the control group.
+    #   if None, the control group is taken from each input file,
+    #   and the identical control blocks are detected by their hash.
+    # key_control: string by which the control columns are classified
+    # conversion_cache: keep a binary copy of the control file and read it in later runs
+
+    def __init__(self, control_filename=None, key_control=None, conversion_cache=False):
+        self.control_filename = control_filename
+        self.key_control = key_control
+        self.conversion_cache = conversion_cache
+        self._df_ctrl = None
+        # (hash of control DataFrame, deviation metric) -> deviation
+        self._deviations = {}
+
+    def get_control(self):
+        # read the control file at the first call
+        if self._df_ctrl is None:
+            self._df_ctrl = read_csv_and_select(
+                self.control_filename, self.key_control, conversion_cache=self.conversion_cache)
+        return self._df_ctrl
+
+    def deviation(self, df_ctrl, metric):
+        # return the deviation of the control group,
+        # which is calculated only when the same control block has not appeared.
+        if df_ctrl is self._df_ctrl:
+            # the control file is loaded only once, so hashing is not needed
+            digest = self.control_filename
+        else:
+            digest = hash_dataframe(df_ctrl)
+        key = (digest, metric)
+        if key not in self._deviations:
+            self._deviations[key] = deviation(df_ctrl, metric)
+        return self._deviations[key]
@@ -1,35 +1,192 @@
+import warnings
 import numpy as np
 import pandas as pd
 from scipy.cluster.hierarchy import linkage, fcluster
+from scipy.stats import rankdata
+
+from ..instrument import get_logger, record, stage
+
+logger = get_logger(__name__)
+
+
+# the core routines work on a float matrix (variables x samples) and index arrays.
+# pandas objects are used only at the boundary (`deviation`, `clustering` and `two_step`).
+#
+# missing values (NaN) are ignored: deviations and ranks are calculated over the observed samples
+# of each variable, and correlations over the samples observed in both variables (pairwise-complete).
+# without missing values, the results are the same as those of the complete-data routines.
+
+# rows ranked at once in `rank_rows`
+RANK_BLOCK_SIZE = 1024
+
+# rows whose correlations with all rows are calculated at once in `masked_distance`
+CORR_BLOCK_SIZE = 1024
+
+# the default minimum number of samples observed in both variables for their correlation
+MIN_OVERLAP = 3
+
+
+def row_median(arr):
+    # median of each row, where NaN is ignored as in pandas
+    if np.isnan(arr).any():
+        # rows without observed values are NaN
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", RuntimeWarning)
+            return np.nanmedian(arr, axis=1)
+    return np.median(arr, axis=1)
+
+
+def mad_array(arr):
+    # MAD: median absolute deviation of each row
+    return row_median(np.abs(arr - row_median(arr)[:, None]))
 
 
 def mad(df):
     # MAD: median absolute deviation
-    return df.subtract(df.median(axis=1), axis=0).abs().median(axis=1)
+    return pd.Series(mad_array(df.to_numpy(dtype=float)), index=df.index)
 
 
-def clustering(df, **kwargs):
-    # clustering using `scipy.cluster.hierarchy`
+def deviation_array(arr, metric):
+    # deviation of each variable (row) in the group
+    if metric == "mad":
+        # median absolute deviation
+        return mad_array(arr)
+    elif metric == "std":
+        # standard deviation.
+        # rows are made contiguous, so that they are summed in the same order as pandas
+        arr = np.ascontiguousarray(arr)
+        if np.isnan(arr).any():
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore", RuntimeWarning)
+                return np.nanstd(arr, axis=1)
+        return np.std(arr, axis=1)
+    else:
+        raise ValueError(
+            f"\"{metric}\" for deviation_metric is not supported. Please use \"mad\" or \"std\".")
+
+
+def deviation(df, metric):
+    # deviation of each variable (row) in the group
+    return pd.Series(deviation_array(df.to_numpy(dtype=float), metric), index=df.index)
 
+
+def rank_rows(arr):
+    # replace the values of each row by their ranks in place (ties get the average rank).
+    # rows are ranked block by block, so that only a block of ranks is allocated at a time.
+    for s in range(0, arr.shape[0], RANK_BLOCK_SIZE):
+        arr[s:s+RANK_BLOCK_SIZE] = rankdata(
+            arr[s:s+RANK_BLOCK_SIZE], axis=1, nan_policy="omit")
+    return arr
+
+
+def preprocess(arr, overwrite=False, **kwargs):
     # preprocess of input values for linkage, that will performed with correlation metric
+    # overwrite: `arr` may be replaced by the preprocessed values (ranks), which saves a copy
     if kwargs["linkage_metric"] == "spearman":
-        df_x = df.rank(axis=1)
+        return rank_rows(arr if overwrite else arr.astype(float))
     elif kwargs["linkage_metric"] == "pearson":
-        df_x = df.copy()
+        # linkage does not modify the input
+        return arr
     else:
         metr = kwargs["linkage_metric"]
         raise ValueError(
             f"\"{metr}\" for linkage_metric is not supported. Please use \"spearman\" or \"pearson\".")
 
-    # call `scipy.cluster.hierarchy.linkage`
-    Z = linkage(df_x,
-                metric="correlation",
-                method=kwargs["linkage_method"])
 
+class MaskedRows:
+    # sums over the samples observed in pairs of rows, as matrix products with the mask of observed values.
+    # for rows i and j, with the mask m and the values x (0 where missing, centered by the row mean),
+    #   n = m m^T: the number of common samples
+    #   s = x m^T: the sum of x_i over the common samples (s^T is that of x_j)
+    #   q = x^2 m^T: the sum of x_i^2 over the common samples
+    #   p = x x^T: the cross products
+    # so that the correlations of all pairs are a few GEMMs instead of a loop over the pairs.
+
+    def __init__(self, arr):
+        mask = ~np.isnan(arr)
+        self.m = mask.astype(float)
+        count = self.m.sum(axis=1, keepdims=True)
+        x = np.where(mask, arr, 0)
+        # centering does not change the correlations, and improves numerical accuracy
+        mean = x.sum(axis=1, keepdims=True) / np.maximum(count, 1)
+        self.x = np.where(mask, x - mean, 0)
+        self.x2 = self.x ** 2
+
+    def correlation(self, rows, min_overlap=MIN_OVERLAP):
+        # correlations between `rows` (slice) and all rows. NaN for the pairs with less than
+        # `min_overlap` common samples, or constant on the common samples.
+        m, x, x2 = self.m[rows], self.x[rows], self.x2[rows]
+        n = m @ self.m.T
+        s = x @ self.m.T
+        s_t = m @ self.x.T
+        with np.errstate(divide="ignore", invalid="ignore"):
+            cov = x @ self.x.T - s * s_t / n
+            var = (x2 @ self.m.T - s * s / n) * (m @ self.x2.T - s_t * s_t / n)
+            cor = cov / np.sqrt(var)
+        cor[(n < max(min_overlap, 2)) | ~(var > 0)] = np.nan
+        return np.clip(cor, -1, 1, out=cor)
+
+
+def correlation_matrix(arr, min_overlap=MIN_OVERLAP):
+    # correlation matrix of rows, pairwise-complete if there are missing values
+    if np.isnan(arr).any():
+        return MaskedRows(arr).correlation(slice(None), min_overlap)
+    return np.corrcoef(arr)
+
+
+def masked_distance(arr_x, min_overlap=MIN_OVERLAP):
+    # condensed correlation distance (1 - correlation) of rows with missing values,
+    # as `scipy.spatial.distance.pdist(metric="correlation")`.
+    # pairs without a correlation (too few common samples) are regarded as uncorrelated (distance 1).
+    k = arr_x.shape[0]
+    masked = MaskedRows(arr_x)
+    ret = np.empty(k * (k - 1) // 2)
+    pos = 0
+    for s in range(0, k, CORR_BLOCK_SIZE):
+        e = min(k, s + CORR_BLOCK_SIZE)
+        dist = 1 - masked.correlation(slice(s, e), min_overlap)
+        np.nan_to_num(dist, copy=False, nan=1)
+        # the upper triangle of the rows of the block
+        for i in range(s, e):
+            ret[pos:pos + k - i - 1] = dist[i - s, i + 1:]
+            pos += k - i - 1
+    return ret
+
+
+def linkage_array(arr_x, **kwargs):
+    # call `scipy.cluster.hierarchy.linkage` for preprocessed values
+    if np.isnan(arr_x).any():
+        # pairwise-complete correlation distance
+        return linkage(masked_distance(arr_x, kwargs.get("min_overlap", MIN_OVERLAP)),
+                       method=kwargs["linkage_method"])
+    return linkage(arr_x,
+                   metric="correlation",
+                   method=kwargs["linkage_method"])
+
+
+def cut_tree(Z, **kwargs):
     # call `scipy.cluster.hierarchy.fcluster` to obtain cluster labels
-    label_arr = fcluster(Z,
-                         1-kwargs["linkage_threshold"],
-                         criterion='distance')
+    return fcluster(Z,
+                    1-kwargs["linkage_threshold"],
+                    criterion='distance')
+
+
+def clustering_array(arr, overwrite=False, **kwargs):
+    # clustering using `scipy.cluster.hierarchy`
+    # arr: values of variables (rows)
+    # overwrite: `arr` may be replaced by the preprocessed values (ranks), which saves a copy
+    # returns
+    # label_arr: cluster indices where the variables are classified into
+    # arr_x: variables after preprocess, that is fed into the clustering routines
+    arr_x = preprocess(arr, overwrite=overwrite, **kwargs)
+    label_arr = cut_tree(linkage_array(arr_x, **kwargs), **kwargs)
+    return label_arr, arr_x
+
+
+def clustering(df, **kwargs):
+    # clustering using `scipy.cluster.hierarchy`
+    label_arr, arr_x = clustering_array(
+        df.to_numpy(dtype=float), **kwargs)
 
     # count variables in each cluster to obtain the cluster size
     freq_sr = pd.Series(label_arr).value_counts()
@@ -37,17 +194,91 @@ def clustering(df, **kwargs):
     # label_arr: series of cluster indices where the variables classified into
     # freq_sr: cluster sizes
     # df_x: variables after preprocess, that is fed into the clustring routines
+    df_x = pd.DataFrame(arr_x, index=df.index, columns=df.columns, copy=False)
     return label_arr, freq_sr, df_x
 
 
-def two_step(df_expr, df_ctrl, **kwargs):
+def cor_mean_array(arr_x, min_overlap=MIN_OVERLAP):
+    # mean of the correlations between all pairs of rows (NaN for a single row)
+    if arr_x.shape[0] < 2:
+        return np.nan
+    if np.isnan(arr_x).any():
+        # pairwise-complete correlations, where pairs without a correlation are ignored
+        cor = MaskedRows(arr_x).correlation(slice(None), min_overlap)
+        cor = cor[np.triu_indices(cor.shape[0], k=1)]
+        cor = cor[~np.isnan(cor)]
+        return np.mean(cor) if len(cor) > 0 else np.nan
+    # column-major as the values of DataFrame, so that the means are summed in the same order
+    cor = np.corrcoef(np.asfortranarray(arr_x))
+    return np.mean(cor[np.triu_indices(cor.shape[0], k=1)])
+
+
+def select_clusters(sub_idx, label_arr, arr_x, dev_expr, dev_ctrl, **kwargs):
+    # select large clusters and calculate the metrics of their variables
+    # sub_idx: labels of the variables that passed the 1st step
+    # label_arr: cluster indices of these variables
+    # arr_x: preprocessed values of these variables
+    # dev_expr, dev_ctrl: deviations of these variables
+    # returns the result DataFrame sorted by cluster size, and the number of selected clusters
+
+    # cluster sizes
+    clusters, sizes = np.unique(label_arr, return_counts=True)
+    logger.info(f"[Step 2] Clustering. Cluster sizes are " +
+                ", ".join([str(x) for x in np.sort(sizes)[::-1][:5]]) + "...")
+
+    # drop clusters that is small relatively to the largest one.
+    th = kwargs["thres_cluster_selection"] * sizes.max()
+    logger.info(f"Threshold of cluster size is {th:.1f}")
+
+    # display the number of remaining clusters
+    cluster_count = np.sum(sizes > th)
+    logger.info(f"{cluster_count} clusters are selected.")
+
+    # drop variables included in the dropped clusters
+    # and then, these are the positions of DNB variables in `arr_x`,
+    # ordered by cluster index (stable), as they are grouped in the post analysis
+    keep = np.flatnonzero(np.isin(label_arr, clusters[sizes > th]))
+    keep = keep[np.argsort(label_arr[keep], kind="stable")]
+    dnb_clusterids = label_arr[keep]
+    dnb_clustersizes = sizes[np.searchsorted(clusters, dnb_clusterids)]
+
+    ########
+    # post analysis
+    ########
+
+    # calculate correlation measure for each cluster
+    # if cluster consists of 1 variable, it is NaN.
+    starts = np.flatnonzero(np.r_[True, np.diff(dnb_clusterids) != 0])
+    ends = np.r_[starts[1:], len(keep)]
+    cor_mean = np.zeros(len(keep))
+    for s, e in zip(starts, ends):
+        cor_mean[s:e] = cor_mean_array(arr_x[keep[s:e]],
+                                       kwargs.get("min_overlap", MIN_OVERLAP))
+
+    # merge them into a result DataFrame, indexed by cluster indices
+    df_ret = pd.DataFrame({
+        "dnb": sub_idx[keep],
+        "cluster": dnb_clusterids,
+        "clustersize": dnb_clustersizes,
+        "dev_expr": dev_expr[keep],
+        "dev_ctrl": dev_ctrl[keep],
+        "cor_mean": cor_mean,
+    }, index=pd.Index(dnb_clusterids)).sort_values(
+        "clustersize", ascending=False)
+    return df_ret, cluster_count
+
+
+def two_step(df_expr, df_ctrl, dev_ctrl=None, **kwargs):
+    # dev_ctrl: deviation of the control group computed in advance (optional).
+    #   when the same control group is shared among timepoints,
+    #   it is calculated only once and reused here.
 
     # check the size of input
     # the minimum number of measurement is 4
     Ne, Nc = df_expr.shape[1], df_ctrl.shape[1]
-    print(f"[Step 0]")
-    print(f"Control group size is {Nc}")
-    print(f"Experimental group size is {Ne}")
+    logger.info(f"[Step 0]")
+    logger.info(f"Control group size is {Nc}")
+    logger.info(f"Experimental group size is {Ne}")
     if Ne < 4:
         raise ValueError(
             'experimental group has less than 4 samples. Check the input files and settings.')
@@ -55,33 +286,36 @@ def two_step(df_expr, df_ctrl, **kwargs):
         raise ValueError(
             'control group has less than 4 samples. Check the input files and settings.')
 
+    # the values are used without copying when the DataFrame has a single float block
+    arr_expr = df_expr.to_numpy(dtype=float)
+
     ########
     #### step 1: deviation filtering ####
     ########
-    if kwargs["deviation_metric"] == "mad":
-        # median absolute deviation
-        dev_expr = mad(df_expr)
-        dev_ctrl = mad(df_ctrl)
-    elif kwargs["deviation_metric"] == "std":
-        # standard deviation
-        dev_expr = df_expr.std(axis=1, ddof=0)
-        dev_ctrl = df_ctrl.std(axis=1, ddof=0)
-    else:
-        #
-        metr = kwargs["deviation_metric"]
-        raise ValueError(
-            f"\"{metr}\" for deviation_metric is not supported. Please use \"mad\" or \"std\".")
-
-    # collect variables that fluctuates in experimental group
-    # than in control group by a specified factor(`theta`)
-    theta = kwargs["thres_gene_filtering"]
-    # collect index of such genes
-    sub_idx = df_expr.index[dev_expr > theta * dev_ctrl]
-    print(
+    with stage("step1"):
+        dev_expr = deviation_array(arr_expr, kwargs["deviation_metric"])
+        if dev_ctrl is None:
+            dev_ctrl = deviation_array(df_ctrl.to_numpy(
+                dtype=float), kwargs["deviation_metric"])
+        elif not dev_ctrl.index.equals(df_expr.index):
+            # align the shared control deviation to the variables of this dataset
+            dev_ctrl = dev_ctrl.reindex(df_expr.index).to_numpy()
+        else:
+            dev_ctrl = dev_ctrl.to_numpy()
+
+        # collect variables that fluctuates in experimental group
+        # than in control group by a specified factor(`theta`)
+        theta = kwargs["thres_gene_filtering"]
+        # collect positions of such genes
+        sub_pos = np.flatnonzero(dev_expr > theta * dev_ctrl)
+        sub_idx = df_expr.index[sub_pos]
+    logger.info(
         f"[Step 1] {len(sub_idx)} genes that are flucuating in experimental group are selected")
     # if only too few variables satisfies the condition,
     # returns immediately.
     if len(sub_idx) < 2:  # 0 or 1
+        record("two_step", n_genes=len(df_expr), n_step1=len(sub_idx),
+               n_clusters=0, n_dnb=0)
         ret = pd.DataFrame([], columns=["dnb", "cluster",
                            "clustersize", "dev_expr", "dev_ctrl"])
         return ret, kwargs, None
@@ -96,84 +330,29 @@ def two_step(df_expr, df_ctrl, **kwargs):
     #### step 2: clustering ####
     ########
 
-    # take only variables that passed the 1st step
-    df_sub_expr = df_expr.loc[sub_idx]
+    # take only variables that passed the 1st step.
+    # this is the only copy of the values; ranks are written into it.
+    arr_sub = arr_expr[sub_pos]
 
     # clustring
-    # label_arr: series of cluster indices where the variables classified into
-    # freq_sr: cluster sizes
-    # df_x: variables after preprocess, that is fed into the clustring routines
-    label_arr, freq_sr, df_x = clustering(df_sub_expr, **kwargs)
-    print(f"[Step 2] Clustering. Cluster sizes are " +
-          ", ".join([str(x) for x in sorted(freq_sr)[::-1][:5]]) + "...")
-
-    # drop clusters that is small relatively to the largest one.
-    th = kwargs["thres_cluster_selection"] * freq_sr.iat[0]
-    print(f"Threshold of cluster size is {th:.1f}")
-
-    # display the number of remaining clusters
-    cluster_count = np.sum(freq_sr > th)
-    print(f"{cluster_count} clusters are selected.")
-
-    # drop variables included in the dropped clusters
-    # and then, this is the indices of DNB variables
-    dnb_idx = sub_idx[np.isin(label_arr, freq_sr.index[freq_sr > th])]
-    # drop rows for dropped variables in deviation DataFrames
-    dnb_dev_expr = dev_expr.loc[dnb_idx].values
-    dnb_dev_ctrl = dev_ctrl.loc[dnb_idx].values
-
-    # convert DNB indices to list
-    dnb_labels = list(dnb_idx)
-    # make the list of large clusters
-    dnb_clusterids = list(
-        label_arr[np.isin(label_arr, freq_sr.index[freq_sr > th])])
-    # list of corresponding cluster sizes
-    dnb_clustersizes = freq_sr[dnb_clusterids]
-
-    # merge them into a result DataFrame
-    df_ret = pd.DataFrame({
-        "dnb": dnb_labels,
-        "cluster": dnb_clusterids,
-        "clustersize": dnb_clustersizes,
-        "dev_expr": dnb_dev_expr,
-        "dev_ctrl": dnb_dev_ctrl,
-    })
-
-    ########
-    # post analysis
-    ########
-
-    # calculate correlation measure for each cluster
-    df_ret_ = []
-    for g, df_g in df_ret.groupby("cluster"):
-        if df_g.shape[0] > 1:
-            # calculate correlation matrix of the variables in the cluster
-            cor = np.corrcoef(df_x.loc[df_g["dnb"].values].values)
-
-            # take the upper triangle of the matrix and flatten to list
-            cor_list = []
-            for i in np.arange(cor.shape[0]-1):
-                cor_list.extend(cor[i, (i+1):])
-            # then calculate mean
-            cor_mean = np.mean(cor_list)
-        else:
-            # if cluster consists of 1 variable, fill it with NaN.
-            cor_mean = np.nan
-
-        # write correlation measure to each row in the DataFrame of the cluster
-        df_g["cor_mean"] = cor_mean
-        # and keep it
-        df_ret_.append(df_g)
-
-    # merge the results to one DataFrame
-    df_ret = pd.concat(df_ret_, axis=0).sort_values(
-        "clustersize", ascending=False)
+    # label_arr: cluster indices where the variables classified into
+    # arr_x: variables after preprocess, that is fed into the clustring routines
+    with stage("step2"):
+        label_arr, arr_x = clustering_array(arr_sub, overwrite=True, **kwargs)
+    df_ret, cluster_count = select_clusters(
+        sub_idx, label_arr, arr_x, dev_expr[sub_pos], dev_ctrl[sub_pos], **kwargs)
+    record("two_step", n_genes=len(df_expr), n_step1=len(sub_idx),
+           n_clusters=int(cluster_count), n_dnb=len(df_ret))
 
     # the metrics for each DNB variable are output only when the option "output_metrics" is given
     # otherwise, it is simplified to include only indices of DNB variables
     if not kwargs["output_metrics"]:
         df_ret = df_ret[["dnb"]]
 
+    # df_x: variables after preprocess, which shares the values with `arr_x`
+    df_x = pd.DataFrame(arr_x, index=sub_idx,
+                        columns=df_expr.columns, copy=False)
+
     # df_ret: the DataFrame of result
     # kwargs: parameters used in the analysis, whose missing values are filled by default values,
     return df_ret, kwargs, df_x
@@ -1,8 +1,15 @@
-from .core import two_step
-from .read_files import read_csv_and_split
+import pandas as pd
+
+from ..instrument import get_logger, stage
+from .core import preprocess, two_step
+from .read_files import read_csv_and_split, read_csv_and_select
 
 from .visualize import plot_heatmap
 from .visualize import plot_correlation
+from .visualize import render_heatmap
+from .visualize import render_correlation
+
+logger = get_logger(__name__)
 
 
 def isfloat(s):
@@ -37,6 +44,8 @@ def set_auto_params(d):
     d["linkage_metric"] = d.get("linkage_metric", "spearman")
     d["linkage_method"] = d.get("linkage_method", 'average')
     d["linkage_threshold"] = get_float(d, "linkage_threshold", 0.75)
+    # the minimum number of samples observed in both genes for their correlation (with missing values)
+    d["min_overlap"] = int(d.get("min_overlap", 3))
 
     # the parameter for selecting large clusters
     d["thres_cluster_selection"] = get_float(d, "thres_cluster_selection", 0.5)
@@ -49,43 +58,124 @@ def set_auto_params(d):
     d["plot_heatmap"] = d.get("plot_heatmap", False)
     d["plot_file_prefix"] = d.get("plot_file_prefix", None)
     d["plot_file_suffix"] = d.get("plot_file_suffix", None)
+    # how plots are drawn. "imshow": a rasterized image (fast), "pcolormesh": one polygon per cell
+    d["plot_renderer"] = d.get("plot_renderer", "imshow")
+    # the maximum number of pixels for each axis of the image.
+    # larger matrices are downsampled by block mean (only for "imshow")
+    d["plot_max_pixels"] = d.get("plot_max_pixels", 1000)
     return d
 
 
-def dnb_tb(filename, key_control, key_experimental, **kwargs_DNB):
-    # read file and split to control and experimental
-    df_c, df_e = read_csv_and_split(
-        filename, key_control, key_experimental)
+def plot_filename(kwargs_DNB, name):
+    # filename of the plot, or None when plots are displayed on screen
+    filename = kwargs_DNB["plot_file_prefix"]
+    if not filename is None:
+        filename = filename + name
+        if kwargs_DNB.get("plot_file_suffix", None):
+            filename = filename + "_" + str(kwargs_DNB["plot_file_suffix"])
+        filename = filename + ".png"
+    return filename
+
+
+def dnb_tb(filename, key_control, key_experimental, control_cache=None, conversion_cache=False, orientation=None, plot_worker=None, **kwargs_DNB):
+    # control_cache: `ControlCache` shared among timepoints (optional)
+    # conversion_cache: keep a binary copy of csv file and read it in later runs
+    # orientation: "columns" or "rows" (transposed). if None, it is detected from the header.
+    # plot_worker: `PlotWorker` to render plot files in background (optional)
+    df_c, df_e = read_tb(filename, key_control, key_experimental, control_cache=control_cache,
+                         conversion_cache=conversion_cache, orientation=orientation)
+    dnb, params, _ = dnb_tb_frames(df_c, df_e, control_cache=control_cache,
+                                   plot_worker=plot_worker, **kwargs_DNB)
+    return dnb, params
 
+
+def read_tb(filename, key_control, key_experimental, control_cache=None, conversion_cache=False, orientation=None):
+    # the control and the experimental groups of an input file (arguments are the same as `dnb_tb`)
+    with stage("read"):
+        if control_cache is not None and control_cache.control_filename is not None:
+            # control group is given as a separate file, which is read only once
+            df_c = control_cache.get_control()
+            df_e = read_csv_and_select(
+                filename, key_experimental, conversion_cache=conversion_cache, orientation=orientation)
+        else:
+            # read file and split to control and experimental
+            df_c, df_e = read_csv_and_split(
+                filename, key_control, key_experimental, conversion_cache=conversion_cache, orientation=orientation)
+    return df_c, df_e
+
+
+def dnb_tb_frames(df_c, df_e, control_cache=None, plot_worker=None, **kwargs_DNB):
+    # `dnb_tb` for the groups already read by `read_tb`.
+    # returns also `df_x` of `two_step` (variables that passed the 1st step)
     # fill missing parameters with default values
     kwargs_DNB = set_auto_params(kwargs_DNB)
 
+    # deviation of the control group is reused if it is already calculated
+    dev_ctrl = None
+    if control_cache is not None:
+        dev_ctrl = control_cache.deviation(
+            df_c, kwargs_DNB["deviation_metric"])
+
     # main routine
     # dnb: DataFrame for results
     # params: parameters used in the analysis
     #   (just for display)
-    dnb, params, df_x = two_step(df_e, df_c, **kwargs_DNB)
+    dnb, params, df_x = two_step(df_e, df_c, dev_ctrl=dev_ctrl, **kwargs_DNB)
 
     # if options are given, generate some plots
+    with stage("plot"):
+        plot_dnb(df_e, df_c, dnb, df_x, kwargs_DNB, plot_worker=plot_worker)
+
+    # keep the results with key(timestamp)
+    return dnb, params, df_x
+
+
+def plot_cached(df_e, df_c, dnb, kwargs_DNB, plot_worker=None):
+    # the plots of a cached result (`ResultCache`) from the groups read again.
+    # only the DNB variables of `df_x` are used by the plots, and their preprocessed values
+    # (ranks of each row for "spearman") are calculated from the experimental group.
+    dnb_labels = dnb["dnb"].values
+    df_x = None
+    if len(dnb_labels) > 0:
+        arr_x = preprocess(df_e.loc[dnb_labels].to_numpy(dtype=float), overwrite=True, **kwargs_DNB)
+        df_x = pd.DataFrame(arr_x, index=dnb_labels, columns=df_e.columns)
+    plot_dnb(df_e, df_c, dnb, df_x, kwargs_DNB, plot_worker=plot_worker)
+
+
+def plot_dnb(df_e, df_c, dnb, df_x, kwargs_DNB, plot_worker=None):
+    # generate the plots specified by options
+    # plot_worker: `PlotWorker` to render plot files in background (optional)
+    fast = kwargs_DNB["plot_renderer"] == "imshow"
+    if not fast and kwargs_DNB["plot_renderer"] != "pcolormesh":
+        renderer = kwargs_DNB["plot_renderer"]
+        raise ValueError(
+            f"\"{renderer}\" for plot_renderer is not supported. Please use \"imshow\" or \"pcolormesh\".")
+    max_pixels = kwargs_DNB["plot_max_pixels"]
+    dnb_labels = dnb["dnb"].values
+
+    def submit(func, *args, filename):
+        # plots on screen are drawn in this thread
+        if plot_worker is None or filename is None:
+            func(*args, filename=filename, max_pixels=max_pixels)
+        else:
+            plot_worker.submit(func, *args, filename=filename,
+                               max_pixels=max_pixels)
+
     if kwargs_DNB["plot_correlation"]:
-        filename = kwargs_DNB["plot_file_prefix"]
-        if not filename is None:
-            filename = filename + "correlation"
-            if kwargs_DNB.get("plot_file_suffix", None):
-                filename = filename + "_" + kwargs_DNB["plot_file_suffix"]
-            filename = filename + ".png"
-        print(f"filename: {filename}")
-        plot_correlation(df_x, dnb, filename=filename)
+        filename = plot_filename(kwargs_DNB, "correlation")
+        logger.info(f"filename: {filename}")
+        if fast:
+            # only the values of DNB variables are passed to the worker
+            arr_dnb_x = None if df_x is None else df_x.loc[dnb_labels].values
+            submit(render_correlation, arr_dnb_x, filename=filename)
+        else:
+            plot_correlation(df_x, dnb, filename=filename)
 
     if kwargs_DNB["plot_heatmap"]:
-        filename = kwargs_DNB["plot_file_prefix"]
-        if not filename is None:
-            filename = filename + "heatmap"
-            if kwargs_DNB.get("plot_file_suffix", None):
-                filename = filename + "_" + kwargs_DNB["plot_file_suffix"]
-            filename = filename + ".png"
-        print(f"filename: {filename}")
-        plot_heatmap(df_e, df_c, dnb, filename=filename)
-
-    # keep the results with key(timestamp)
-    return dnb, params
+        filename = plot_filename(kwargs_DNB, "heatmap")
+        logger.info(f"filename: {filename}")
+        if fast:
+            submit(render_heatmap, df_e.loc[dnb_labels].values,
+                   df_c.loc[dnb_labels].values, filename=filename)
+        else:
+            plot_heatmap(df_e, df_c, dnb, filename=filename)
@@ -1,30 +1,139 @@
-from .dnb import dnb_tb
+from ..instrument import get_logger, context, record, stage
+from .core import deviation, two_step
+from .dnb import dnb_tb_frames, plot_cached, plot_dnb, read_tb, set_auto_params
+from .control import ControlCache
+from .prefetch import Prefetcher
+from .read_files import read_wide
+from .output import BackgroundWriter
+from .visualize import PlotWorker
 import pandas as pd
 import yaml
 
+logger = get_logger(__name__)
 
-def dnb_tb_iterate(keys, filenames, key_control, key_experimental, kwargs_DNB):
+
+def dnb_tb_iterate(keys, filenames, key_control, key_experimental, kwargs_DNB, control_filename=None, cache=None, conversion_cache=False, orientation=None, writer=None, plot_workers=1, prefetch=0, on_timepoint=None):
     # keys: keys for datasets, typically timestamps
     # filenames: corresponding input filenames
     # key_control, key_experimental: string by which the input columns are classified
     # kwargs_DNB: parameters passed to the main routine `two_step`
+    # control_filename: a separate file for the control group shared among all timepoints (optional)
+    # cache: `ResultCache` to reuse the results of unchanged timepoints (optional)
+    # conversion_cache: keep binary copies of csv files and read them in later runs
+    # orientation: "columns" or "rows" (transposed). if None, it is detected for each file.
+    # writer: `ResultWriter` to which the result of each timepoint is written as soon as it is finished.
+    #   if given, results are not kept in memory and None is returned.
+    #   timepoints not claimed by the writer (e.g. already completed in the checkpoint,
+    #   or processed by another worker with `ShardWriter`) are skipped.
+    # plot_workers: the number of threads that render plot files in background.
+    #   if 0, plots are rendered before the next timepoint is processed.
+    # prefetch: the number of input files read ahead in a background thread (see `Prefetcher`),
+    #   so that reading overlaps with the analysis. the results are written in a background thread too.
+    #   timepoints are claimed by the writer when they are read.
+    #   if 0, each file is read and written in turn.
+    # on_timepoint: function called with (key, df_e, df_c, dnb, df_x) after each timepoint is analyzed,
+    #   e.g. `LandscapeCollector`, to use the groups already read. df_x is None for a cached result.
+
+    # parameters used for this run, whose missing values are filled by default values
+    params = set_auto_params(dict(kwargs_DNB))
+    plots = params["plot_correlation"] or params["plot_heatmap"]
+
+    # the control group and its deviation are shared among timepoints.
+    # without `control_filename`, identical control blocks are detected by hash.
+    control_cache = ControlCache(
+        control_filename, key_control, conversion_cache=conversion_cache)
+
+    def load(k, filename):
+        # the cached result or the input of a timepoint, or None if it is not claimed.
+        # with `prefetch`, this is called in the background thread.
+        if writer is not None and not writer.claim(k):
+            return None
+        with context(time_point=k):
+            cache_key = dnb = None
+            if cache is not None:
+                # look up the result for the same input and parameters
+                cache_key = cache.make_key(filename, key_control, key_experimental,
+                                           params, control_filename=control_filename)
+                dnb = cache.load(cache_key)
+            # the groups are read also for a cached result when they are used by `on_timepoint`
+            # or by the plots
+            if dnb is not None and on_timepoint is None and not plots:
+                return cache_key, dnb, None
+            return cache_key, dnb, read_tb(filename, key_control, key_experimental,
+                                           control_cache=control_cache,
+                                           conversion_cache=conversion_cache, orientation=orientation)
+
+    # plot files are rendered while the next timepoint is processed
+    plot_worker = PlotWorker(plot_workers)
+    # results are written in the order of timepoints by a thread
+    output = None
+    if writer is not None:
+        output = BackgroundWriter(writer, background=prefetch > 0)
+    prefetcher = Prefetcher(zip(keys, filenames), load, depth=prefetch)
     ret = []
-    # calculate DNB for each input file
-    for i, kf in enumerate(zip(keys, filenames)):
-        k, filename = kf
-        dnb, params = dnb_tb(filename, key_control,
-                             key_experimental, **kwargs_DNB)
-
-        # after all inputs are processed, display parameters for the analysis
-        if i == len(filenames)-1:
-            print("parameters used for this run:")
-            print("========")
-            print(yaml.dump(params, default_flow_style=False))
-            print("========")
-        # keep the results with key(timestamp)
-        df = dnb.copy()
-        df["time_point"] = k
-        ret.append(df)
+    try:
+        # calculate DNB for each input file
+        for (k, filename), loaded in prefetcher:
+            if loaded is None:
+                continue
+            if output is not None:
+                # stop as soon as a result could not be written
+                output.check()
+            cache_key, dnb, data = loaded
+            # metrics of this timepoint are recorded with its key
+            with context(time_point=k), stage("timepoint", filename=filename):
+                df_x = None
+                # plots of each timepoint are written to different files
+                kwargs = dict(kwargs_DNB)
+                if kwargs.get("plot_file_suffix", None) is None:
+                    kwargs["plot_file_suffix"] = k
+                if dnb is not None:
+                    logger.info(
+                        f"cached result is used for \"{filename}\"")
+                    record("cache_hit", filename=filename)
+                    if plots:
+                        df_c, df_e = data
+                        with stage("plot"):
+                            plot_cached(df_e, df_c, dnb, set_auto_params(kwargs),
+                                        plot_worker=plot_worker)
+                else:
+                    df_c, df_e = data
+                    dnb, _, df_x = dnb_tb_frames(df_c, df_e, control_cache=control_cache,
+                                                 plot_worker=plot_worker, **kwargs)
+                    if cache is not None:
+                        cache.save(cache_key, dnb)
+                if on_timepoint is not None:
+                    df_c, df_e = data
+                    on_timepoint(k, df_e, df_c, dnb, df_x)
+
+                # keep the results with key(timestamp)
+                df = dnb.copy()
+                df["time_point"] = k
+                if writer is not None:
+                    output.write(k, df)
+                else:
+                    ret.append(df)
+    finally:
+        prefetcher.close()
+        # wait for the outputs and the plots of the last timepoints
+        try:
+            if output is not None:
+                output.close()
+        finally:
+            plot_worker.close()
+
+    return finish(ret, params, writer)
+
+
+def finish(ret, params, writer):
+    # after all inputs are processed, display parameters for the analysis
+    logger.info("parameters used for this run:\n========\n" +
+                yaml.dump(params, default_flow_style=False) + "========")
+
+    if writer is not None:
+        writer.close()
+        return None
+
     # merge the kept result into DataFrame
     ret = pd.concat(ret, axis=0).reset_index(drop=True)
 
@@ -33,3 +142,91 @@ def dnb_tb_iterate(keys, filenames, key_control, key_experimental, kwargs_DNB):
     ret.index = [""] * len(ret.index)
 
     return ret
+
+
+def dnb_tb_groups(filename, key_control, pattern, kwargs_DNB, conversion_cache=False, orientation=None, writer=None, plot_workers=1):
+    # DNB of several experimental groups in a single wide table, against its control group.
+    # filename: the wide table
+    # pattern: regular expression (or dictionary) that maps the labels to group keys (see `classify_groups`)
+    # the other arguments are the same as `dnb_tb_iterate`, and the group keys are the keys of the result.
+    # the table is parsed once, the groups are views of the same array,
+    # and the deviation of the control group is calculated once.
+    params = set_auto_params(dict(kwargs_DNB))
+    with stage("read"):
+        df_c, keys, groups = read_wide(filename, key_control, pattern,
+                                       conversion_cache=conversion_cache, orientation=orientation)
+    logger.info(f"{len(keys)} groups are found in \"{filename}\": " +
+                ", ".join(f"{k} ({df_e.shape[1]} samples)" for k, df_e in zip(keys, groups)))
+    dev_ctrl = deviation(df_c, params["deviation_metric"])
+
+    plot_worker = PlotWorker(plot_workers)
+    ret = []
+    try:
+        for k, df_e in zip(keys, groups):
+            if writer is not None and not writer.claim(k):
+                continue
+            with context(time_point=k), stage("timepoint", filename=filename):
+                # plots of each group are written to different files
+                kwargs = dict(kwargs_DNB)
+                if kwargs.get("plot_file_suffix", None) is None:
+                    kwargs["plot_file_suffix"] = k
+                kwargs = set_auto_params(kwargs)
+                dnb, _, df_x = two_step(
+                    df_e, df_c, dev_ctrl=dev_ctrl, **kwargs)
+                with stage("plot"):
+                    plot_dnb(df_e, df_c, dnb, df_x, kwargs,
+                             plot_worker=plot_worker)
+
+                df = dnb.copy()
+                df["time_point"] = k
+                if writer is not None:
+                    writer.write(k, df)
+                else:
+                    ret.append(df)
+    finally:
+        # wait for the plots of the last groups
+        plot_worker.close()
+
+    return finish(ret, params, writer)
+
+
+def dnb_tb_arrays(keys, groups, kwargs_DNB, writer=None, plot_workers=1):
+    # DNB of datasets already in memory, e.g. windows of a time series, without writing them to files.
+    # groups: (df_e, df_c) for each key, the experimental and the control groups (variables x samples),
+    #   which may be views of the same array.
+    # the other arguments are the same as `dnb_tb_iterate`.
+    # the deviation of identical control groups is calculated once.
+    params = set_auto_params(dict(kwargs_DNB))
+    control_cache = ControlCache()
+
+    plot_worker = PlotWorker(plot_workers)
+    ret = []
+    try:
+        for k, (df_e, df_c) in zip(keys, groups):
+            if writer is not None and not writer.claim(k):
+                continue
+            with context(time_point=k), stage("timepoint"):
+                # plots of each dataset are written to different files
+                kwargs = dict(kwargs_DNB)
+                if kwargs.get("plot_file_suffix", None) is None:
+                    kwargs["plot_file_suffix"] = k
+                kwargs = set_auto_params(kwargs)
+                dev_ctrl = control_cache.deviation(
+                    df_c, kwargs["deviation_metric"])
+                dnb, _, df_x = two_step(
+                    df_e, df_c, dev_ctrl=dev_ctrl, **kwargs)
+                with stage("plot"):
+                    plot_dnb(df_e, df_c, dnb, df_x, kwargs,
+                             plot_worker=plot_worker)
+
+                df = dnb.copy()
+                df["time_point"] = k
+                if writer is not None:
+                    writer.write(k, df)
+                else:
+                    ret.append(df)
+    finally:
+        # wait for the plots of the last datasets
+        plot_worker.close()
+
+    return finish(ret, params, writer)
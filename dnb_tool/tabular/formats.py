@@ -0,0 +1,263 @@
+import csv
+import functools
+import json
+import os
+import numpy as np
+import pandas as pd
+
+
+# supported formats of input tables.
+# in every format, the first column (or the stored index) is used as index.
+#   .csv: text table, as read by `pd.read_csv(filename, index_col=0)`
+#   .parquet, .feather: columnar binary tables (require pyarrow)
+#   .npz: NumPy archive with arrays "data" (2-dim), "index" and "columns"
+INPUT_SUFFIXES = (".csv", ".parquet", ".feather", ".npz")
+
+# directory of binary copies of csv files, placed next to the csv files
+CONVERSION_CACHE_DIR = ".dnb_cache"
+
+
+def input_format(filename):
+    # format of input file determined by its extension
+    for suffix in INPUT_SUFFIXES:
+        if filename.endswith(suffix):
+            return suffix[1:]
+    raise ValueError(
+        f"\"{filename}\" is not supported. The input file should be one of " + ", ".join(INPUT_SUFFIXES))
+
+
+def has_pyarrow():
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+########
+#### header ####
+########
+
+def parquet_header(filename):
+    # column labels and the stored index of parquet file, without reading values
+    import pyarrow.parquet as pq
+    schema = pq.read_schema(filename)
+    meta = schema.pandas_metadata or {}
+    # RangeIndex is stored as metadata (dict), not as a column
+    index_columns = [c for c in meta.get("index_columns", [])
+                     if isinstance(c, str)]
+    names = [n for n in schema.names if n not in index_columns]
+    return names, index_columns
+
+
+def feather_header(filename):
+    # column labels of feather file, without reading values
+    import pyarrow.ipc
+    with pyarrow.ipc.open_file(filename) as reader:
+        return list(reader.schema.names)
+
+
+def csv_first_column(filename):
+    # labels in the first column of csv file and their line numbers,
+    # obtained by scanning lines without parsing the values.
+    # the result of the latest files is kept while mtime and size are unchanged (as binary copies),
+    # so that a file is scanned once by `read_index` and `read_table`
+    signature = file_signature(filename)
+    labels, line_numbers = scan_first_column(
+        os.path.abspath(filename), signature["mtime_ns"], signature["size"])
+    return list(labels), list(line_numbers)
+
+
+@functools.lru_cache(maxsize=16)
+def scan_first_column(path, mtime_ns, size):
+    # mtime_ns, size: keys of the cache
+    labels, line_numbers = [], []
+    with open(path, "r", newline="") as f:
+        next(f)  # header
+        for i, line in enumerate(f, start=1):
+            line = line.rstrip("\r\n")
+            # blank lines are skipped as in `pd.read_csv`
+            if line.strip() == "":
+                continue
+            if line.startswith('"'):
+                label = next(csv.reader([line]))[0]
+            else:
+                label = line.split(",", 1)[0]
+            labels.append(label)
+            line_numbers.append(i)
+    return tuple(labels), tuple(line_numbers)
+
+
+def read_header(filename, conversion_cache=False):
+    # column labels (excluding index) of the input table, without reading values
+    fmt = input_format(filename)
+    if fmt == "csv":
+        sidecar = conversion_cache and find_sidecar(filename)
+        if sidecar:
+            return read_header(sidecar)
+        return list(pd.read_csv(filename, index_col=0, nrows=0).columns)
+    elif fmt == "parquet":
+        names, index_columns = parquet_header(filename)
+        return names if len(index_columns) > 0 else names[1:]
+    elif fmt == "feather":
+        return feather_header(filename)[1:]
+    else:  # npz
+        with np.load(filename, allow_pickle=False) as f:
+            return list(f["columns"])
+
+
+def read_index(filename, conversion_cache=False):
+    # row labels (the first column) of the input table, without reading values
+    fmt = input_format(filename)
+    if fmt == "csv":
+        sidecar = conversion_cache and find_sidecar(filename)
+        if sidecar:
+            return read_index(sidecar)
+        labels, _ = csv_first_column(filename)
+        return labels
+    elif fmt == "parquet":
+        names, index_columns = parquet_header(filename)
+        if len(index_columns) == 0:
+            return list(pd.read_parquet(filename, columns=names[:1]).iloc[:, 0].astype(str))
+        return list(pd.read_parquet(filename, columns=[]).index.astype(str))
+    elif fmt == "feather":
+        names = feather_header(filename)
+        return list(pd.read_feather(filename, columns=names[:1]).iloc[:, 0].astype(str))
+    else:  # npz
+        with np.load(filename, allow_pickle=False) as f:
+            return list(f["index"].astype(str))
+
+
+########
+#### read ####
+########
+
+def read_npz(filename, columns=None, rows=None):
+    with np.load(filename, allow_pickle=False) as f:
+        data = f["data"]
+        labels = f["columns"]
+        index = f["index"]
+        if columns is not None:
+            data = data[:, columns]
+            labels = labels[columns]
+        if rows is not None:
+            data = data[rows]
+            index = index[rows]
+        index = pd.Index(index)
+        if "index_name" in f.files:
+            index.name = str(f["index_name"])
+    return pd.DataFrame(data, index=index, columns=list(labels))
+
+
+def read_table(filename, columns=None, rows=None, conversion_cache=False):
+    # read input table whose first column is the index
+    # columns: positions of columns to read (excluding index). if None, all columns are read.
+    # rows: positions of rows to read. if None, all rows are read.
+    # conversion_cache: for csv files, keep a binary copy and read it in later runs
+    fmt = input_format(filename)
+    if fmt == "csv":
+        if conversion_cache:
+            sidecar = find_sidecar(filename)
+            if sidecar:
+                return read_table(sidecar, columns=columns, rows=rows)
+            signature = file_signature(filename)
+            df = pd.read_csv(filename, index_col=0)
+            write_sidecar(filename, df, signature)
+            return select_rows_and_columns(df, columns, rows)
+        kwargs = {}
+        if columns is not None:
+            kwargs["usecols"] = [0] + [c + 1 for c in columns]
+        if rows is not None:
+            # skip lines other than the header and the specified rows
+            _, line_numbers = csv_first_column(filename)
+            keep = set([0] + [line_numbers[r] for r in rows])
+            kwargs["skiprows"] = lambda i: i not in keep
+        return pd.read_csv(filename, index_col=0, **kwargs)
+    elif fmt == "parquet":
+        names, index_columns = parquet_header(filename)
+        if len(index_columns) == 0:
+            # no index is stored, so the first column is used as index as in csv
+            first, names = names[0], names[1:]
+            selected = names if columns is None else [names[c] for c in columns]
+            df = pd.read_parquet(
+                filename, columns=[first] + selected).set_index(first)
+        else:
+            selected = None if columns is None else [
+                names[c] for c in columns]
+            df = pd.read_parquet(filename, columns=selected)
+        return select_rows_and_columns(df, None, rows)
+    elif fmt == "feather":
+        names = feather_header(filename)
+        first, names = names[0], names[1:]
+        selected = names if columns is None else [names[c] for c in columns]
+        df = pd.read_feather(
+            filename, columns=[first] + selected).set_index(first)
+        return select_rows_and_columns(df, None, rows)
+    else:  # npz
+        return read_npz(filename, columns=columns, rows=rows)
+
+
+def select_rows_and_columns(df, columns, rows):
+    if columns is not None:
+        df = df.iloc[:, columns]
+    if rows is not None:
+        df = df.iloc[rows]
+    return df
+
+
+########
+#### conversion cache of csv files ####
+########
+
+def sidecar_paths(filename):
+    # paths of binary copy of csv file and its metadata
+    dirname, basename = os.path.split(filename)
+    cache_dir = os.path.join(dirname, CONVERSION_CACHE_DIR)
+    suffix = ".parquet" if has_pyarrow() else ".npz"
+    return (os.path.join(cache_dir, basename + suffix),
+            os.path.join(cache_dir, basename + ".json"))
+
+
+def file_signature(filename):
+    # the binary copy is valid while mtime and size of the csv file are unchanged
+    st = os.stat(filename)
+    return {"mtime_ns": st.st_mtime_ns, "size": st.st_size}
+
+
+def find_sidecar(filename):
+    # return the path of valid binary copy, or None
+    path, meta_path = sidecar_paths(filename)
+    if not (os.path.exists(path) and os.path.exists(meta_path)):
+        return None
+    with open(meta_path, "r") as f:
+        meta = json.load(f)
+    if meta != file_signature(filename):
+        return None
+    return path
+
+
+def write_sidecar(filename, df, signature):
+    # signature: `file_signature` of the csv file taken before it was read
+    path, meta_path = sidecar_paths(filename)
+    if path.endswith(".npz") and df.values.dtype == object:
+        # non-numeric values cannot be stored without pickle
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # write to temporary files first, so that a broken copy is never read
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        if path.endswith(".parquet"):
+            df.to_parquet(f)
+        else:
+            index = df.index.to_numpy()
+            if index.dtype == object:
+                index = index.astype(str)
+            arrays = {"data": df.values, "index": index,
+                      "columns": np.array(df.columns, dtype=str)}
+            if df.index.name is not None:
+                arrays["index_name"] = str(df.index.name)
+            np.savez(f, **arrays)
+    os.replace(tmp, path)
+    with open(meta_path + ".tmp", "w") as f:
+        json.dump(signature, f)
+    os.replace(meta_path + ".tmp", meta_path)
@@ -0,0 +1,193 @@
+import numpy as np
+import pandas as pd
+
+from ..instrument import get_logger, stage
+from .core import deviation_array
+from .dnb import set_auto_params
+from .read_files import read_csv_and_split, read_csv_and_select
+
+logger = get_logger(__name__)
+
+
+########
+#### single-sample (landscape) DNB ####
+########
+
+# each sample is added to the reference (control) cohort, and the changes of
+# the standard deviations and the correlations caused by the sample are measured:
+#   sd_in: mean |SD' - SD| of the genes in the module
+#   pcc_in: mean |PCC' - PCC| of the pairs of genes in the module
+#   pcc_out: mean |PCC' - PCC| of the pairs between the module and the other genes
+#   score: sd_in * pcc_in / pcc_out
+# where ' denotes the reference with the sample.
+#
+# adding a sample y to n reference samples with mean mu and scatter matrix S
+# is a rank-1 update, S' = S + n / (n + 1) * (y - mu) (y - mu)^T,
+# so the perturbed correlations of all samples are computed from S without recomputing
+# the correlation matrix for each sample.
+
+# the number of elements of the perturbed matrices allocated at a time
+BATCH_ELEMENTS = 1 << 22
+
+
+def perturbation_scores(arr_ref, arr_samples, modules, outside, batch_size=None):
+    # arr_ref: reference values (genes x reference samples)
+    # arr_samples: values of the samples to be scored (genes x samples)
+    # modules: list of position arrays of the genes in each module
+    # outside: position array of the genes compared with the modules (those in the module are excluded)
+    # returns arrays of sd_in, pcc_in, pcc_out (samples x modules)
+    n = arr_ref.shape[1]
+    c = n / (n + 1)
+    genes = np.unique(np.concatenate(list(modules) + [outside]))
+    # positions in `genes`
+    pos = {g: i for i, g in enumerate(genes)}
+
+    X = arr_ref[genes]
+    mu = X.mean(axis=1)
+    Xc = X - mu[:, None]
+    S = Xc @ Xc.T
+    d = np.diag(S).copy()
+    # correlation and standard deviation of the reference
+    C = S / np.sqrt(np.outer(d, d))
+    sd = np.sqrt(d / (n - 1))
+    # deviations of the samples from the reference mean (samples x genes)
+    D = (arr_samples[genes] - mu[:, None]).T
+
+    n_samples = D.shape[0]
+    sd_in = np.full((n_samples, len(modules)), np.nan)
+    pcc_in = np.full((n_samples, len(modules)), np.nan)
+    pcc_out = np.full((n_samples, len(modules)), np.nan)
+
+    outside_set = np.array([pos[g] for g in outside], dtype=int)
+    for k, module in enumerate(modules):
+        m = np.array([pos[g] for g in module], dtype=int)
+        o = np.setdiff1d(outside_set, m)
+        size = max(1, len(m) * max(len(m), len(o)))
+        bs = batch_size or max(1, BATCH_ELEMENTS // size)
+        iu = np.triu_indices(len(m), k=1)
+        for s in range(0, n_samples, bs):
+            Dm = D[s:s+bs][:, m]
+            Do = D[s:s+bs][:, o]
+            # updated diagonal, which gives the standard deviations and the normalization
+            dm = d[m] + c * Dm ** 2
+            do = d[o] + c * Do ** 2
+            sd_in[s:s+bs, k] = np.mean(
+                np.abs(np.sqrt(dm / n) - sd[m]), axis=1)
+            if len(m) > 1:
+                Smm = S[np.ix_(m, m)] + c * Dm[:, :, None] * Dm[:, None, :]
+                Cmm = Smm / np.sqrt(dm[:, :, None] * dm[:, None, :])
+                pcc_in[s:s+bs, k] = np.mean(
+                    np.abs(Cmm - C[np.ix_(m, m)])[:, iu[0], iu[1]], axis=1)
+            if len(o) > 0:
+                Smo = S[np.ix_(m, o)] + c * Dm[:, :, None] * Do[:, None, :]
+                Cmo = Smo / np.sqrt(dm[:, :, None] * do[:, None, :])
+                pcc_out[s:s+bs, k] = np.mean(
+                    np.abs(Cmo - C[np.ix_(m, o)]), axis=(1, 2))
+    return sd_in, pcc_in, pcc_out
+
+
+def landscape_dnb(df_samples, df_ctrl, dnb, candidates, batch_size=None):
+    # single-sample DNB scores of each sample for each DNB module found by `two_step`
+    # df_samples: values of the samples to be scored (genes x samples), e.g. the experimental group
+    # df_ctrl: values of the reference (control) group
+    # dnb: result of `two_step`. modules are its clusters ("cluster" column, with "output_metrics"),
+    #   or all DNB variables are a module without it.
+    # candidates: labels of genes compared with the modules for pcc_out,
+    #   e.g. the index of `df_x` returned by `two_step` (genes that passed the 1st step)
+    # returns DataFrame with columns "sample", "cluster", "sd_in", "pcc_in", "pcc_out" and "score"
+    columns = ["sample", "cluster", "sd_in", "pcc_in", "pcc_out", "score"]
+    if len(dnb) == 0:
+        return pd.DataFrame([], columns=columns)
+    index = df_ctrl.index
+    if "cluster" in dnb.columns:
+        clusters = list(dict.fromkeys(dnb["cluster"]))
+        modules = [index.get_indexer(dnb.loc[dnb["cluster"] == g, "dnb"])
+                   for g in clusters]
+    else:
+        clusters = [0]
+        modules = [index.get_indexer(dnb["dnb"])]
+    outside = index.get_indexer(pd.Index(candidates))
+
+    sd_in, pcc_in, pcc_out = perturbation_scores(
+        df_ctrl.to_numpy(dtype=float),
+        df_samples.reindex(index).to_numpy(dtype=float),
+        modules, outside, batch_size=batch_size)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        score = sd_in * pcc_in / pcc_out
+
+    n_samples = df_samples.shape[1]
+    return pd.DataFrame({
+        "sample": np.repeat(df_samples.columns.to_numpy(), len(clusters)),
+        "cluster": np.tile(clusters, n_samples),
+        "sd_in": sd_in.ravel(),
+        "pcc_in": pcc_in.ravel(),
+        "pcc_out": pcc_out.ravel(),
+        "score": score.ravel(),
+    }, columns=columns)
+
+
+def step1_candidates(df_e, df_c, kwargs_DNB):
+    # labels of genes that pass the 1st step of `two_step` (the index of its `df_x`),
+    # for the timepoints whose DNB modules are not computed in this process
+    dev_expr = deviation_array(df_e.to_numpy(dtype=float), kwargs_DNB["deviation_metric"])
+    dev_ctrl = deviation_array(df_c.to_numpy(dtype=float), kwargs_DNB["deviation_metric"])
+    return df_e.index[dev_expr > kwargs_DNB["thres_gene_filtering"] * dev_ctrl]
+
+
+class LandscapeCollector:
+    # single-sample DNB scores of the timepoints analyzed by `dnb_tb_iterate` (its `on_timepoint`).
+    # the scores are computed on the groups already read, with the DNB modules of the main pass,
+    # so that the files are not read and `two_step` is not run again.
+    # modules are the clusters with the option "output_metrics" (see `landscape_dnb`).
+
+    def __init__(self, kwargs_DNB):
+        self.kwargs_DNB = set_auto_params(dict(kwargs_DNB))
+        # key -> scores
+        self.scores = {}
+
+    def __call__(self, k, df_e, df_c, dnb, df_x):
+        # df_x: `df_x` of `two_step`, or None when the result is taken from the cache
+        with stage("landscape"):
+            # the control group of a separate file is aligned to the genes of this timepoint
+            df_c = df_c.reindex(df_e.index)
+            if df_x is not None:
+                candidates = df_x.index
+            elif len(dnb) > 0:
+                candidates = step1_candidates(df_e, df_c, self.kwargs_DNB)
+            else:
+                candidates = []
+            df = landscape_dnb(df_e, df_c, dnb, candidates)
+        df["time_point"] = k
+        self.scores[k] = df
+
+
+def landscape_iterate(keys, filenames, key_control, key_experimental, kwargs_DNB, result,
+                      control_filename=None, conversion_cache=False, orientation=None):
+    # single-sample DNB scores of the experimental samples of each input file,
+    # with the DNB modules in `result` (the output of `dnb_tb_iterate` with "output_metrics"),
+    # e.g. for the timepoints analyzed by other workers or in the previous run.
+    # returns DataFrame of `landscape_dnb` with "time_point" column
+    kwargs_DNB = set_auto_params(dict(kwargs_DNB))
+    result_keys = result["time_point"].astype(str)
+    ret = []
+    if control_filename is not None:
+        df_c = read_csv_and_select(control_filename, key_control,
+                                   conversion_cache=conversion_cache)
+    for k, filename in zip(keys, filenames):
+        logger.info(f"single-sample DNB scores for \"{filename}\"")
+        if control_filename is not None:
+            df_e = read_csv_and_select(filename, key_experimental,
+                                       conversion_cache=conversion_cache, orientation=orientation)
+            df_c_k = df_c.reindex(df_e.index)
+        else:
+            df_c_k, df_e = read_csv_and_split(filename, key_control, key_experimental,
+                                              conversion_cache=conversion_cache, orientation=orientation)
+        dnb = result[result_keys == str(k)].copy()
+        # labels in the result file may have been parsed as numbers
+        pos = df_e.index.astype(str).get_indexer(dnb["dnb"].astype(str))
+        dnb["dnb"] = df_e.index[pos]
+        candidates = step1_candidates(df_e, df_c_k, kwargs_DNB) if len(dnb) > 0 else []
+        df = landscape_dnb(df_e, df_c_k, dnb, candidates)
+        df["time_point"] = k
+        ret.append(df)
+    return pd.concat(ret, axis=0).reset_index(drop=True)
@@ -0,0 +1,207 @@
+import glob
+import json
+import os
+import pandas as pd
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from ..instrument import get_logger
+from .cache import params_for_key
+
+logger = get_logger(__name__)
+
+
+# columns of the result of `two_step` (with the option "output_metrics")
+RESULT_COLUMNS = ["dnb", "cluster", "clustersize",
+                  "dev_expr", "dev_ctrl", "cor_mean"]
+
+
+def result_columns(output_metrics):
+    # columns of the output file
+    if output_metrics:
+        return RESULT_COLUMNS + ["time_point"]
+    else:
+        return ["dnb", "time_point"]
+
+
+def write_json(filename, d):
+    # write to a temporary file first, so that the file is never broken
+    tmp = filename + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(d, f, indent=2, default=str)
+    os.replace(tmp, filename)
+
+
+class ResultWriter:
+    # writes the result of each timepoint as soon as it is finished.
+    # a checkpoint manifest ("{output_filename}.manifest.json") records the completed timepoints,
+    # so that an interrupted run can be resumed from the last completed one.
+    #
+    # output_filename: ".csv" file to which the results are appended,
+    #   or ".parquet" directory in which the result of each timepoint is written as a part file
+    # params: parameters of the analysis. a run is resumed only with the same parameters
+    #   (except for the plot options).
+    # resume: continue from the manifest of the previous run
+
+    def __init__(self, output_filename, params, resume=False):
+        self.output_filename = output_filename
+        self.format = "parquet" if output_filename.endswith(
+            ".parquet") else "csv"
+        self.columns = result_columns(params["output_metrics"])
+        self.manifest_filename = output_filename + ".manifest.json"
+        self.manifest = {
+            "output_filename": output_filename,
+            "format": self.format,
+            "params": json.loads(json.dumps(params_for_key(params), default=str)),
+            "completed": [],
+            "offset": 0,
+            "finished": False,
+        }
+        if resume and os.path.exists(self.manifest_filename):
+            self._resume()
+        else:
+            self._start()
+
+    def _start(self):
+        if self.format == "csv":
+            # write only the header
+            with open(self.output_filename, "w") as f:
+                pd.DataFrame([], columns=self.columns).to_csv(f, index=False)
+                self.manifest["offset"] = f.tell()
+        else:
+            os.makedirs(self.output_filename, exist_ok=True)
+            for part in glob.glob(os.path.join(self.output_filename, "part-*.parquet")):
+                os.remove(part)
+        write_json(self.manifest_filename, self.manifest)
+
+    def _resume(self):
+        with open(self.manifest_filename, "r") as f:
+            manifest = json.load(f)
+        if manifest["params"] != self.manifest["params"] or manifest["format"] != self.format:
+            raise ValueError(
+                f"The parameters of the previous run in \"{self.manifest_filename}\" are different. Run without resuming.")
+        if not self._output_intact(manifest):
+            logger.warning(
+                f"the output \"{self.output_filename}\" of the previous run is missing or truncated. The run starts from the beginning.")
+            self._start()
+            return
+        self.manifest = manifest
+        self.manifest["finished"] = False
+        if self.format == "csv":
+            # discard rows written after the last checkpoint
+            with open(self.output_filename, "r+") as f:
+                f.truncate(self.manifest["offset"])
+        else:
+            # discard part files written after the last checkpoint
+            parts = set(self.manifest.get("parts", []))
+            for part in glob.glob(os.path.join(self.output_filename, "part-*.parquet")):
+                if os.path.basename(part) not in parts:
+                    os.remove(part)
+        logger.info(
+            f"resume from \"{self.manifest_filename}\": {len(self.completed())} timepoints are already completed")
+
+    def _output_intact(self, manifest):
+        # whether the output contains everything recorded in the manifest
+        if self.format == "csv":
+            return os.path.isfile(self.output_filename) and \
+                os.path.getsize(self.output_filename) >= manifest["offset"]
+        return all(os.path.isfile(os.path.join(self.output_filename, part))
+                   for part in manifest.get("parts", []))
+
+    def completed(self):
+        # keys of completed timepoints
+        return [str(k) for k in self.manifest["completed"]]
+
+    def is_completed(self, key):
+        return str(key) in self.completed()
+
+    def claim(self, key):
+        # returns True if the timepoint is to be processed
+        return not self.is_completed(key)
+
+    def write(self, key, df):
+        # df: result of a timepoint, which has "time_point" column
+        df = df.reindex(columns=self.columns)
+        if self.format == "csv":
+            with open(self.output_filename, "a") as f:
+                df.to_csv(f, header=False, index=False)
+                f.flush()
+                os.fsync(f.fileno())
+                self.manifest["offset"] = f.tell()
+        elif len(df) > 0:
+            part = f"part-{len(self.manifest['completed']):06d}.parquet"
+            path = os.path.join(self.output_filename, part)
+            # the temporary file starts with "." so that it is not read as a part
+            tmp = os.path.join(self.output_filename, "." + part + ".tmp")
+            df.to_parquet(tmp, index=False)
+            os.replace(tmp, path)
+            self.manifest.setdefault("parts", []).append(part)
+        self.manifest["completed"].append(key)
+        write_json(self.manifest_filename, self.manifest)
+
+    def close(self):
+        self.manifest["finished"] = True
+        write_json(self.manifest_filename, self.manifest)
+
+
+class BackgroundWriter:
+    # writes the results to `writer` (`ResultWriter` or `ShardWriter`) in the order of timepoints
+    # by a thread, so that writing overlaps with the analysis of the next timepoint.
+    # at most `max_pending` results wait to be written, and an error of a write is raised
+    # at the next `check` or `write`, so that the run stops soon after the output fails.
+    # the writes after a failed one are skipped.
+    #
+    # background: if False, each result is written immediately
+
+    def __init__(self, writer, background=True, max_pending=2):
+        self.writer = writer
+        self.max_pending = max_pending
+        self.executor = ThreadPoolExecutor(max_workers=1) if background else None
+        self.futures = deque()
+        self.failed = False
+
+    def claim(self, key):
+        return self.writer.claim(key)
+
+    def _write(self, key, df):
+        if self.failed:
+            return
+        try:
+            self.writer.write(key, df)
+        except BaseException:
+            self.failed = True
+            raise
+
+    def _collect(self, max_pending):
+        # raise the error of a finished write, and wait until at most `max_pending` writes remain
+        while self.futures and (self.futures[0].done() or len(self.futures) > max_pending):
+            self.futures.popleft().result()
+
+    def check(self):
+        self._collect(self.max_pending)
+
+    def write(self, key, df):
+        if self.executor is None:
+            self.writer.write(key, df)
+            return
+        self._collect(self.max_pending - 1)
+        self.futures.append(self.executor.submit(self._write, key, df))
+
+    def wait(self):
+        self._collect(0)
+
+    def close(self):
+        # wait for the remaining writes (the writer itself is closed by its owner)
+        try:
+            self.wait()
+        finally:
+            if self.executor is not None:
+                self.executor.shutdown()
+
+
+def read_result(output_filename):
+    # read the output written by `ResultWriter`
+    if output_filename.endswith(".parquet"):
+        return pd.read_parquet(output_filename)
+    else:
+        return pd.read_csv(output_filename)
@@ -0,0 +1,81 @@
+import contextvars
+import queue
+import threading
+
+
+class Prefetcher:
+    # prepares the next items in a background thread while the current one is processed,
+    # e.g. reads, splits and converts the next input files while `two_step` runs on the current one.
+    # prepared items wait in a queue of `depth` slots, and the thread blocks while the queue is full,
+    # so that at most `depth` items (and the one being prepared) are kept in memory.
+    #
+    # items: iterable of tuples, the arguments of `prepare`
+    # prepare: function called with each item in the background thread
+    # depth: the number of items prepared ahead. if 0, each item is prepared when it is taken.
+    #
+    #   with Prefetcher(zip(keys, filenames), read, depth=2) as prefetcher:
+    #       for (k, filename), data in prefetcher:
+    #           ...
+    #
+    # an error of `prepare` is raised when its item is taken, after the preceding items.
+
+    def __init__(self, items, prepare, depth=1):
+        self.items = items
+        self.prepare = prepare
+        self.depth = depth
+        self.stop = threading.Event()
+        self.thread = None
+        if depth > 0:
+            self.queue = queue.Queue(maxsize=depth)
+            # the fields of the records (`instrument.context`) are passed to the thread
+            ctx = contextvars.copy_context()
+            self.thread = threading.Thread(
+                target=ctx.run, args=(self._run,), daemon=True)
+            self.thread.start()
+
+    def _run(self):
+        for item in self.items:
+            try:
+                entry = (item, self.prepare(*item), None)
+            except BaseException as e:
+                entry = (item, None, e)
+            if not self._put(entry) or entry[2] is not None:
+                return
+        # end of the items
+        self._put(None)
+
+    def _put(self, entry):
+        # wait for a free slot. returns False if the consumer has stopped.
+        while not self.stop.is_set():
+            try:
+                self.queue.put(entry, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def __iter__(self):
+        if self.thread is None:
+            for item in self.items:
+                yield item, self.prepare(*item)
+            return
+        while True:
+            entry = self.queue.get()
+            if entry is None:
+                return
+            item, data, error = entry
+            if error is not None:
+                raise error
+            yield item, data
+
+    def close(self):
+        # stop preparing the items not taken yet
+        self.stop.set()
+        if self.thread is not None:
+            self.thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -1,6 +1,12 @@
 import numpy as np
 import pandas as pd
 import os
+import re
+
+from ..instrument import get_logger
+from .formats import INPUT_SUFFIXES, read_header, read_index, read_table
+
+logger = get_logger(__name__)
 
 
 ########
@@ -43,7 +49,7 @@ def filter_by_prefix(x, prefix, suffix):
     values = []
     for s in x:
         if s.startswith(prefix) and s.endswith(suffix):
-            k = s.lstrip(prefix).rstrip(suffix).strip()
+            k = s[len(prefix):len(s)-len(suffix)].strip()
             if len(k) > 0 and (k[0] == "_" or k[0] == "."):
                 k = k[1:]
             keys.append(k)
@@ -53,17 +59,26 @@ def filter_by_prefix(x, prefix, suffix):
     return keys, values
 
 
-def get_filenames(path, prefix):
+def get_filenames(path, prefix, suffixes=INPUT_SUFFIXES):
     # collect files that matches in the specified format.
     # format is:
     # "{path}/{prefix}{key}.csv",
     # "{path}/{prefix}_{key}.csv", or
     # "{path}/{prefix}.{key}.csv".
+    # binary tables (".parquet", ".feather", ".npz") are also collected in the same way.
 
     # collect all files in `path`
     ls = os.listdir(path)
     # extract keys and sort them by keys
-    keys, filenames = filter_by_prefix(ls, prefix, ".csv")
+    keys, filenames = [], []
+    for suffix in suffixes:
+        k, v = filter_by_prefix(ls, prefix, suffix)
+        keys.extend(k)
+        filenames.extend(v)
+    if len(set(keys)) != len(keys):
+        dup = [k for k in keys if keys.count(k) > 1][0]
+        raise ValueError(
+            f"multiple input files are found for the key \"{dup}\". Keep only one format for each key.")
     keys, filenames = sort_keys(keys, filenames)
     # return keys and corresponding list of fullpaths
     return keys, [path + "/" + v for v in filenames]
@@ -97,43 +112,190 @@ def split_dataframe(df, key_control, key_experimental):
     return df_c, df_e
 
 
-def read_csv_and_split(filename, key_control, key_experimental, ignore_extra_columns=True):
-    # read csv file (use the first column as index)
-    df = pd.read_csv(filename, index_col=0)
+def read_labels(filename, orientation, conversion_cache=False):
+    # labels by which the groups are classified, without reading values.
+    # "columns": the header row, "rows": the first column (transposed table).
+    if orientation == "columns":
+        return read_header(filename, conversion_cache=conversion_cache)
+    elif orientation == "rows":
+        return read_index(filename, conversion_cache=conversion_cache)
+    else:
+        raise ValueError(
+            f"\"{orientation}\" for orientation is not supported. Please use \"columns\" or \"rows\".")
 
-    # split into control and experimental by column name
-    df_c, df_e = split_dataframe(
-        df, key_control, key_experimental)
 
-    def check_success(df, df_c, df_e):
+def sniff_orientation(filename, key_control, key_experimental, ignore_extra_columns, conversion_cache=False):
+    # detect the orientation of the table and the positions of control and experimental groups,
+    # by reading only the header row and the first column.
+    # returns None for orientation when neither of them is classified.
+    def check_success(labels, idx_c, idx_e):
         if ignore_extra_columns:
-            return df_c.size != 0 and df_e.size != 0
+            return len(idx_c) != 0 and len(idx_e) != 0
         else:
-            return (df_c.shape[1] + df_e.shape[1]) == df.shape[1]
-
-    # transposed DataFrame is also accepted
-    # if failed, try the transposed one
-    if not check_success(df, df_c, df_e):
-        df_c1, df_e1 = split_dataframe(df.T, key_control, key_experimental)
-        # when success, overwrite the result
-        if check_success(df.T, df_c1, df_e1):
-            df_c, df_e = df_c1, df_e1
+            return (len(idx_c) + len(idx_e)) == len(labels)
+
+    for orientation in ["columns", "rows"]:
+        labels = read_labels(filename, orientation,
+                             conversion_cache=conversion_cache)
+        idx_c, _ = filter_by_substr(labels, key_control)
+        idx_e, _ = filter_by_substr(labels, key_experimental)
+        if check_success(labels, idx_c, idx_e):
+            return orientation, idx_c, idx_e
+        if orientation == "columns":
+            # kept for the case neither orientation succeeds
+            ret = None, idx_c, idx_e
+    return ret
+
+
+def read_groups(filename, orientation, positions, conversion_cache=False):
+    # read only the specified columns (or rows for transposed table),
+    # and return DataFrames for each list of positions, whose columns are the samples.
+    selected = sorted(set([i for idx in positions for i in idx]))
+    if orientation == "columns":
+        df = read_table(filename, columns=selected,
+                        conversion_cache=conversion_cache)
+    else:
+        df = read_table(filename, rows=selected,
+                        conversion_cache=conversion_cache).T
+    # positions in the table that contains only the selected labels
+    pos = {c: i for i, c in enumerate(selected)}
+    return [df.iloc[:, [pos[i] for i in idx]] for idx in positions]
+
+
+def read_csv_and_split(filename, key_control, key_experimental, ignore_extra_columns=True, conversion_cache=False, orientation=None):
+    # conversion_cache: keep a binary copy of csv file and read it in later runs
+    # orientation: "columns" if samples are in columns, "rows" if the table is transposed.
+    #   if None, it is detected from the header row and the first column.
+
+    if orientation is None:
+        orientation, idx_c, idx_e = sniff_orientation(
+            filename, key_control, key_experimental, ignore_extra_columns, conversion_cache=conversion_cache)
+        success = orientation is not None
+        if not success:
+            orientation = "columns"
+    else:
+        labels = read_labels(filename, orientation,
+                             conversion_cache=conversion_cache)
+        idx_c, _ = filter_by_substr(labels, key_control)
+        idx_e, _ = filter_by_substr(labels, key_experimental)
+        if ignore_extra_columns:
+            success = len(idx_c) != 0 and len(idx_e) != 0
         else:
-            if not ignore_extra_columns:
-                raise ValueError(
-                    "Data is not correctly classified as control or experimental. Check the `key_control' and `key_experimental' settings or the `ignore_extra_columns' setting.")
+            success = (len(idx_c) + len(idx_e)) == len(labels)
+
+    if not success and not ignore_extra_columns:
+        raise ValueError(
+            "Data is not correctly classified as control or experimental. Check the `key_control' and `key_experimental' settings or the `ignore_extra_columns' setting.")
+
+    # read only the columns of each group in the detected orientation
+    df_c, df_e = read_groups(filename, orientation, [idx_c, idx_e],
+                             conversion_cache=conversion_cache)
     return df_c, df_e
 
+
+def read_csv_and_select(filename, key, conversion_cache=False, orientation=None):
+    # read csv file that contains only one group (e.g. a separate control file)
+    # and take the columns that include `key`
+    orientations = ["columns", "rows"] if orientation is None else [orientation]
+    for orientation in orientations:
+        labels = read_labels(filename, orientation,
+                             conversion_cache=conversion_cache)
+        idx, _ = filter_by_substr(labels, key)
+        if len(idx) > 0:
+            df, = read_groups(filename, orientation, [idx],
+                              conversion_cache=conversion_cache)
+            return df
+    raise ValueError(
+        f"No column including \"{key}\" is found in \"{filename}\".")
+
+########
+#### wide table with many groups ####
+########
+
+
+def classify_groups(labels, pattern, exclude=()):
+    # positions of the labels of each experimental group in a wide table.
+    # pattern: regular expression whose first capturing group (or the whole match) is the group key,
+    #   e.g. r"expr_(\d+)" for "expr_1_a", "expr_1_b", "expr_2_a", ...,
+    #   or a dictionary {regular expression: group key}, where the first matching expression is used.
+    # exclude: positions not classified (e.g. the control group)
+    # returns sorted keys and the list of positions for each key
+    if isinstance(pattern, dict):
+        rules = [(re.compile(p), k) for p, k in pattern.items()]
+    else:
+        rules = [(re.compile(pattern), None)]
+    exclude = set(exclude)
+    groups = {}
+    for i, label in enumerate(labels):
+        if i in exclude:
+            continue
+        for regex, key in rules:
+            m = regex.search(str(label))
+            if m is None:
+                continue
+            if key is None:
+                key = m.group(1) if regex.groups > 0 else m.group(0)
+            groups.setdefault(str(key), []).append(i)
+            break
+    keys = list(groups.keys())
+    return sort_keys(keys, [groups[k] for k in keys])
+
+
+def column_view(arr, idx):
+    # columns of `arr`, as a view when they are consecutive
+    if len(idx) > 0 and np.array_equal(idx, np.arange(idx[0], idx[0] + len(idx))):
+        return arr[:, idx[0]:idx[0] + len(idx)]
+    return arr[:, idx]
+
+
+def read_wide(filename, key_control, pattern, conversion_cache=False, orientation=None):
+    # read a wide table that contains the control group and several experimental groups at once.
+    # key_control: string by which the control columns are classified
+    # pattern: regular expression or dictionary for the experimental groups (see `classify_groups`)
+    # orientation: "columns" or "rows" (transposed). if None, the one in which both the control
+    #   and the experimental groups are found is used.
+    # returns the control DataFrame, the group keys and the DataFrame of each group.
+    # the table is parsed once, and the groups share its values (consecutive columns are not copied).
+    orientations = ["columns", "rows"] if orientation is None else [orientation]
+    for orientation in orientations:
+        labels = read_labels(filename, orientation,
+                             conversion_cache=conversion_cache)
+        idx_c, _ = filter_by_substr(labels, key_control)
+        keys, positions = classify_groups(labels, pattern, exclude=idx_c)
+        if len(idx_c) > 0 and len(keys) > 0:
+            break
+    else:
+        raise ValueError(
+            f"The control group (key=\"{key_control}\") and the experimental groups (pattern={pattern!r}) are not found in \"{filename}\".")
+
+    selected = sorted(set(idx_c).union(*positions))
+    if orientation == "columns":
+        df = read_table(filename, columns=selected,
+                        conversion_cache=conversion_cache)
+    else:
+        df = read_table(filename, rows=selected,
+                        conversion_cache=conversion_cache).T
+    # positions in the table that contains only the selected labels
+    pos = {c: i for i, c in enumerate(selected)}
+    arr = df.to_numpy(dtype=float)
+
+    def frame(idx):
+        idx = np.array([pos[i] for i in idx], dtype=int)
+        return pd.DataFrame(column_view(arr, idx), index=df.index,
+                            columns=df.columns[idx], copy=False)
+    return frame(idx_c), keys, [frame(idx) for idx in positions]
+
+
 ########
 #### check input file format ####
 ########
 
 
 def print_dataframe_summary(df):
-    print(df.iloc[:5].T.iloc[:5].T)
+    logger.info(df.iloc[:5].T.iloc[:5].T)
 
 
-def check_input(keys, filenames, key_control, key_experimental, ignore_extra_columns):
+def check_input(keys, filenames, key_control, key_experimental, ignore_extra_columns, control_filename=None, conversion_cache=False, orientation=None):
     # sample first file in the input dataset,
     # and check whether it is correctly splited to control and experimental
     # by displaying them.
@@ -141,20 +303,49 @@ def check_input(keys, filenames, key_control, key_experimental, ignore_extra_col
     if len(filenames) == 0:
         raise ValueError("No input files")
 
-    print("#### input files ####")
-    print(filenames)
+    if control_filename is not None:
+        # control group is given as a separate file,
+        # so the input files need to contain only experimental group
+        check_input_with_control_file(
+            filenames, control_filename, key_control, key_experimental, conversion_cache, orientation)
+        return
+
+    logger.info("#### input files ####")
+    logger.info(filenames)
 
-    print("#### the first input table (", filenames[0], ") ####")
+    logger.info(f"#### the first input table ( {filenames[0]} ) ####")
     print_dataframe_summary(
-        pd.read_csv(filenames[0], index_col=0))
+        read_table(filenames[0], conversion_cache=conversion_cache))
 
     df_c, df_e = read_csv_and_split(
-        filenames[0], key_control, key_experimental, ignore_extra_columns=ignore_extra_columns)
-    print(f"#### control group (key=\"{key_control}\") ####")
+        filenames[0], key_control, key_experimental, ignore_extra_columns=ignore_extra_columns, conversion_cache=conversion_cache, orientation=orientation)
+    logger.info(f"#### control group (key=\"{key_control}\") ####")
     print_dataframe_summary(df_c)
-    print(f"#### experimental group (key=\"{key_experimental}\") ####")
+    logger.info(f"#### experimental group (key=\"{key_experimental}\") ####")
     print_dataframe_summary(df_e)
 
     for filename in filenames:
         df_c, df_e = read_csv_and_split(
-            filename, key_control, key_experimental, ignore_extra_columns=ignore_extra_columns)
+            filename, key_control, key_experimental, ignore_extra_columns=ignore_extra_columns, conversion_cache=conversion_cache, orientation=orientation)
+
+
+def check_input_with_control_file(filenames, control_filename, key_control, key_experimental, conversion_cache, orientation):
+    logger.info("#### control file ####")
+    logger.info(control_filename)
+    df_c = read_csv_and_select(
+        control_filename, key_control, conversion_cache=conversion_cache)
+    logger.info(f"#### control group (key=\"{key_control}\") ####")
+    print_dataframe_summary(df_c)
+
+    logger.info("#### input files ####")
+    logger.info(filenames)
+
+    df_e = read_csv_and_select(
+        filenames[0], key_experimental, conversion_cache=conversion_cache, orientation=orientation)
+    logger.info(
+        f"#### experimental group (key=\"{key_experimental}\") in the first input table ( {filenames[0]} ) ####")
+    print_dataframe_summary(df_e)
+
+    for filename in filenames:
+        df_e = read_csv_and_select(
+            filename, key_experimental, conversion_cache=conversion_cache, orientation=orientation)
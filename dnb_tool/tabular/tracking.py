@@ -0,0 +1,144 @@
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from scipy.optimize import linear_sum_assignment
+
+from ..instrument import get_logger
+
+logger = get_logger(__name__)
+
+
+########
+#### tracking DNB clusters across timepoints ####
+########
+
+# the clusters of each timepoint (result of `dnb_tb_iterate` with "output_metrics") are encoded
+# as a sparse indicator matrix (genes x clusters), so that the overlaps of all pairs of clusters
+# between consecutive timepoints are a sparse product, A^T B.
+# the clusters are linked one-to-one by the assignment maximizing the total Jaccard index,
+# and pairs whose Jaccard index is less than `min_jaccard` are not linked.
+# a cluster not linked to the previous timepoint starts a new track,
+# so tracks end at a timepoint without clusters.
+#
+# composite index of a cluster: sd_in * pcc_in, where sd_in is the mean deviation of the genes
+# in the experimental group and pcc_in is the mean correlation in the cluster ("cor_mean").
+# the correlation with the genes outside the cluster is not kept in the result, so it is not included.
+
+
+def membership_matrices(df, time_points=None):
+    # df: result with "dnb", "cluster" and "time_point" columns
+    # time_points: all the time points in order, including those without clusters.
+    #   if None, the time points of `df` in the order of appearance.
+    # returns the time points, the genes,
+    # and for each time point, the cluster labels and the indicator matrix (genes x clusters)
+    gene_codes, genes = pd.factorize(df["dnb"])
+    if time_points is None:
+        time_codes, time_points = pd.factorize(df["time_point"])
+    else:
+        # keys are compared as strings, since the output file may be read back with other types
+        time_codes = pd.Index([str(k) for k in time_points]).get_indexer(
+            df["time_point"].astype(str))
+        if (time_codes < 0).any():
+            missing = df["time_point"][time_codes < 0].iloc[0]
+            raise ValueError(f"the time point \"{missing}\" of the result is not in the time points")
+        # the values of `df` are used for the time points in it
+        time_points = list(time_points)
+        for t, i in zip(*np.unique(time_codes, return_index=True)):
+            time_points[t] = df["time_point"].iloc[i]
+    ret = []
+    for t in range(len(time_points)):
+        rows = np.flatnonzero(time_codes == t)
+        cluster_codes, clusters = pd.factorize(df["cluster"].to_numpy()[rows])
+        m = sparse.csc_matrix((np.ones(len(rows)), (gene_codes[rows], cluster_codes)),
+                              shape=(len(genes), len(clusters)))
+        ret.append((clusters, m))
+    return list(time_points), genes, ret
+
+
+def jaccard(a, b):
+    # Jaccard indices of all pairs of columns of indicator matrices a and b (dense, a.cols x b.cols)
+    inter = (a.T @ b).toarray()
+    size_a = np.asarray(a.sum(axis=0)).ravel()
+    size_b = np.asarray(b.sum(axis=0)).ravel()
+    return inter / (size_a[:, None] + size_b[None, :] - inter)
+
+
+def track_clusters(df, min_jaccard=0.3, time_points=None):
+    # link the clusters of consecutive timepoints into tracks.
+    # df: result of `dnb_tb_iterate` (or the output file) with "output_metrics"
+    # time_points: keys of all the timepoints in order. a timepoint without DNB has no rows in `df`,
+    #   so without this, the clusters on both sides of it are linked as if they were consecutive.
+    # returns DataFrame with a row for each cluster at each time point:
+    #   track, time_point, cluster, clustersize,
+    #   jaccard (with the cluster of the same track at the previous time point, NaN at the start),
+    #   sd_in, pcc_in, composite_index
+    if "cluster" not in df.columns:
+        raise ValueError(
+            "cluster labels are necessary for tracking. Run with the option \"output_metrics\".")
+    columns = ["track", "time_point", "cluster", "clustersize",
+               "jaccard", "sd_in", "pcc_in", "composite_index"]
+    if len(df) == 0:
+        return pd.DataFrame([], columns=columns)
+
+    time_points, _, members = membership_matrices(df, time_points)
+    tracks = []
+    jaccards = []
+    n_tracks = 0
+    prev = None
+    for clusters, m in members:
+        track = np.full(len(clusters), -1)
+        jac = np.full(len(clusters), np.nan)
+        if prev is not None and len(clusters) > 0 and len(prev[0]) > 0:
+            prev_track, prev_m = prev
+            J = jaccard(prev_m, m)
+            rows, cols = linear_sum_assignment(J, maximize=True)
+            ok = J[rows, cols] >= min_jaccard
+            track[cols[ok]] = prev_track[rows[ok]]
+            jac[cols[ok]] = J[rows[ok], cols[ok]]
+        # new tracks for clusters not linked
+        new = np.flatnonzero(track < 0)
+        track[new] = n_tracks + np.arange(len(new))
+        n_tracks += len(new)
+        tracks.append(track)
+        jaccards.append(jac)
+        prev = (track, m)
+
+    # metrics of each cluster, in the same order as `membership_matrices`
+    stats = df.groupby(["time_point", "cluster"], sort=False).agg(
+        clustersize=("dnb", "size"),
+        sd_in=("dev_expr", "mean"),
+        pcc_in=("cor_mean", "first"),
+    )
+    ret = pd.DataFrame({
+        "track": np.concatenate(tracks),
+        "time_point": np.repeat(time_points, [len(c) for c, _ in members]),
+        "cluster": np.concatenate([c for c, _ in members]),
+        "jaccard": np.concatenate(jaccards),
+    })
+    ret = ret.join(stats, on=["time_point", "cluster"])
+    ret["composite_index"] = ret["sd_in"] * ret["pcc_in"]
+    logger.info(
+        f"{n_tracks} tracks of DNB clusters over {len(time_points)} time points")
+    return ret.sort_values(["track"], kind="stable").reset_index(drop=True)[columns]
+
+
+def track_summary(df_tracks):
+    # summary of each track: the first and the last time points, the number of time points,
+    # and the time point where the composite index peaks.
+    # the peak of a track whose composite indices are all NaN (e.g. clusters of a single gene,
+    # whose "cor_mean" is NaN) is NaN.
+    if len(df_tracks) == 0:
+        return pd.DataFrame([], columns=["track", "start", "end", "length", "peak_time_point",
+                                         "peak_composite_index", "max_clustersize"])
+    g = df_tracks.groupby("track", sort=True)
+    valid = df_tracks.dropna(subset=["composite_index"])
+    peak = valid.loc[valid.groupby("track")["composite_index"].idxmax()].set_index("track")
+    peak = peak.reindex(g.size().index)
+    return pd.DataFrame({
+        "start": g["time_point"].first(),
+        "end": g["time_point"].last(),
+        "length": g.size(),
+        "peak_time_point": peak["time_point"],
+        "peak_composite_index": peak["composite_index"],
+        "max_clustersize": g["clustersize"].max(),
+    }).reset_index()
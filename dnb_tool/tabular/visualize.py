@@ -1,11 +1,17 @@
+import warnings
 import numpy as np
 import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from .core import correlation_matrix
 
 
 def plot_correlation(df_x, df_ret, filename=None):
     if df_x is not None:
         # calculate correlation matrix
-        cor = np.corrcoef(df_x.loc[df_ret["dnb"].values].values)
+        cor = correlation_matrix(df_x.loc[df_ret["dnb"].values].values)
 
         # display the correlation matrix
         plt.pcolormesh(cor, vmin=-1, vmax=1)
@@ -25,20 +31,42 @@ def plot_correlation(df_x, df_ret, filename=None):
     plt.close()
 
 
+def normalize_by_control(arr_dnb_expr, arr_dnb_ctrl):
+    # normalize experimental and control data for each row based on control data.
+    # missing values are ignored. rows whose control data are constant or missing
+    # are only shifted (or left as they are).
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        offset = np.nanmean(arr_dnb_ctrl, axis=1)
+        scale = np.nanstd(arr_dnb_ctrl, axis=1)
+    offset = np.where(np.isnan(offset), 0, offset)
+    scale = np.where(scale > 0, scale, 1)
+    arr_dnb_expr = (arr_dnb_expr - offset[:, None]) / scale[:, None]
+    arr_dnb_ctrl = (arr_dnb_ctrl - offset[:, None]) / scale[:, None]
+    return arr_dnb_expr, arr_dnb_ctrl
+
+
+def value_range(*arrs):
+    # the range of the values of arrays, where missing values are ignored.
+    # (None, None) if there is no value, so that the range is set automatically
+    values = np.concatenate([a.ravel() for a in arrs])
+    values = values[~np.isnan(values)]
+    if len(values) == 0:
+        return None, None
+    return values.min(), values.max()
+
+
 def plot_heatmap(df_expr, df_ctrl, df_ret, filename=None):
     # take DNB variables for each group
     arr_dnb_expr = df_expr.loc[df_ret["dnb"].values].values
     arr_dnb_ctrl = df_ctrl.loc[df_ret["dnb"].values].values
 
     # normalize experimental and control data for each row based on control data
-    offset = np.mean(arr_dnb_ctrl, axis=1)
-    scale = np.std(arr_dnb_ctrl, axis=1)
-    arr_dnb_expr = (arr_dnb_expr - offset[:, None]) / scale[:, None]
-    arr_dnb_ctrl = (arr_dnb_ctrl - offset[:, None]) / scale[:, None]
+    arr_dnb_expr, arr_dnb_ctrl = normalize_by_control(
+        arr_dnb_expr, arr_dnb_ctrl)
 
     # calculate value range
-    v0 = np.minimum(np.min(arr_dnb_expr), np.min(arr_dnb_ctrl))
-    v1 = np.maximum(np.max(arr_dnb_expr), np.max(arr_dnb_ctrl))
+    v0, v1 = value_range(arr_dnb_expr, arr_dnb_ctrl)
 
     # generate plots
     fig, axes = plt.subplots(nrows=1, ncols=2, figsize=(8, 4))
@@ -61,3 +89,148 @@ def plot_heatmap(df_expr, df_ctrl, df_ret, filename=None):
     else:
         plt.savefig(filename)
     plt.close()
+
+
+########
+#### fast rendering ####
+########
+
+def block_mean(arr, max_size):
+    # downsample 2-dim array by taking the mean of blocks,
+    # so that each axis has at most `max_size` elements
+    if max_size is None:
+        return arr
+    for axis in [0, 1]:
+        n = arr.shape[axis]
+        if n <= max_size:
+            continue
+        # the number of elements in a block, and the number of blocks
+        factor = -(-n // max_size)
+        size = -(-n // factor)
+        # pad the last block with NaN, which is ignored in the mean
+        pad = [(0, 0), (0, 0)]
+        pad[axis] = (0, factor * size - n)
+        arr = np.pad(arr.astype(float), pad, constant_values=np.nan)
+        shape = list(arr.shape)
+        shape[axis:axis+1] = [size, factor]
+        arr = np.nanmean(arr.reshape(shape), axis=axis+1)
+    return arr
+
+
+def draw_image(ax, arr, vmin, vmax, max_pixels):
+    # rasterized image whose axes are in units of the original array,
+    # which looks the same as `pcolormesh` but draws a single image
+    n_rows, n_cols = arr.shape
+    return ax.imshow(block_mean(arr, max_pixels), vmin=vmin, vmax=vmax,
+                     origin="lower", aspect="auto", interpolation="nearest",
+                     extent=(0, n_cols, 0, n_rows), rasterized=True)
+
+
+def new_figure(filename, figsize=None):
+    # files are written by a figure that is not managed by pyplot,
+    # which uses the non-interactive Agg backend and is safe in worker threads
+    if filename is None:
+        return plt.figure(figsize=figsize)
+    return Figure(figsize=figsize)
+
+
+def show_or_save(fig, filename):
+    if filename is None:
+        plt.show()
+        plt.close(fig)
+    else:
+        fig.savefig(filename)
+
+
+def render_correlation(arr_dnb_x, filename=None, max_pixels=1000):
+    # arr_dnb_x: preprocessed values of DNB variables (rows), or None
+    fig = new_figure(filename)
+    ax = fig.add_subplot(1, 1, 1)
+    if arr_dnb_x is not None:
+        # calculate correlation matrix
+        cor = correlation_matrix(arr_dnb_x)
+
+        # display the correlation matrix
+        im = draw_image(ax, cor, -1, 1, max_pixels)
+        ax.set_xlabel("gene index")
+        ax.set_ylabel("gene index")
+        ax.set_title("correlation matrix of DNB genes")
+        fig.colorbar(im, ax=ax)
+    else:
+        fig.set_size_inches(5, 5)
+        ax.set_title("no candidate remained after deviation filtering")
+    show_or_save(fig, filename)
+
+
+def render_heatmap(arr_dnb_expr, arr_dnb_ctrl, filename=None, max_pixels=1000):
+    # arr_dnb_expr, arr_dnb_ctrl: values of DNB variables (rows) for each group
+    if arr_dnb_expr.shape[0] == 0:
+        fig = new_figure(filename, figsize=(5, 5))
+        fig.add_subplot(1, 1, 1).set_title(
+            "no candidate remained after deviation filtering")
+        show_or_save(fig, filename)
+        return
+
+    # normalize experimental and control data for each row based on control data
+    arr_dnb_expr, arr_dnb_ctrl = normalize_by_control(
+        arr_dnb_expr, arr_dnb_ctrl)
+
+    # calculate value range
+    v0, v1 = value_range(arr_dnb_expr, arr_dnb_ctrl)
+
+    # generate plots
+    fig = new_figure(filename, figsize=(8, 4))
+    axes = fig.subplots(nrows=1, ncols=2)
+
+    # 1st panel: experimental group
+    draw_image(axes[0], arr_dnb_expr, v0, v1, max_pixels)
+    axes[0].set_ylabel("gene index")
+    axes[0].set_xlabel("patient index")
+    axes[0].set_title("experimental group")
+
+    # 2nd panel: control group
+    draw_image(axes[1], arr_dnb_ctrl, v0, v1, max_pixels)
+    axes[1].set_title("control group")
+    axes[1].set_xlabel("patient index")
+
+    fig.suptitle("relative expression of DNB genes")
+    show_or_save(fig, filename)
+
+
+class PlotWorker:
+    # renders plots in background threads,
+    # so that writing figures overlaps with the computation of the next timepoint.
+    # each plot keeps its matrices until it is rendered, so at most 2 * max_workers plots
+    # wait at a time; `submit` blocks on the oldest one when rendering is slower than the computation.
+    #
+    # max_workers: the number of threads. if 0, plots are rendered immediately.
+
+    def __init__(self, max_workers=1):
+        self.executor = None
+        self.max_pending = 2 * max_workers
+        if max_workers > 0:
+            self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.futures = deque()
+
+    def _collect(self, max_pending):
+        # drop finished plots (raising their errors), and wait until at most `max_pending` remain
+        while self.futures and (self.futures[0].done() or len(self.futures) > max_pending):
+            self.futures.popleft().result()
+
+    def submit(self, func, *args, **kwargs):
+        if self.executor is None:
+            func(*args, **kwargs)
+        else:
+            self._collect(self.max_pending - 1)
+            self.futures.append(self.executor.submit(func, *args, **kwargs))
+
+    def wait(self):
+        # wait for all submitted plots, and raise the error if any of them failed
+        self._collect(0)
+
+    def close(self):
+        try:
+            self.wait()
+        finally:
+            if self.executor is not None:
+                self.executor.shutdown()
@@ -1,8 +1,34 @@
-from .tabular.dnb_iterate import dnb_tb_iterate
+from .tabular.dnb_iterate import dnb_tb_groups, dnb_tb_iterate
 from .tabular.read_files import check_input, get_filenames
+from .tabular.cache import ResultCache, params_for_key
+from .tabular.dnb import set_auto_params
+from .tabular.output import ResultWriter, read_result, result_columns
+from .tabular.bootstrap import bootstrap_iterate
+from .tabular.landscape import LandscapeCollector, landscape_iterate
+from .tabular.tracking import track_clusters, track_summary
+from .shard import ShardDirectory, ShardWriter
+from .instrument import Recorder, get_logger, set_recorder, setup_logging, stage
+import os
 import argparse
+import pandas as pd
 import json
 
+logger = get_logger("dnb_tool.tabular_main")
+
+
+def write_tracks(output_filename, min_jaccard, keys):
+    # tracks of DNB clusters in the output file
+    # keys: all the timepoints in order, so that tracks end at a timepoint without DNB
+    with stage("tracking"):
+        df_tracks = track_clusters(read_result(output_filename),
+                                   min_jaccard=min_jaccard, time_points=keys)
+        df_summary = track_summary(df_tracks)
+    base = os.path.splitext(output_filename)[0]
+    df_tracks.to_csv(base + "_tracks.csv", index=False)
+    df_summary.to_csv(base + "_track_summary.csv", index=False)
+    logger.info(
+        f"Output files are \"{base}_tracks.csv\" and \"{base}_track_summary.csv\"")
+
 
 def main():
     # set parser
@@ -13,7 +39,7 @@ def main():
 
     parser.add_argument('--input_path',
                         default="input",
-                        help='the name of folder that contains input .csv files (default: %(default)s)')
+                        help='the name of folder that contains input files (.csv, .parquet, .feather or .npz) (default: %(default)s)')
 
     parser.add_argument('--config_file',
                         default=None,
@@ -28,13 +54,75 @@ def main():
     parser.add_argument('--key_experimental',
                         default="expr",
                         help='the columns that contains this are considered as experimental group (default: %(default)s)')
+    parser.add_argument('--control_file',
+                        default=None,
+                        help='a separate .csv file that contains the control group shared among all timepoints. If given, input files need to contain only the experimental group (default: %(default)s)')
+    parser.add_argument('--wide_file',
+                        default=None,
+                        help='wide mode: a single table that contains the control group and several experimental groups, which is analyzed instead of the input files. The groups are defined by --group_pattern, and their keys are written as time_point (default: %(default)s)')
+    parser.add_argument('--group_pattern',
+                        default=None,
+                        help='in wide mode, a regular expression for the columns of the experimental groups, whose first group in parentheses is the group key. e.g. "expr_(\\d+)" classifies "expr_1_a" and "expr_1_b" into the group 1. In the configuration file, a dictionary {regular expression: group key} is also accepted (default: %(default)s)')
     parser.add_argument('--ignore_extra_columns',
                         default=False,
                         action="store_true",
                         help='ignore columns not included in either control or experimental group (default: %(default)s)')
+    parser.add_argument('--orientation',
+                        choices=["auto", "columns", "rows"],
+                        default="auto",
+                        help='where the samples are. "columns": samples are in columns, "rows": the table is transposed, "auto": detected from the header row and the first column (default: %(default)s)')
     parser.add_argument('--output_filename',
                         default="output.csv",
-                        help='DNB calculated from each file are written to this file (default: %(default)s)')
+                        help='DNB calculated from each file are written to this file as soon as each file is processed. If the name ends with ".parquet", a directory of Parquet files is written instead (default: %(default)s)')
+    parser.add_argument('--resume',
+                        default=False,
+                        action="store_true",
+                        help='resume the interrupted run from the checkpoint "{output_filename}.manifest.json" (default: %(default)s)')
+    parser.add_argument('--conversion_cache',
+                        default=False,
+                        action="store_true",
+                        help='keep a binary copy of each .csv file under ".dnb_cache" in the input folder, and read it while the .csv file is unchanged (default: %(default)s)')
+    parser.add_argument('--cache_dir',
+                        default=None,
+                        help='directory to keep the result of each input file. Unchanged files analyzed with the same parameters are not recalculated. If None, the cache is disabled (default: %(default)s)')
+    parser.add_argument('--cache_max_size',
+                        type=float,
+                        default=None,
+                        help='upper limit of the cache size in MB. The least recently used results are removed when exceeded (default: unlimited)')
+    parser.add_argument('--clear_cache',
+                        default=False,
+                        action="store_true",
+                        help='remove all cached results before the analysis (default: %(default)s)')
+    parser.add_argument('--shard_dir',
+                        default=None,
+                        help='shard mode: input files are processed by any number of workers (on any machines) running the same command with this shared directory. Each file is claimed by a lock file, and the workers wait until all files are finished (taking over those of crashed workers). Then one of them merges the results into the output file, and runs the bootstrap and the landscape steps (default: %(default)s)')
+    parser.add_argument('--shard_lock_timeout',
+                        type=float,
+                        default=600,
+                        help='in shard mode, a file whose worker has not updated its lock for this many seconds (e.g. the worker crashed) is taken over by another worker (default: %(default)s)')
+
+    parser.add_argument('--bootstrap',
+                        type=int,
+                        default=0,
+                        help='the number of bootstrap resamples to evaluate the stability of DNB candidates. Selection and co-clustering frequencies are written to "{output}_stability.csv" and "{output}_cocluster.csv". 0: disabled (default: %(default)s)')
+    parser.add_argument('--n_jobs',
+                        type=int,
+                        default=1,
+                        help='the number of worker processes for bootstrap. 0: all CPUs (default: %(default)s)')
+    parser.add_argument('--seed',
+                        type=int,
+                        default=0,
+                        help='random seed for bootstrap (default: %(default)s)')
+    parser.add_argument('--landscape',
+                        action='store_true',
+                        help='score each experimental sample against the control group for each DNB module (single-sample DNB). Scores are written to "{output}_landscape.csv" (default: %(default)s)')
+    parser.add_argument('--track',
+                        action='store_true',
+                        help='link the DNB clusters of consecutive timepoints by their Jaccard index into tracks. The composite index of each track at each timepoint is written to "{output}_tracks.csv", and a summary of the tracks to "{output}_track_summary.csv". Requires --output_metrics (default: %(default)s)')
+    parser.add_argument('--track_min_jaccard',
+                        type=float,
+                        default=0.3,
+                        help='clusters whose Jaccard index is less than this are not linked into a track (default: %(default)s)')
 
     parser.add_argument('--deviation_metric',
                         choices=["mad", "std"],
@@ -55,6 +143,10 @@ def main():
                         type=float,
                         default=0.75,
                         help='the threshold for cluster division (default: %(default)s)')
+    parser.add_argument('--min_overlap',
+                        type=int,
+                        default=3,
+                        help='missing values (empty cells or NaN) are ignored, and the correlation of two genes is calculated over the samples observed in both. Pairs with fewer common samples than this are regarded as uncorrelated. (default: %(default)s)')
     parser.add_argument('--thres_cluster_selection',
                         type=float,
                         default=0.5,
@@ -86,10 +178,37 @@ def main():
     parser.add_argument('--plot_file_prefix',
                         default=None,
                         help='(path and) prefix of filenames of plots (if None, they will be displayed on screen) (default: %(default)s)')
+    parser.add_argument('--plot_renderer',
+                        choices=["imshow", "pcolormesh"],
+                        default="imshow",
+                        help='how plots are drawn. "imshow": a rasterized image (fast for large DNB sets), "pcolormesh": one polygon per cell. (default: %(default)s)')
+    parser.add_argument('--plot_max_pixels',
+                        type=int,
+                        default=1000,
+                        help='matrices larger than this along an axis are downsampled by block mean before drawing (only for "imshow") (default: %(default)s)')
+    parser.add_argument('--plot_workers',
+                        type=int,
+                        default=1,
+                        help='the number of threads that write plot files in background. If 0, plots are written before the next file is processed (default: %(default)s)')
+    parser.add_argument('--prefetch',
+                        type=int,
+                        default=None,
+                        help='the number of input files read ahead in a background thread while the current file is analyzed, and the results are written by another thread. Memory grows with the number of files kept in advance. If 0, each file is read, analyzed and written in turn (default: 1)')
+
+    parser.add_argument('--metrics_file',
+                        default=None,
+                        help='write metrics of the run (timings of stages, peak memory and the numbers of genes and clusters) to this .json or .csv file (default: %(default)s)')
+    parser.add_argument('--quiet',
+                        action='store_true',
+                        help='show only warnings and errors')
+    parser.add_argument('--verbose',
+                        action='store_true',
+                        help='also show the elapsed time of each stage')
 
     args = parser.parse_args()
+    setup_logging(quiet=args.quiet, verbose=args.verbose)
 
-    print("*** Step 1: Configuration ***")
+    logger.info("*** Step 1: Configuration ***")
     # the name of folder that contains input .csv files
     input_path = args.input_path
     # the prefix of input .csv files
@@ -98,10 +217,31 @@ def main():
     key_control = args.key_control
     # the columns that contains this are considered as experimental group
     key_experimental = args.key_experimental
+    # a separate file that contains the control group shared among all timepoints
+    control_file = args.control_file
     # ignore columns not included in either control or experimental group
     ignore_extra_columns = args.ignore_extra_columns
+    # where the samples are, "columns", "rows" or "auto"
+    orientation = args.orientation
+    # a single table that contains several experimental groups, and the pattern of the groups
+    wide_file = args.wide_file
+    group_pattern = args.group_pattern
     # DNB calculated from each file are written to this file
     output_filename = args.output_filename
+    # keep a binary copy of each .csv file
+    conversion_cache = args.conversion_cache
+    # directory to keep the result of each input file
+    cache_dir = args.cache_dir
+    # upper limit of the cache size in MB
+    cache_max_size = args.cache_max_size
+    # the number of threads that write plot files
+    plot_workers = args.plot_workers
+    # the number of input files read ahead
+    prefetch = args.prefetch
+    # file to which metrics of the run are written
+    metrics_file = args.metrics_file
+    # directory shared by the workers in shard mode
+    shard_dir = args.shard_dir
     kwargs_DNB = {
         # the metric for deviation. "mad": median absolute deviation. "std": standard deviation.
         "deviation_metric": args.deviation_metric,
@@ -113,6 +253,8 @@ def main():
         "linkage_method": args.linkage_method,
         # the threshold for cluster division
         "linkage_threshold": args.linkage_threshold,
+        # the minimum number of samples observed in both genes for their correlation (with missing values)
+        "min_overlap": args.min_overlap,
         # clusters whose size is larger than X*100 % of the maximum cluster size are selected for output.
         "thres_cluster_selection": args.thres_cluster_selection,
         # output detailed metrics for DNB candidates
@@ -122,7 +264,11 @@ def main():
         # plot inputs for DNB candidates
         "plot_heatmap": args.plot_heatmap,
         # (path and) prefix of filenames of plots (if None, they will be displayed on screen)
-        "plot_file_prefix": args.plot_file_prefix
+        "plot_file_prefix": args.plot_file_prefix,
+        # how plots are drawn, "imshow" or "pcolormesh"
+        "plot_renderer": args.plot_renderer,
+        # matrices larger than this along an axis are downsampled before drawing
+        "plot_max_pixels": args.plot_max_pixels,
     }
 
     if args.config_file:
@@ -133,9 +279,21 @@ def main():
         key_control = config_json.pop("key_control", key_control)
         key_experimental = config_json.pop(
             "key_experimental", key_experimental)
+        control_file = config_json.pop("control_file", control_file)
         ignore_extra_columns = config_json.pop(
             "ignore_extra_columns", ignore_extra_columns)
+        orientation = config_json.pop("orientation", orientation)
+        wide_file = config_json.pop("wide_file", wide_file)
+        group_pattern = config_json.pop("group_pattern", group_pattern)
         output_filename = config_json.pop("output_filename", output_filename)
+        conversion_cache = config_json.pop(
+            "conversion_cache", conversion_cache)
+        cache_dir = config_json.pop("cache_dir", cache_dir)
+        cache_max_size = config_json.pop("cache_max_size", cache_max_size)
+        plot_workers = config_json.pop("plot_workers", plot_workers)
+        prefetch = config_json.pop("prefetch", prefetch)
+        metrics_file = config_json.pop("metrics_file", metrics_file)
+        shard_dir = config_json.pop("shard_dir", shard_dir)
 
         for k in kwargs_DNB:
             kwargs_DNB[k] = config_json.pop(k, kwargs_DNB[k])
@@ -144,28 +302,180 @@ def main():
             k = next(iter(config_json))
             raise ValueError(f"invalid key is in configuration file: {k}")
 
-    print(f"Load input from \"{input_path}/{prefix}...\"")
+    if orientation == "auto":
+        orientation = None
+    if args.track and not kwargs_DNB["output_metrics"]:
+        raise ValueError("--track requires --output_metrics")
+    if args.landscape and not kwargs_DNB["output_metrics"]:
+        raise ValueError("--landscape requires --output_metrics")
+
+    # metrics are recorded only when the file is given
+    recorder = None
+    if metrics_file is not None:
+        recorder = Recorder()
+        set_recorder(recorder)
+
+    if wide_file is not None:
+        if group_pattern is None:
+            raise ValueError("--group_pattern is necessary for --wide_file")
+        if shard_dir is not None or args.bootstrap > 0 or args.landscape or cache_dir is not None \
+                or prefetch is not None or control_file is not None:
+            raise ValueError(
+                "--wide_file cannot be used with --shard_dir, --bootstrap, --landscape, --cache_dir, --prefetch or --control_file")
+        logger.info(f"*** Step 2: Read the groups in \"{wide_file}\" ***")
+        writer = ResultWriter(output_filename,
+                              set_auto_params(dict(kwargs_DNB)),
+                              resume=args.resume)
+        logger.info(
+            "**** Step 3: calculate SFGs (DNB candidate) and output result ****")
+        dnb_tb_groups(wide_file,
+                      key_control,
+                      group_pattern,
+                      kwargs_DNB,
+                      conversion_cache=conversion_cache,
+                      orientation=orientation,
+                      writer=writer,
+                      plot_workers=plot_workers)
+        logger.info(f"Output file is \"{output_filename}\"")
+        if args.track:
+            logger.info("**** Step 4: tracks of DNB clusters ****")
+            # the groups in the order of the analysis (the manifest)
+            write_tracks(output_filename, args.track_min_jaccard, writer.completed())
+        if recorder is not None:
+            recorder.write(metrics_file)
+            logger.info(f"Metrics file is \"{metrics_file}\"")
+        return
+
+    # the default of the options not used in wide mode
+    if prefetch is None:
+        prefetch = 1
 
-    print("*** Step 2: Obtain and check input files ***")
+    logger.info(f"Load input from \"{input_path}/{prefix}...\"")
+
+    logger.info("*** Step 2: Obtain and check input files ***")
     keys, filenames = get_filenames(input_path, prefix)
     check_input(keys,
                 filenames,
                 key_control,
                 key_experimental,
-                ignore_extra_columns)
+                ignore_extra_columns,
+                control_filename=control_file,
+                conversion_cache=conversion_cache,
+                orientation=orientation)
+
+    cache = None
+    if cache_dir is not None:
+        max_size = None if cache_max_size is None else int(cache_max_size * 1e6)
+        cache = ResultCache(cache_dir, max_size=max_size)
+        if args.clear_cache:
+            cache.clear()
+
+    params = set_auto_params(dict(kwargs_DNB))
+    shard = None
+    if shard_dir is not None:
+        # results of the files claimed by this worker are written to the shard directory
+        shard_params = {"key_control": key_control, "key_experimental": key_experimental,
+                        "control_file": control_file, "orientation": orientation,
+                        **params_for_key(params)}
+        shard = ShardWriter(ShardDirectory(shard_dir, keys, filenames, shard_params,
+                                           lock_timeout=args.shard_lock_timeout),
+                            result_columns(params["output_metrics"]))
+        writer = shard
+    else:
+        # results are written to the output file as soon as each file is processed
+        writer = ResultWriter(output_filename, params, resume=args.resume)
+
+    logger.info("**** Step 3: calculate SFGs (DNB candidate) and output result ****")
+
+    # single-sample scores are computed in the same pass, on the groups already read
+    landscape = LandscapeCollector(kwargs_DNB) if args.landscape else None
+
+    def run(keys_run):
+        # files of `keys_run`, which are claimed by the writer
+        files = dict(zip(keys, filenames))
+        dnb_tb_iterate(keys_run,
+                       [files[k] for k in keys_run],
+                       key_control,
+                       key_experimental,
+                       kwargs_DNB,
+                       control_filename=control_file,
+                       cache=cache,
+                       conversion_cache=conversion_cache,
+                       orientation=orientation,
+                       writer=writer,
+                       plot_workers=plot_workers,
+                       prefetch=prefetch,
+                       on_timepoint=landscape)
+
+    if shard is None:
+        run(keys)
+    else:
+        # the workers process the files claimed by each of them (and those of crashed workers)
+        # until all files are finished, and one of them merges the results
+        try:
+            merge = shard.directory.run(
+                shard.suffix, run, lambda: shard.merge(ResultWriter(output_filename, params)))
+        finally:
+            shard.directory.close()
+        if not merge:
+            if recorder is not None:
+                recorder.write(metrics_file)
+                logger.info(f"Metrics file is \"{metrics_file}\"")
+            return
+
+    logger.info(f"Output file is \"{output_filename}\"")
 
-    print("**** Step 3: calculate SFGs (DNB candidate) ****")
+    if args.bootstrap > 0:
+        logger.info("**** Step 4: stability of SFGs by bootstrap ****")
+        df_freq, df_pairs = bootstrap_iterate(keys,
+                                              filenames,
+                                              key_control,
+                                              key_experimental,
+                                              kwargs_DNB,
+                                              n_boot=args.bootstrap,
+                                              n_jobs=args.n_jobs,
+                                              seed=args.seed,
+                                              control_filename=control_file,
+                                              conversion_cache=conversion_cache,
+                                              orientation=orientation)
+        base = os.path.splitext(output_filename)[0]
+        df_freq.to_csv(base + "_stability.csv", index=False)
+        df_pairs.to_csv(base + "_cocluster.csv", index=False)
+        logger.info(
+            f"Output files are \"{base}_stability.csv\" and \"{base}_cocluster.csv\"")
 
-    result = dnb_tb_iterate(keys,
-                            filenames,
-                            key_control,
-                            key_experimental,
-                            kwargs_DNB)
+    if args.landscape:
+        logger.info("**** Step 5: single-sample DNB scores ****")
+        # timepoints analyzed by other workers or in the previous run (resume)
+        # are scored with the DNB modules in the output file
+        rest = [(k, f) for k, f in zip(keys, filenames)
+                if k not in landscape.scores]
+        if len(rest) > 0:
+            with stage("landscape"):
+                df_rest = landscape_iterate([k for k, _ in rest],
+                                            [f for _, f in rest],
+                                            key_control,
+                                            key_experimental,
+                                            kwargs_DNB,
+                                            read_result(output_filename),
+                                            control_filename=control_file,
+                                            conversion_cache=conversion_cache,
+                                            orientation=orientation)
+            for k, _ in rest:
+                landscape.scores[k] = df_rest[df_rest["time_point"] == k]
+        df_scores = pd.concat([landscape.scores[k] for k in keys],
+                              axis=0).reset_index(drop=True)
+        base = os.path.splitext(output_filename)[0]
+        df_scores.to_csv(base + "_landscape.csv", index=False)
+        logger.info(f"Output file is \"{base}_landscape.csv\"")
 
-    print("**** Step 4: output result to csv file ****")
+    if args.track:
+        logger.info("**** Step 6: tracks of DNB clusters ****")
+        write_tracks(output_filename, args.track_min_jaccard, keys)
 
-    result.to_csv(output_filename, index=False)
-    print(f"Output file is \"{output_filename}\"")
+    if recorder is not None:
+        recorder.write(metrics_file)
+        logger.info(f"Metrics file is \"{metrics_file}\"")
 
 
 if __name__ == "__main__":
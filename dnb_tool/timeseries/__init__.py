@@ -1 +1,2 @@
-from .dnb_ts import EWS_DNB, CPD_EWS, CPDotsu
+from .dnb_ts import EWS_DNB, EWS_indicators, CPD_EWS, CPDotsu
+from .surrogate import surrogate_test
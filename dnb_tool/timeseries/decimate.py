@@ -0,0 +1,83 @@
+import numpy as np
+
+
+# decimation of long time series for plotting.
+# the drawn lines keep the shape of the original ones with a few thousand points.
+
+
+def bucket_edges(n, n_buckets):
+    # split range(n) into `n_buckets` contiguous buckets
+    return np.linspace(0, n, n_buckets + 1).astype(int)
+
+
+def minmax_decimate(x, max_points):
+    # keep the minimum and maximum of each bucket in time order,
+    # so that the envelope of the line (e.g. spikes) is preserved.
+    # x: (T,) or (T, d) array
+    # returns t, y: time indices and values of the kept points (the same shape as each other).
+    #   for 2-dim input, t is also 2-dim, which is accepted by `plt.plot(t, y)`.
+    x = np.asarray(x)
+    squeeze = x.ndim == 1
+    x = x.reshape(x.shape[0], -1)
+    T = x.shape[0]
+    if max_points is None or T <= max_points:
+        t = np.broadcast_to(np.arange(T)[:, None], x.shape)
+    else:
+        # at least a bucket, whose minimum and maximum are kept
+        n_buckets = max(1, max_points // 2)
+        edges = bucket_edges(T, n_buckets)
+        # the shortest bucket; longer buckets are scanned by their first `width` points
+        # plus their last point, which covers all points because widths differ at most by 1
+        width = np.min(np.diff(edges))
+        starts = edges[:-1]
+        ends = edges[1:]
+        idx = starts[:, None] + np.arange(width)[None, :]
+        idx = np.concatenate([idx, (ends - 1)[:, None]], axis=1)
+        blocks = x[idx]  # (n_buckets, width + 1, d)
+        i_min = idx[np.arange(n_buckets)[:, None],
+                    np.argmin(blocks, axis=1)]
+        i_max = idx[np.arange(n_buckets)[:, None],
+                    np.argmax(blocks, axis=1)]
+        # (n_buckets, 2, d) -> (2 * n_buckets, d), in time order in each bucket
+        t = np.stack([np.minimum(i_min, i_max),
+                     np.maximum(i_min, i_max)], axis=1).reshape(-1, x.shape[1])
+    y = np.take_along_axis(x, t, axis=0)
+    if squeeze:
+        return t[:, 0], y[:, 0]
+    return t, y
+
+
+def lttb(y, max_points):
+    # Largest-Triangle-Three-Buckets: select points that keep the visual shape of a 1-dim series
+    # y: (T,) array
+    # returns t, y: time indices and values of the kept points
+    y = np.asarray(y)
+    T = y.shape[0]
+    if max_points is None or T <= max_points or max_points < 3:
+        return np.arange(T), y
+    # the first and the last points are always kept
+    edges = bucket_edges(T - 2, max_points - 2) + 1
+    ret = np.zeros(max_points, dtype=int)
+    a = 0
+    for i in range(max_points - 2):
+        # average point of the next bucket
+        if i < max_points - 3:
+            t_next = np.arange(edges[i+1], edges[i+2])
+        else:
+            t_next = np.array([T - 1])
+        t_avg, y_avg = t_next.mean(), y[t_next].mean()
+        # the point of the current bucket that makes the largest triangle
+        t_cur = np.arange(edges[i], edges[i+1])
+        area = np.abs((a - t_avg) * (y[t_cur] - y[a]) -
+                      (a - t_cur) * (y_avg - y[a]))
+        a = t_cur[np.argmax(area)]
+        ret[i+1] = a
+    ret[-1] = T - 1
+    return ret, y[ret]
+
+
+def select_features(d, max_features):
+    # evenly spaced indices of at most `max_features` features
+    if max_features is None or d <= max_features:
+        return np.arange(d)
+    return np.unique(np.linspace(0, d - 1, max_features).astype(int))
@@ -1,25 +1,17 @@
 import numpy as np
-import time
-import tqdm
 from sklearn.decomposition import PCA
 import ruptures as rpt
 
 
-from numpy.lib.stride_tricks import sliding_window_view as sliding_window
+from numpy.lib.stride_tricks import as_strided, sliding_window_view as sliding_window
 
+from .. import kernels
+from ..instrument import get_logger, timed
 
-def timer(func):
-    def wrapper(*args, **kwargs):
-        time_s = time.time()
-        res = func(*args, **kwargs)
-        print(f'calculation time ={time.time() - time_s}sec')
-        return res
-    return wrapper
+logger = get_logger(__name__)
 
 
-@timer
-def EWS_DNB(x, window_size, padding='online', normalization='straight'):
-    print('caluculating time series DNB:')
+def normalize(x, normalization='straight'):
     # normalization
     if normalization == 'std':
         x = x / x.std(0)
@@ -34,29 +26,291 @@ def EWS_DNB(x, window_size, padding='online', normalization='straight'):
     elif normalization != 'straight':
         raise NameError('select \'straight\',\'PCA\', \'minmax\', or \'std\'')
         return -1
-    # 1 dim or n dim
+    return x
+
+
+def sliding_blocks(x, window_size, block_size):
+    # split sliding windows of x (T x d) into blocks of `block_size` windows
+    # yields (start, segment) where segment covers the windows of the block, shifted by its mean.
+    # statistics of windows are invariant to the shift, which improves numerical accuracy
+    n = x.shape[0] - window_size + 1
+    for s in range(0, n, block_size):
+        e = min(n, s + block_size)
+        seg = x[s:e + window_size - 1]
+        yield s, seg - seg.mean(0)
+
+
+def block_cov(seg, window_size):
+    # covariance matrices of all windows in a segment.
+    # the sums and the cross products of the first window are updated
+    # by adding the entering sample and removing the leaving one (cumulative sums),
+    # instead of computing `np.cov` for each window.
+    nb = seg.shape[0] - window_size + 1
+    head = seg[:window_size]
+    S0 = head.sum(0)
+    P0 = head.T @ head
+    add = seg[window_size:window_size + nb - 1]
+    rem = seg[:nb - 1]
+    S = np.concatenate([S0[None], S0 + np.cumsum(add - rem, axis=0)])
+    P = np.concatenate([P0[None], P0 + np.cumsum(
+        add[:, :, None] * add[:, None, :] - rem[:, :, None] * rem[:, None, :], axis=0)])
+    return (P - S[:, :, None] * S[:, None, :] / window_size) / (window_size - 1)
+
+
+def cov_block_size(n, d):
+    # about 32 MB for the stack of matrices
+    return max(1, min(n, (1 << 22) // (d * d)))
+
+
+def sliding_cov(x, window_size, block_size=None):
+    # covariance matrices of all sliding windows of x (T x d), computed block by block.
+    # yields (start, covariances) where covariances is (n_block, d, d), the same as `np.cov`.
+    T, d = x.shape
+    if block_size is None:
+        block_size = cov_block_size(T - window_size + 1, d)
+    for s, seg in sliding_blocks(x, window_size, block_size):
+        yield s, block_cov(seg, window_size)
+
+
+def sliding_lambda_max(x, window_size, block_size=None, backend=None):
+    # the maximum eigenvalue of the covariance matrix of each sliding window (valid part)
+    # for 1 dim input, the standard deviation of each window.
+    # backend: "numpy", "numba" or "auto" (see `kernels`)
     if len(x.shape) == 1:
-        xs = sliding_window(x, window_size)
-        cov_time_tmp = xs.std(1)
-    else:
-        x = x.reshape(x.shape[0], -1)
-        xs = sliding_window(x, (window_size, 1)).reshape(-1,
-                                                         x.shape[1], window_size)
-        cov_time_tmp = np.zeros(xs.shape[0])
-        for i in tqdm.tqdm(range(0, cov_time_tmp.shape[0])):
-            sigmas, _ = np.linalg.eigh(np.cov(xs[i]))
-            cov_time_tmp[i] = sigmas.max()
+        return sliding_window(x, window_size).std(1)
+    x = x.reshape(x.shape[0], -1)
+    if kernels.resolve_backend(backend) == "numba":
+        if block_size is None:
+            block_size = kernels.numba_block_size(x.shape[0] - window_size + 1)
+        return kernels.sliding_lambda_max(np.ascontiguousarray(x, dtype=float), window_size, block_size)
+    ret = np.zeros(x.shape[0] - window_size + 1)
+    for s, cov in sliding_cov(x, window_size, block_size=block_size):
+        # eigenvalues of the stacked matrices in ascending order
+        ret[s:s + cov.shape[0]] = np.linalg.eigvalsh(cov)[:, -1]
+    return ret
+
+
+# estimators of the matrix whose maximum eigenvalue is EWS
+# covariance: covariance matrix (the standard deviation for 1 dim input)
+# spearman: Spearman's rank correlation matrix
+# mad: robust covariance, Spearman's correlation converted to Pearson's (2 sin(pi rho / 6)) and
+#   scaled by the robust standard deviations of the features (1.4826 * MAD)
+# for 1 dim input, the robust estimators give the robust standard deviation of each window.
+ESTIMATORS = ("covariance", "spearman", "mad")
+
+# MAD of the standard normal distribution is 1 / MAD_SCALE
+MAD_SCALE = 1.4826
+
+
+def block_ranks(seg, window_size):
+    # ranks (average ranks for ties) of the samples in each window of a segment, (nb, window_size, d).
+    # as the sums of `block_cov`, the ranks are obtained from prefix counts instead of sorting each window:
+    # for sample t, the samples u in [t - w + 1, t + w) are compared with it once, and the counts of
+    # x(u) < x(t) (and <=) are accumulated over u, so that the rank of t in any window containing it
+    # is the difference of two prefix counts. each window costs O(w) per feature.
+    L, d = seg.shape
+    w = window_size
+    nb = L - w + 1
+    ret = np.empty((nb, w, d))
+    cnt = np.zeros((L, 2 * w), dtype=np.int32)
+    pad = np.full(w - 1, np.nan)
+    for i in range(d):
+        v = seg[:, i]
+        # band[t, m] = x(t - w + 1 + m); comparisons with NaN outside the segment are False
+        band = sliding_window(np.concatenate([pad, v, pad]), 2 * w - 1)
+        # average rank = (#{x(u) < x(t)} + #{x(u) <= x(t)} + 1) / 2, where the latter includes t itself.
+        # a[t, j]: twice the rank of t at the position j of the window [t - j, t - j + w)
+        np.cumsum(band < v[:, None], axis=1, out=cnt[:, 1:])
+        a = cnt[:, 2 * w - 1:w - 1:-1] - cnt[:, w - 1::-1]
+        np.cumsum(band <= v[:, None], axis=1, out=cnt[:, 1:])
+        a += cnt[:, 2 * w - 1:w - 1:-1] - cnt[:, w - 1::-1] + 1
+        # the rank at the position j of the window k is a[k + j, j]
+        ret[:, :, i] = as_strided(a, shape=(nb, w),
+                                  strides=(a.strides[0], a.strides[0] + a.strides[1])) / 2
+    return ret
+
+
+def block_robust_matrix(seg, window_size, estimator):
+    # Spearman's correlation ("spearman") or the robust covariance ("mad")
+    # of all windows in a segment, (nb, d, d)
+    w = window_size
+    rc = block_ranks(seg, w) - (w + 1) / 2
+    g = np.matmul(rc.transpose(0, 2, 1), rc)
+    sd = np.sqrt(np.diagonal(g, axis1=1, axis2=2))
+    # a constant feature is not correlated with the others
+    inv = np.divide(1, sd, out=np.zeros_like(sd), where=sd > 0)
+    rho = g * inv[:, :, None] * inv[:, None, :]
+    if estimator == "spearman":
+        idx = np.arange(seg.shape[1])
+        rho[:, idx, idx] = 1
+        return rho
+    scale = MAD_SCALE * sliding_mad(seg, w)
+    return 2 * np.sin(np.pi * rho / 6) * scale[:, :, None] * scale[:, None, :]
+
 
+def sliding_mad(x, window_size):
+    # median absolute deviation of each feature in each sliding window (valid part), (n, d)
+    windows = sliding_window(x, window_size, axis=0)
+    med = np.median(windows, axis=2)
+    return np.median(np.abs(windows - med[:, :, None]), axis=2)
+
+
+def robust_block_size(n, window_size, d):
+    # about 32 MB for the ranks of the windows, and at least window_size windows,
+    # so that the comparisons at the edges of the segment are shared by enough windows
+    return max(1, min(n, max(window_size, (1 << 22) // (window_size * d))))
+
+
+def sliding_robust_lambda_max(x, window_size, estimator="spearman", block_size=None):
+    # the maximum eigenvalue of the robust matrix ("spearman" or "mad", see ESTIMATORS)
+    # of each sliding window (valid part).
+    # for 1 dim input, the robust standard deviation (1.4826 * MAD) of each window.
+    if estimator not in ESTIMATORS[1:]:
+        raise NameError('select \'spearman\' or \'mad\'')
+    if len(x.shape) == 1:
+        return MAD_SCALE * sliding_mad(x[:, None], window_size)[:, 0]
+    x = x.reshape(x.shape[0], -1)
+    T, d = x.shape
+    n = T - window_size + 1
+    if block_size is None:
+        block_size = robust_block_size(n, window_size, d)
+    ret = np.zeros(n)
+    for s, seg in sliding_blocks(x, window_size, block_size):
+        mat = block_robust_matrix(seg, window_size, estimator)
+        ret[s:s + mat.shape[0]] = np.linalg.eigvalsh(mat)[:, -1]
+    return ret
+
+
+def sliding_ews(x, window_size, estimator="covariance", backend=None):
+    # EWS of each sliding window (valid part) by the estimator (see ESTIMATORS)
+    if estimator == "covariance":
+        return sliding_lambda_max(x, window_size, backend=backend)
+    elif estimator in ESTIMATORS:
+        return sliding_robust_lambda_max(x, window_size, estimator)
+    raise NameError('select \'covariance\', \'spearman\', or \'mad\'')
+
+
+# indicators of `sliding_indicators`
+# lambda_max: the maximum eigenvalue of the covariance matrix (the standard deviation for 1 dim input)
+# variance: variance of each feature, averaged over features
+# ac1: lag-1 autocorrelation of each feature, averaged over features
+# skewness: skewness of each feature, averaged over features
+# mean_abs_cross_corr: mean of absolute correlations between pairs of features
+INDICATORS = ("lambda_max", "variance", "ac1",
+              "skewness", "mean_abs_cross_corr")
+
+
+def sliding_indicators(x, window_size, indicators=INDICATORS, block_size=None):
+    # rolling indicators of each sliding window (valid part), computed in one pass.
+    # in each block of windows, the per-feature moments and lag-1 products are prefix sums
+    # shared by the indicators, and the covariance matrices (only when lambda_max or
+    # mean_abs_cross_corr is requested) are updated as in `sliding_cov`.
+    # returns a structured array with a field for each indicator.
+    for name in indicators:
+        if name not in INDICATORS:
+            raise NameError('select indicators from ' +
+                            ', '.join(f'\'{i}\'' for i in INDICATORS))
+    squeeze = len(x.shape) == 1
+    x = x.reshape(x.shape[0], -1)
+    T, d = x.shape
+    w = window_size
+    n = T - w + 1
+    ret = np.zeros(n, dtype=[(name, float) for name in indicators])
+    need_cov = ("lambda_max" in indicators and not squeeze) or "mean_abs_cross_corr" in indicators
+    if block_size is None:
+        block_size = cov_block_size(n, d) if need_cov else max(
+            1, min(n, (1 << 22) // d))
+    for s, seg in sliding_blocks(x, w, block_size):
+        nb = seg.shape[0] - w + 1
+        sl = slice(s, s + nb)
+        # prefix sums of moments and lag-1 products (nb windows x d)
+        c1 = np.concatenate([np.zeros((1, d)), np.cumsum(seg, axis=0)])
+        c2 = np.concatenate([np.zeros((1, d)), np.cumsum(seg ** 2, axis=0)])
+        S1 = c1[w:] - c1[:nb]
+        S2 = c2[w:] - c2[:nb]
+        mean = S1 / w
+        # central second moment (biased)
+        m2 = S2 / w - mean ** 2
+        if "variance" in indicators:
+            ret["variance"][sl] = np.mean(m2 * w / (w - 1), axis=1)
+        if "lambda_max" in indicators and squeeze:
+            # as `EWS_DNB` for 1 dim input
+            ret["lambda_max"][sl] = np.sqrt(np.maximum(m2[:, 0], 0))
+        if "skewness" in indicators:
+            c3 = np.concatenate(
+                [np.zeros((1, d)), np.cumsum(seg ** 3, axis=0)])
+            S3 = c3[w:] - c3[:nb]
+            m3 = S3 / w - 3 * mean * S2 / w + 2 * mean ** 3
+            with np.errstate(divide="ignore", invalid="ignore"):
+                ret["skewness"][sl] = np.mean(m3 / m2 ** 1.5, axis=1)
+        if "ac1" in indicators:
+            cl = np.concatenate([np.zeros((1, d)), np.cumsum(
+                seg[:-1] * seg[1:], axis=0)])
+            # pairs (t, t + 1) in the window
+            k = w - 1
+            Sxy = cl[k:k + nb] - cl[:nb]
+            Sx = S1 - seg[w - 1:w - 1 + nb]
+            Sy = S1 - seg[:nb]
+            Sxx = S2 - seg[w - 1:w - 1 + nb] ** 2
+            Syy = S2 - seg[:nb] ** 2
+            with np.errstate(divide="ignore", invalid="ignore"):
+                ac1 = (k * Sxy - Sx * Sy) / np.sqrt((k * Sxx - Sx ** 2) * (k * Syy - Sy ** 2))
+            ret["ac1"][sl] = np.mean(ac1, axis=1)
+        if need_cov:
+            cov = block_cov(seg, w)
+            if "lambda_max" in indicators and not squeeze:
+                ret["lambda_max"][sl] = np.linalg.eigvalsh(cov)[:, -1]
+            if "mean_abs_cross_corr" in indicators:
+                if d < 2:
+                    ret["mean_abs_cross_corr"][sl] = np.nan
+                else:
+                    sd = np.sqrt(np.diagonal(cov, axis1=1, axis2=2))
+                    iu = np.triu_indices(d, k=1)
+                    with np.errstate(divide="ignore", invalid="ignore"):
+                        cor = cov[:, iu[0], iu[1]] / \
+                            (sd[:, iu[0]] * sd[:, iu[1]])
+                    ret["mean_abs_cross_corr"][sl] = np.mean(
+                        np.abs(cor), axis=1)
+    return ret
+
+
+@timed("EWS_indicators")
+def EWS_indicators(x, window_size, indicators=INDICATORS, padding='online', normalization='straight'):
+    # rolling indicators on the same windows as `EWS_DNB`, in one pass over the series.
+    # returns a structured array of the length of the series (padded as `EWS_DNB`),
+    # whose field "lambda_max" is the same as the result of `EWS_DNB`.
+    logger.info('caluculating time series indicators:')
+    x = normalize(x, normalization)
+    ret_tmp = sliding_indicators(x, window_size, indicators)
+    ret = np.zeros(x.shape[0] if padding != 'valid' else ret_tmp.shape[0],
+                   dtype=ret_tmp.dtype)
+    for name in ret_tmp.dtype.names:
+        ret[name] = pad_ews(ret_tmp[name], x.shape[0], window_size, padding)
+    return ret
+
+
+@timed("EWS_DNB")
+def EWS_DNB(x, window_size, padding='online', normalization='straight', backend=None,
+            estimator='covariance'):
+    # estimator: "covariance", or "spearman" and "mad" robust to outliers (see ESTIMATORS)
+    logger.info('caluculating time series DNB:')
+    x = normalize(x, normalization)
+    cov_time_tmp = sliding_ews(x, window_size, estimator, backend=backend)
+    return pad_ews(cov_time_tmp, x.shape[0], window_size, padding)
+
+
+def pad_ews(cov_time_tmp, length, window_size, padding='online'):
+    # pad EWS of the valid part (`sliding_lambda_max`) to the length of the series
     if padding == 'same':
         # padding marage data using the edge
-        cov_time = np.zeros(x.shape[0])
+        cov_time = np.zeros(length)
         cov_time[window_size//2:-window_size//2+1] = cov_time_tmp
         cov_time[:window_size//2] = cov_time_tmp[0]
         cov_time[-window_size//2+1:] = cov_time_tmp[-1]
         return cov_time
     elif padding == 'online':
         # cov_time[t] is calculated as time-sereis data t - window_size : t
-        cov_time = np.zeros(x.shape[0])
+        cov_time = np.zeros(length)
         cov_time[:window_size-1] = cov_time_tmp[0]
         cov_time[window_size-1:] = cov_time_tmp
         return cov_time
@@ -67,7 +321,7 @@ def EWS_DNB(x, window_size, padding='online', normalization='straight'):
         return -1
 
 
-def CPDotsu(ews):
+def CPDotsu(ews, backend=None):
     def OtsuScore(data, thresh):
         w_0 = np.sum(data <= thresh)/data.shape[0]
         w_1 = np.sum(data > thresh)/data.shape[0]
@@ -82,9 +336,12 @@ def CPDotsu(ews):
 
         return sigma2_b
     ths = (ews.max() - ews.min()) * np.arange(0, 1, 1e-4) + ews.min()
-    scores = np.zeros(ths.shape[0])
-    for i in range(ths.shape[0]):
-        scores[i] = OtsuScore(ews, ths[i])
+    if kernels.resolve_backend(backend) == "numba":
+        scores = kernels.otsu_scores(np.ascontiguousarray(ews, dtype=float), ths)
+    else:
+        scores = np.zeros(ths.shape[0])
+        for i in range(ths.shape[0]):
+            scores[i] = OtsuScore(ews, ths[i])
     y_ews = np.zeros(ews.shape[0])
     y_ews[ews > ths[scores.argmax()]] = 1
 
@@ -93,9 +350,9 @@ def CPDotsu(ews):
     return cp
 
 
-@timer
-def CPD_EWS(ews, cfg={'type': 'ar', 'dim': 2}, scope_range=np.inf):
-    print('caluculating change point:')
+@timed("CPD_EWS")
+def CPD_EWS(ews, cfg={'type': 'ar', 'dim': 2}, scope_range=np.inf, backend=None):
+    logger.info('caluculating change point:')
     max_time = ews.argmax()
     window_size = min(scope_range, max_time)
     ews_calc = ews[max_time - window_size:max_time] / \
@@ -103,7 +360,7 @@ def CPD_EWS(ews, cfg={'type': 'ar', 'dim': 2}, scope_range=np.inf):
     if cfg['type'] == 'peak':
         cp = max_time
     elif cfg['type'] == 'ohtsu':
-        cp = max_time - window_size + CPDotsu(ews_calc)
+        cp = max_time - window_size + CPDotsu(ews_calc, backend=backend)
     elif cfg['type'] == 'linear':
         algo = rpt.Dynp(model='linear', min_size=1, jump=1).fit(
             ews_calc.reshape(-1, 1))
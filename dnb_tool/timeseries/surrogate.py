@@ -0,0 +1,141 @@
+import os
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from scipy.stats import kendalltau
+
+from ..parallel import SharedArray, attach, detach, get_attached
+from .dnb_ts import normalize, sliding_ews
+
+
+########
+#### surrogate data ####
+########
+
+def phase_randomize(x, rng):
+    # phase-randomized surrogate, which keeps the power spectrum of each feature.
+    # the same random phases are used for all features, so that their cross-correlations are kept.
+    x = x.reshape(x.shape[0], -1)
+    T = x.shape[0]
+    X = np.fft.rfft(x, axis=0)
+    phases = rng.uniform(0, 2 * np.pi, X.shape[0])
+    # the mean (and the Nyquist component for even T) stays real
+    phases[0] = 0
+    if T % 2 == 0:
+        phases[-1] = 0
+    return np.fft.irfft(X * np.exp(1j * phases)[:, None], n=T, axis=0)
+
+
+def block_shuffle(x, rng, block_size):
+    # surrogate made by shuffling blocks of `block_size` steps,
+    # which keeps short-range autocorrelation and cross-correlation within the blocks
+    x = x.reshape(x.shape[0], -1)
+    blocks = np.arange(0, x.shape[0], block_size)
+    order = rng.permutation(len(blocks))
+    return np.concatenate([x[blocks[i]:blocks[i] + block_size] for i in order], axis=0)
+
+
+def make_surrogate(x, rng, method, block_size):
+    if method == "phase":
+        return phase_randomize(x, rng)
+    elif method == "block":
+        return block_shuffle(x, rng, block_size)
+    else:
+        raise NameError('select \'phase\' or \'block\'')
+
+
+########
+#### statistics ####
+########
+
+def ews_statistic(ews, statistic, end=None):
+    # statistic of EWS to be tested
+    # peak: the maximum value
+    # kendall: Kendall's tau between EWS and time (increasing trend)
+    # end: the statistic is calculated on ews[:end] (e.g. up to the change point)
+    ews = ews[:end]
+    if statistic == "peak":
+        return ews.max()
+    elif statistic == "kendall":
+        return kendalltau(np.arange(ews.shape[0]), ews).statistic
+    else:
+        raise NameError('select \'peak\' or \'kendall\'')
+
+
+def surrogate_statistics(seeds, window_size, normalization, method, block_size, statistic, end,
+                         backend=None, estimator="covariance"):
+    # statistics of EWS calculated for the surrogates of the series attached in this process
+    x = get_attached("x")
+    ret = np.zeros(len(seeds))
+    for i, seed in enumerate(seeds):
+        rng = np.random.default_rng(seed)
+        x_s = make_surrogate(x, rng, method, block_size)
+        ews = sliding_ews(normalize(x_s, normalization), window_size,
+                          estimator, backend=backend)
+        ret[i] = ews_statistic(ews, statistic, end)
+    return ret
+
+
+def surrogate_test(x, window_size, n_surrogates=200, method="phase", statistic="kendall",
+                   normalization="straight", block_size=None, end=None,
+                   n_jobs=1, seed=0, batch_size=None, backend=None, estimator="covariance"):
+    # significance test of EWS by surrogate data.
+    # EWS (the maximum eigenvalue of sliding covariance, as `EWS_DNB` with padding='valid')
+    # is calculated for `n_surrogates` surrogates of x, and the statistic of the original series
+    # is compared with their distribution.
+    #
+    # x: (T,) or (T, d) time series
+    # method: "phase" (phase randomization) or "block" (block shuffle)
+    # statistic: "peak" or "kendall"
+    # block_size: the length of blocks for "block" (default: window_size)
+    # end: the statistic is calculated on EWS up to this index of the valid part (e.g. change point).
+    #   at least 2 values are necessary.
+    # n_jobs: the number of worker processes. the series is shared through shared memory.
+    #   if None, all CPUs are used.
+    # seed: seed of random streams. the result does not depend on `n_jobs`.
+    # estimator: estimator of EWS, "covariance", "spearman" or "mad" (see `dnb_ts.ESTIMATORS`)
+    # backend: backend of `sliding_lambda_max`. with "numba", each process also runs
+    #   its own threads, so a small `n_jobs` is preferable.
+    #
+    # returns a dictionary with
+    # statistic: the statistic of the original series
+    # p_value: empirical p-value, (1 + #{surrogates >= statistic}) / (1 + n_surrogates)
+    # null: statistics of the surrogates
+    if end is not None and end < 2:
+        raise ValueError(
+            f"the significance test needs the EWS of at least 2 windows before the change point, "
+            f"but it ends at index {end} of the valid part. The change point may be in the first window "
+            f"of {window_size} steps.")
+    x = np.asarray(x, dtype=float)
+    if block_size is None:
+        block_size = window_size
+    ews = sliding_ews(normalize(x, normalization), window_size,
+                      estimator, backend=backend)
+    observed = ews_statistic(ews, statistic, end)
+
+    if n_jobs is None:
+        n_jobs = os.cpu_count()
+    if batch_size is None:
+        batch_size = max(1, -(-n_surrogates // (4 * n_jobs)))
+    seeds = np.random.SeedSequence(seed).spawn(n_surrogates)
+    batches = [seeds[i:i+batch_size]
+               for i in range(0, n_surrogates, batch_size)]
+    args = (window_size, normalization, method,
+            block_size, statistic, end, backend, estimator)
+
+    shared = SharedArray(x)
+    specs = {"x": shared.spec()}
+    try:
+        if n_jobs == 1:
+            attach(specs)
+            null = [surrogate_statistics(b, *args) for b in batches]
+        else:
+            with ProcessPoolExecutor(max_workers=n_jobs, initializer=attach, initargs=(specs,)) as executor:
+                null = list(executor.map(surrogate_statistics, batches,
+                                         *[[a] * len(batches) for a in args]))
+    finally:
+        detach(specs.keys())
+        shared.close()
+    null = np.concatenate(null)
+
+    p_value = (1 + np.sum(null >= observed)) / (1 + n_surrogates)
+    return {"statistic": observed, "p_value": p_value, "null": null}
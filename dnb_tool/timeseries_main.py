@@ -1,98 +1,476 @@
 import argparse
+import json
+import os
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
-from .timeseries.dnb_ts import EWS_DNB, CPD_EWS
+from .timeseries.dnb_ts import EWS_DNB, EWS_indicators, CPD_EWS, ESTIMATORS, INDICATORS
+from .timeseries.decimate import minmax_decimate, lttb, select_features
+from .timeseries.surrogate import surrogate_test
+from .tabular.dnb import set_auto_params
+from .tabular.dnb_iterate import dnb_tb_arrays
+from .tabular.output import ResultWriter, write_json
+from .shard import ShardDirectory
+from .instrument import Recorder, context, get_logger, record, set_recorder, setup_logging, stage
 
+logger = get_logger("dnb_tool.timeseries_main")
 
-def main():
-    # set parser
-    parser = argparse.ArgumentParser(
-        description='This script aims to create early warning signals for branches, based on Dynamic Network Biomarker (DNB) theory.',
-        add_help=True
-    )
-    parser.add_argument('filename',
-                        help='Target csv filename: the 1st raw is description, the 1st columns is time or steps, the second and subsequent lines are data.')
 
-    parser.add_argument('--input_path',
-                        default=".",
-                        help='the name of folder that contains input .csv files (default: %(default)s)')
-    parser.add_argument('--window_size',
-                        default=100,
-                        help='sindow size to calculate covarrience matrix')
-    parser.add_argument('--padding',
-                        default="online",
-                        choices=["valid", "same", "online"],
-                        help='padding controls the values of the time-series on both sides., valid: no padding, same: completing the numbers so that the output is centered, online: completing numbers so that outputs can be calculated online.')
-    parser.add_argument('--normalization',
-                        default="straight",
-                        choices=["straight", "std", "minmax", "PCA"],
-                        help='normalization type; straight: not normalized, std: std of the data become 1, minmax: the maximum error of data become 1, PCA: Dimensions are compressed by PCA (Output is 10 dimensions). ')
-    parser.add_argument('--cfg',
-                        default={'type': 'ar', 'dim': 1},
-                        help='Config of change point detection methods; type: peak : bifucation point assume peak linear : Linear prediction, ar : AR model, Ohtsu :  01 detection using Ohtsu method, dim: order of the target model')
-    parser.add_argument('--scope_range',
-                        default=1000,
-                        help='Range to probe the change point from the maximum')
+# label of EWS in the plot for each estimator
+ESTIMATOR_LABELS = {
+    "covariance": '$\lambda_{max}$(Covariance matrix)',
+    "spearman": '$\lambda_{max}$(Spearman correlation)',
+    "mad": '$\lambda_{max}$(Robust covariance)',
+}
 
-    args = parser.parse_args()
+
+def save_ews(ews, basename, output_format):
+    # write EWS as "EWS_{basename}.{csv,npy,parquet}"
+    df_ews = pd.DataFrame(ews, columns=["EWS_DNB"])
+    if output_format == "csv":
+        filename = f"EWS_{basename}.csv"
+        df_ews.to_csv(filename)
+    elif output_format == "npz":
+        filename = f"EWS_{basename}.npy"
+        np.save(filename, ews)
+    else:
+        filename = f"EWS_{basename}.parquet"
+        df_ews.to_parquet(filename)
+    return filename
+
+
+def save_indicators(indicators, basename, output_format):
+    # write rolling indicators as "EWS_{basename}_indicators.{csv,npy,parquet}"
+    df_ind = pd.DataFrame(indicators)
+    if output_format == "csv":
+        filename = f"EWS_{basename}_indicators.csv"
+        df_ind.to_csv(filename)
+    elif output_format == "npz":
+        filename = f"EWS_{basename}_indicators.npy"
+        np.save(filename, indicators)
+    else:
+        filename = f"EWS_{basename}_indicators.parquet"
+        df_ind.to_parquet(filename)
+    return filename
+
+
+def plot_indicators(indicators, cp, control, max_points, filename):
+    # a panel for each indicator, with the candidates of bifurcation and control
+    names = indicators.dtype.names
+    fig, axes = plt.subplots(len(names), 1, figsize=(8, 1.8 * len(names)),
+                             sharex=True, squeeze=False)
+    for ax, name in zip(axes[:, 0], names):
+        t, y = lttb(indicators[name], max_points)
+        ax.grid()
+        ax.plot(t, y)
+        ax.axvline(cp, color='red')
+        ax.axvline(control, color='blue')
+        ax.set_ylabel(name, fontsize=10)
+    axes[-1, 0].set_xlabel('Step', fontsize=16)
+    fig.tight_layout()
+    fig.align_labels()
+    fig.savefig(filename, bbox_inches='tight')
+    plt.close(fig)
+
+
+def save_dnb_dataset(x_control, x_cp, features, basename, output_format):
+    # write the windows of control and change point as an input of the DNB tool for tabular data.
+    # "DNB_{basename}.{csv,npz,parquet}", which is read by `dnb_tabular` in any format.
+    columns = [f'ctrl_{i:06}' for i in range(
+        x_control.shape[0])] + [f'expr_{i:06}' for i in range(x_cp.shape[0])]
+    data = np.r_[x_control, x_cp].T
+    if output_format == "npz":
+        filename = f"DNB_{basename}.npz"
+        np.savez(filename, data=data, index=np.asarray(features).astype(str),
+                 columns=np.array(columns))
+        return filename
+    df_out = pd.DataFrame(data, index=features, columns=columns)
+    if output_format == "csv":
+        filename = f"DNB_{basename}.csv"
+        df_out.to_csv(filename)
+    else:
+        filename = f"DNB_{basename}.parquet"
+        df_out.columns = df_out.columns.astype(str)
+        df_out.index = df_out.index.astype(str)
+        df_out.to_parquet(filename)
+    return filename
+
+
+def dnb_window(t, window_size, length, align="before"):
+    # slice of the window of `window_size` steps at step t, clipped to the series of `length` steps.
+    # "before": [t - window_size, t), as the windows of `save_dnb_dataset`,
+    # "center": centered at t, "after": [t, t + window_size)
+    if align == "before":
+        start = t - window_size
+    elif align == "center":
+        start = t - window_size // 2
+    else:
+        start = t
+    return slice(max(0, start), min(length, start + window_size))
+
+
+def check_change_points(change_points, window_size, length, align="before"):
+    # the windows at each candidate and at its half (control) should be in the series
+    for cp in change_points:
+        for t in [cp, cp // 2]:
+            s = dnb_window(t, window_size, length, align)
+            if s.stop - s.start < window_size:
+                raise ValueError(
+                    f"the window of {window_size} steps ({align}) at step {t} for the candidate {cp} "
+                    f"is out of the series of {length} steps. Check --change_points, --dnb_window_size and --dnb_align.")
+
+
+def dnb_groups(x, features, change_points, window_size, align="before"):
+    # the windows at each candidate of the change point (experimental group)
+    # and at the half of it (control group), as `two_step` inputs (features x steps).
+    # the DataFrames are views of x, so that the series is not copied or written to files.
+    groups = []
+    for cp in change_points:
+        s_e = dnb_window(cp, window_size, x.shape[0], align)
+        s_c = dnb_window(cp // 2, window_size, x.shape[0], align)
+        groups.append((pd.DataFrame(x[s_e].T, index=features, copy=False),
+                       pd.DataFrame(x[s_c].T, index=features, copy=False)))
+    return groups
+
+
+def valid_index(cp, window_size, padding):
+    # index of the EWS without padding that corresponds to `cp`
+    if padding == 'online':
+        return cp - window_size + 1
+    elif padding == 'same':
+        return cp - window_size // 2
+    return cp
+
+
+def analyze(args, filename, plot_suffix="", kwargs_DNB=None):
+    # EWS, change point and outputs of a series file.
+    # kwargs_DNB: parameters of `two_step` for the DNB analysis of the windows (option "dnb")
+    # plots are written to "EWS_DNB{plot_suffix}.pdf" (and "EWS_indicators{plot_suffix}.pdf").
+    # returns the summary of the file (the change point and the result of the significance test)
     #### 2. Read data from the csv file ####
 
     input_path = args.input_path
-    df = pd.read_csv(f"{input_path}/{args.filename}", index_col=0)
+    df = pd.read_csv(f"{input_path}/{filename}", index_col=0)
     x = df.values[:, 1:]
 
     # look the csv head data
-    print('Data State')
-    print(df.head(10))
+    logger.info('Data State')
+    logger.info(df.head(10))
 
     #### 3. Calculating the EWS and the candidate of the bifurcation point ####
 
     # calc ews
-    ews = EWS_DNB(x, window_size=args.window_size,
-                  padding=args.padding, normalization=args.normalization)
+    indicators = None
+    if args.indicators:
+        # lambda_max is computed in the same pass as the other indicators
+        names = INDICATORS if args.indicators == "all" else args.indicators.split(",")
+        names = ["lambda_max"] + [n for n in names if n != "lambda_max"]
+        indicators = EWS_indicators(x, window_size=args.window_size, indicators=names,
+                                    padding=args.padding, normalization=args.normalization)
+    if indicators is not None and args.estimator == "covariance":
+        ews = indicators["lambda_max"]
+    else:
+        ews = EWS_DNB(x, window_size=args.window_size,
+                      padding=args.padding, normalization=args.normalization, backend=args.backend,
+                      estimator=args.estimator)
 
     # calc change point
-    cp = CPD_EWS(ews, cfg=args.cfg, scope_range=args.scope_range)
+    cp = CPD_EWS(ews, cfg=args.cfg, scope_range=args.scope_range,
+                 backend=args.backend)
     control = cp//2
+    # the other candidates given by the user are evaluated by the DNB analysis
+    change_points = list(dict.fromkeys([int(cp)] + args.change_points))
+    if args.dnb:
+        check_change_points(change_points, args.dnb_window_size or args.window_size,
+                            x.shape[0], args.dnb_align)
+    record("change_point", n_steps=x.shape[0], n_features=x.shape[1],
+           change_point=int(cp), control=int(control))
+
+    # significance test of EWS up to the change point
+    if args.n_surrogates > 0:
+        logger.info(f'Significance test ({args.n_surrogates} surrogates)')
+        with stage("surrogate_test", n_surrogates=args.n_surrogates):
+            test = surrogate_test(x, args.window_size, n_surrogates=args.n_surrogates,
+                                  method=args.surrogate_method, statistic=args.surrogate_statistic,
+                                  normalization=args.normalization,
+                                  end=valid_index(cp, args.window_size, args.padding) + 1,
+                                  n_jobs=args.n_jobs if args.n_jobs > 0 else None, seed=args.seed,
+                                  backend=args.backend, estimator=args.estimator)
+        logger.info(f'{args.surrogate_statistic} = {test["statistic"]:.4g}, p-value = {test["p_value"]:.4g}')
 
     #### 4. Visualizing and save ####
 
     # Visualization
-    print('Visualization')
+    logger.info('Visualization')
+    max_points = args.max_points if args.max_points > 0 else None
+    max_features = args.max_features if args.max_features > 0 else None
+    # long series are decimated keeping their envelope
+    features = select_features(x.shape[1], max_features)
+    t_x, x_plot = minmax_decimate(x[:, features], max_points)
+    t_ews, ews_plot = lttb(ews, max_points)
+
     fig = plt.figure(figsize=(8, 5))
     plt.subplot(2, 1, 1)
     plt.grid()
-    plt.plot(x)
+    plt.plot(t_x, x_plot)
     plt.ylabel('Feature', fontsize=16)
     plt.subplot(2, 1, 2)
     plt.grid()
-    plt.plot(ews)
+    plt.plot(t_ews, ews_plot)
     plt.scatter(cp, ews[cp], color='red', label='candidate of bifurcation')
+    if len(change_points) > 1:
+        plt.scatter(change_points[1:], ews[change_points[1:]], color='orange',
+                    label='other candidates')
     plt.scatter(control, ews[control], color='blue',
                 label='candidate of control')
     plt.legend(fontsize=16)
-    plt.ylabel('$\lambda_{max}$(Covariance matrix)', fontsize=16)
+    plt.ylabel(ESTIMATOR_LABELS[args.estimator], fontsize=16)
     plt.xlabel('Step', fontsize=16)
     fig.tight_layout()
     fig.align_labels()
-    plt.savefig('EWS_DNB.pdf', bbox_inches='tight')
+    plt.savefig(f'EWS_DNB{plot_suffix}.pdf', bbox_inches='tight')
+    plt.close(fig)
+    if indicators is not None:
+        plot_indicators(indicators, cp, control,
+                        max_points, f'EWS_indicators{plot_suffix}.pdf')
 
     # Save data
-    df_ews = pd.DataFrame(ews, columns=["EWS_DNB"])
-    df_ews.to_csv('EWS_' + args.filename)
+    basename = os.path.splitext(filename)[0]
+    save_ews(ews, basename, args.output_format)
+    if indicators is not None:
+        save_indicators(indicators, basename, args.output_format)
+    if args.n_surrogates > 0:
+        write_json(f"EWS_{basename}_surrogate.json", {
+            "change_point": int(cp),
+            "method": args.surrogate_method,
+            "statistic_name": args.surrogate_statistic,
+            "n_surrogates": args.n_surrogates,
+            "seed": args.seed,
+            "statistic": float(test["statistic"]),
+            "p_value": float(test["p_value"]),
+            "null": test["null"].tolist(),
+        })
 
-    # make DNB tools file
-    print('Make DNB dataset')
-    x_cp = x[cp-args.window_size:cp]
-    x_control = x[control-args.window_size:control]
+    summary = {"filename": filename, "n_steps": int(x.shape[0]), "n_features": int(x.shape[1]),
+               "change_point": int(cp), "control": int(control)}
+    if args.dnb:
+        # DNB of the windows at the change point and the other candidates, in this process
+        logger.info('DNB analysis of the windows at ' +
+                    ', '.join(str(c) for c in change_points))
+        window_size = args.dnb_window_size or args.window_size
+        groups = dnb_groups(x, df.columns[1:], change_points,
+                            window_size, args.dnb_align)
+        ext = "parquet" if args.output_format == "parquet" else "csv"
+        result_filename = f"DNB_{basename}_result.{ext}"
+        with stage("dnb"):
+            dnb_tb_arrays(change_points, groups, kwargs_DNB,
+                          writer=ResultWriter(result_filename, set_auto_params(dict(kwargs_DNB))),
+                          plot_workers=args.plot_workers)
+        logger.info(f'DNB result is "{result_filename}"')
+        summary["dnb_result"] = result_filename
+    else:
+        # make DNB tools file
+        logger.info('Make DNB dataset')
+        x_cp = x[cp-args.window_size:cp]
+        x_control = x[control-args.window_size:control]
+        save_dnb_dataset(x_control, x_cp, df.columns[1:],
+                         basename, args.output_format)
 
-    columns = [f'ctrl_{i:06}' for i in range(
-        x_control.shape[0])] + [f'expr_{i:06}' for i in range(x_cp.shape[0])]
-    index = df.columns[1:]
-    df_out = pd.DataFrame(np.r_[x_control, x_cp].T,
-                          index=index, columns=columns)
-    df_out.to_csv('DNB_' + args.filename)
+    if args.n_surrogates > 0:
+        summary.update(statistic=float(test["statistic"]),
+                       p_value=float(test["p_value"]))
+    return summary
+
+
+def run_shard(args, kwargs_DNB=None):
+    # shard mode: the series files are claimed by the workers sharing `args.shard_dir`,
+    # and one of them writes the summaries in the order of filenames after all files are finished.
+    filenames = sorted(args.filename)
+    keys = [os.path.splitext(f)[0] for f in filenames]
+    exclude = ["filename", "shard_dir", "shard_lock_timeout", "summary_file", "n_jobs",
+               "plot_workers", "metrics_file", "quiet", "verbose"]
+    params = {k: v for k, v in vars(args).items() if k not in exclude}
+    params["kwargs_DNB"] = kwargs_DNB
+    directory = ShardDirectory(args.shard_dir, keys, filenames, params,
+                               lock_timeout=args.shard_lock_timeout)
+    files = dict(zip(keys, filenames))
+
+    def work(pending):
+        for k in pending:
+            if not directory.claim(k, ".json"):
+                continue
+            with context(series=k), stage("series", filename=files[k]):
+                summary = analyze(args, files[k], "_" + k, kwargs_DNB)
+            directory.save(k, ".json",
+                           lambda tmp: write_json(tmp, summary))
+
+    def merge():
+        summaries = []
+        for k in keys:
+            with open(directory.result_path(k, ".json"), "r") as f:
+                summaries.append(json.load(f))
+        pd.DataFrame(summaries).to_csv(args.summary_file, index=False)
+        logger.info(f'Summary file is "{args.summary_file}"')
+        return [args.summary_file]
+
+    # the workers stay until all files are finished (taking over those of crashed workers),
+    # and one of them writes the summary
+    try:
+        directory.run(".json", work, merge)
+    finally:
+        directory.close()
+
+
+def main():
+    # set parser
+    parser = argparse.ArgumentParser(
+        description='This script aims to create early warning signals for branches, based on Dynamic Network Biomarker (DNB) theory.',
+        add_help=True
+    )
+    parser.add_argument('filename',
+                        nargs='+',
+                        help='Target csv filename: the 1st raw is description, the 1st columns is time or steps, the second and subsequent lines are data. If multiple files are given, each of them is analyzed and its plots are written to EWS_DNB_{basename}.pdf')
+
+    parser.add_argument('--input_path',
+                        default=".",
+                        help='the name of folder that contains input .csv files (default: %(default)s)')
+    parser.add_argument('--window_size',
+                        type=int,
+                        default=100,
+                        help='sindow size to calculate covarrience matrix')
+    parser.add_argument('--padding',
+                        default="online",
+                        choices=["valid", "same", "online"],
+                        help='padding controls the values of the time-series on both sides., valid: no padding, same: completing the numbers so that the output is centered, online: completing numbers so that outputs can be calculated online.')
+    parser.add_argument('--normalization',
+                        default="straight",
+                        choices=["straight", "std", "minmax", "PCA"],
+                        help='normalization type; straight: not normalized, std: std of the data become 1, minmax: the maximum error of data become 1, PCA: Dimensions are compressed by PCA (Output is 10 dimensions). ')
+    parser.add_argument('--estimator',
+                        default="covariance",
+                        choices=list(ESTIMATORS),
+                        help='matrix whose maximum eigenvalue is EWS; covariance: covariance matrix, spearman: Spearman\'s rank correlation matrix, mad: robust covariance (Spearman\'s correlation scaled by 1.4826 * MAD of the features). spearman and mad are robust to outliers (default: %(default)s)')
+    parser.add_argument('--cfg',
+                        default={'type': 'ar', 'dim': 1},
+                        help='Config of change point detection methods; type: peak : bifucation point assume peak linear : Linear prediction, ar : AR model, Ohtsu :  01 detection using Ohtsu method, dim: order of the target model')
+    parser.add_argument('--scope_range',
+                        type=int,
+                        default=1000,
+                        help='Range to probe the change point from the maximum')
+    parser.add_argument('--max_points',
+                        type=int,
+                        default=2000,
+                        help='the maximum number of points drawn for each line. Longer series are decimated. 0: draw all points (default: %(default)s)')
+    parser.add_argument('--max_features',
+                        type=int,
+                        default=50,
+                        help='the maximum number of features drawn in the plot. Features are taken at even intervals. 0: draw all features (default: %(default)s)')
+    parser.add_argument('--output_format',
+                        default="csv",
+                        choices=["csv", "npz", "parquet"],
+                        help='format of the output files. csv: EWS_*.csv and DNB_*.csv, npz: EWS_*.npy and DNB_*.npz, parquet: EWS_*.parquet and DNB_*.parquet (requires pyarrow). DNB_* files are accepted by dnb_tabular in any format (default: %(default)s)')
+    parser.add_argument('--indicators',
+                        default=None,
+                        help='rolling indicators computed on the same windows in one pass, comma separated or "all" (' + ', '.join(INDICATORS) + '). They are written to EWS_*_indicators and plotted in EWS_indicators.pdf (default: %(default)s)')
+    parser.add_argument('--n_surrogates',
+                        type=int,
+                        default=0,
+                        help='the number of surrogates for the significance test of EWS up to the change point. The result is written in EWS_*_surrogate.json. 0: no test (default: %(default)s)')
+    parser.add_argument('--surrogate_method',
+                        default="phase",
+                        choices=["phase", "block"],
+                        help='surrogate data; phase: phase randomization, block: shuffle of blocks of window_size steps (default: %(default)s)')
+    parser.add_argument('--surrogate_statistic',
+                        default="kendall",
+                        choices=["kendall", "peak"],
+                        help='statistic of EWS; kendall: Kendall\'s tau between EWS and time, peak: the maximum of EWS (default: %(default)s)')
+    parser.add_argument('--n_jobs',
+                        type=int,
+                        default=1,
+                        help='the number of processes for the significance test. 0: all CPUs (default: %(default)s)')
+    parser.add_argument('--seed',
+                        type=int,
+                        default=0,
+                        help='random seed for the significance test (default: %(default)s)')
+    parser.add_argument('--backend',
+                        default=None,
+                        choices=["numpy", "numba", "auto"],
+                        help='implementation of the sliding statistics and Otsu\'s method; numba requires numba to be installed (default: $DNB_BACKEND or numpy)')
+    parser.add_argument('--dnb',
+                        action='store_true',
+                        help='analyze the windows at the change point by the DNB tool for tabular data in this process, instead of writing DNB_*.csv for dnb_tabular. The result is written to DNB_*_result.csv (or .parquet) with the change point as time_point (default: %(default)s)')
+    parser.add_argument('--change_points',
+                        type=lambda s: [int(t) for t in s.split(",")],
+                        default=[],
+                        help='other candidates of the change point evaluated with --dnb in the same run, comma separated steps. Each candidate is compared with the window at its half, as the detected one, and both windows should be in the series (default: none)')
+    parser.add_argument('--dnb_window_size',
+                        type=int,
+                        default=None,
+                        help='the number of steps of the windows for --dnb (default: --window_size)')
+    parser.add_argument('--dnb_align',
+                        default="before",
+                        choices=["before", "center", "after"],
+                        help='position of the windows for --dnb relative to each candidate; before: the steps up to the candidate, as DNB_*.csv, center: centered at the candidate, after: the steps from the candidate (default: %(default)s)')
+    parser.add_argument('--dnb_config',
+                        default=None,
+                        help='.json file of the parameters of the DNB analysis for --dnb, with the same keys as the configuration file of dnb_tabular (e.g. "thres_gene_filtering", "linkage_threshold", "output_metrics"). Missing parameters are the defaults of dnb_tabular (default: %(default)s)')
+    parser.add_argument('--plot_workers',
+                        type=int,
+                        default=1,
+                        help='the number of threads that write the plot files of --dnb. 0: plots are written before the next candidate is analyzed (default: %(default)s)')
+    parser.add_argument('--shard_dir',
+                        default=None,
+                        help='shard mode: the files are processed by any number of workers (on any machines) running the same command with this shared directory. Each file is claimed by a lock file, and the workers wait until all files are finished (taking over those of crashed workers). Then one of them writes the summary of all files to --summary_file (default: %(default)s)')
+    parser.add_argument('--shard_lock_timeout',
+                        type=float,
+                        default=600,
+                        help='in shard mode, a file whose worker has not updated its lock for this many seconds (e.g. the worker crashed) is taken over by another worker (default: %(default)s)')
+    parser.add_argument('--summary_file',
+                        default="EWS_summary.csv",
+                        help='in shard mode, the change point (and the p-value of the significance test) of each file, in the order of filenames (default: %(default)s)')
+    parser.add_argument('--metrics_file',
+                        default=None,
+                        help='write metrics of the run (timings of stages and peak memory) to this .json or .csv file (default: %(default)s)')
+    parser.add_argument('--quiet',
+                        action='store_true',
+                        help='show only warnings and errors')
+    parser.add_argument('--verbose',
+                        action='store_true',
+                        help='also show the elapsed time of each stage')
+
+    args = parser.parse_args()
+    setup_logging(quiet=args.quiet, verbose=args.verbose)
+    # metrics are recorded only when the file is given
+    recorder = None
+    if args.metrics_file is not None:
+        recorder = Recorder()
+        set_recorder(recorder)
+    if 0 < args.max_points < 3:
+        raise ValueError("--max_points should be 0 (draw all points) or at least 3")
+    if args.change_points and not args.dnb:
+        raise ValueError("--change_points requires --dnb")
+    # parameters of the DNB analysis (option "dnb")
+    kwargs_DNB = None
+    if args.dnb:
+        kwargs_DNB = {}
+        if args.dnb_config:
+            with open(args.dnb_config, "r") as f:
+                kwargs_DNB = json.load(f)
+        for k in kwargs_DNB:
+            if k not in set_auto_params({}):
+                raise ValueError(f"invalid key is in configuration file: {k}")
+    if args.shard_dir is None:
+        for filename in args.filename:
+            # plots of each file are written to different files
+            plot_suffix = "" if len(args.filename) == 1 else "_" + \
+                os.path.splitext(filename)[0]
+            analyze(args, filename, plot_suffix, kwargs_DNB)
+    else:
+        run_shard(args, kwargs_DNB)
+
+    if recorder is not None:
+        recorder.write(args.metrics_file)
+        logger.info(f'Metrics file is "{args.metrics_file}"')
 
 
 if __name__ == "__main__":
@@ -24,6 +24,7 @@ setuptools.setup(
             "dnb_example_timeseries=dnb_tool.example_timeseries:main",
             "dnb_tabular=dnb_tool.tabular_main:main",
             "dnb_timeseries=dnb_tool.timeseries_main:main",
+            "dnb_service=dnb_tool.service:main",
         ],
     },
     classifiers=[
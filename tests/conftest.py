@@ -0,0 +1,43 @@
+import os
+import sys
+
+# tests are run from the source tree
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# plots are written to files without a display
+os.environ.setdefault("MPLBACKEND", "Agg")
+
+
+import numpy as np  # noqa: E402
+import pandas as pd  # noqa: E402
+import pytest  # noqa: E402
+
+
+def table(seed=0, n_genes=100, n_samples=8, n_dnb=10, key_control="ctrl", key_experimental="expr"):
+    # input table of genes (rows) x samples, with `n_samples` columns of each group.
+    # the first `n_dnb` genes fluctuate together in the experimental group.
+    rng = np.random.default_rng(seed)
+    ctrl = rng.standard_normal((n_genes, n_samples))
+    expr = rng.standard_normal((n_genes, n_samples))
+    expr[:n_dnb] = 5 * rng.standard_normal(n_samples) + 0.5 * rng.standard_normal((n_dnb, n_samples))
+    columns = [f"{key_control}_{i}" for i in range(n_samples)] + \
+        [f"{key_experimental}_{i}" for i in range(n_samples)]
+    index = pd.Index([f"gene{i}" for i in range(n_genes)], name="Symbol")
+    return pd.DataFrame(np.hstack([ctrl, expr]), index=index, columns=columns)
+
+
+@pytest.fixture
+def make_table():
+    # make_table(**kwargs) returns `table(**kwargs)`
+    return table
+
+
+@pytest.fixture
+def write_table(tmp_path):
+    # write_table(name, **kwargs) writes `table(**kwargs)` as csv in a temporary directory
+    # and returns the filename
+    def write(name, **kwargs):
+        filename = str(tmp_path / name)
+        table(**kwargs).to_csv(filename)
+        return filename
+    return write
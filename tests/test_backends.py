@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+
+from dnb_tool import kernels
+from dnb_tool.datasets import HP_model, May_model, saddle_node_model
+from dnb_tool.timeseries.dnb_ts import CPDotsu, sliding_lambda_max
+
+RTOL = 1e-8
+
+
+def test_numba_backend_requires_numba():
+    if kernels.has_numba():
+        pytest.skip("numba is installed")
+    assert kernels.resolve_backend("auto") == "numpy"
+    with pytest.raises(ImportError):
+        kernels.resolve_backend("numba")
+
+
+# the compiled kernels (backend "numba") against the NumPy implementations,
+# the same checks as `benchmarks/check_backends.py` on smaller inputs
+
+
+def check_backends(func):
+    pytest.importorskip("numba")
+    ref = np.asarray(func(backend="numpy"))
+    ret = np.asarray(func(backend="numba"))
+    assert ret.shape == ref.shape
+    np.testing.assert_allclose(ret, ref, rtol=RTOL, atol=0)
+
+
+@pytest.mark.parametrize("T, d, w", [(500, 1, 50), (1000, 4, 100), (600, 30, 60)])
+def test_sliding_lambda_max(T, d, w):
+    rng = np.random.default_rng(0)
+    x = rng.standard_normal((T, d)).cumsum(0) * 0.01 + rng.standard_normal((T, d))
+    check_backends(lambda backend: sliding_lambda_max(x, w, backend=backend))
+
+
+@pytest.mark.parametrize("length", [100, 2000])
+def test_CPDotsu(length):
+    rng = np.random.default_rng(0)
+    ews = np.abs(rng.standard_normal(length)).cumsum()
+    check_backends(lambda backend: [CPDotsu(ews, backend=backend)])
+
+
+def test_May_model():
+    check_backends(lambda backend: May_model.get_data(backend=backend)[1])
+
+
+def test_saddle_node_model():
+    check_backends(lambda backend: saddle_node_model.get_data(backend=backend)[1])
+
+
+def test_HP_model():
+    check_backends(lambda backend: HP_model.get_data(n=5, backend=backend)[1])
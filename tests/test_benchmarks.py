@@ -0,0 +1,84 @@
+import json
+import os
+import sys
+
+import pytest
+
+# the benchmark scripts import `synthetic` from their own directory
+sys.path.insert(0, os.path.join(os.path.dirname(
+    os.path.dirname(os.path.abspath(__file__))), "benchmarks"))
+
+import compare  # noqa: E402
+import run  # noqa: E402
+
+TINY = {
+    "tables": [(200, 6)],
+    "clustering": [200],
+    "hp": [2],
+    "may": [1],
+    "otsu": [300],
+    "cpd": [100],
+}
+
+
+@pytest.fixture
+def tiny(monkeypatch):
+    monkeypatch.setitem(run.PRESETS, "tiny", TINY)
+    monkeypatch.setattr(run, "_inputs", {})
+    return "tiny"
+
+
+def test_case_id():
+    assert run.case_id("two_step", {"n_genes": 1000, "n_samples": 20}) == \
+        "two_step[n_genes=1000,n_samples=20]"
+    assert run.case_id("mad", {}) == "mad[]"
+
+
+def test_cases(tiny):
+    # every case of a preset runs, and the ids are unique
+    ids = []
+    for name, params, setup, func in run.cases(tiny):
+        times, peak = run.measure(func, setup(), repeat=2, max_time=60)
+        assert 1 <= len(times) <= 2
+        assert all(t >= 0 for t in times)
+        assert peak > 0
+        ids.append(run.case_id(name, params))
+    assert len(ids) == len(set(ids))
+    assert {i.split("[")[0] for i in ids} == \
+        {"mad", "two_step", "clustering", "EWS_DNB", "CPDotsu", "CPD_EWS"}
+
+
+def test_measure_max_time():
+    calls = []
+    times, _ = run.measure(lambda: calls.append(1), (), repeat=5, max_time=-1)
+    # one timed run exceeds the limit, then one run for the peak memory
+    assert len(times) == 1
+    assert len(calls) == 2
+
+
+def write_results(path, commit, results, machine="m"):
+    with open(path, "w") as f:
+        json.dump({"commit": commit, "dirty": False, "machine": machine,
+                   "results": [{"id": i, "min": t, "peak_memory_mb": m} for i, t, m in results]}, f)
+    return str(path)
+
+
+def test_compare(tmp_path, monkeypatch, capsys):
+    old = write_results(tmp_path / "old.json", "a" * 40,
+                        [("fast[]", 1.0, 10.0), ("slow[]", 1.0, 10.0), ("same[]", 1.0, 10.0)])
+    new = write_results(tmp_path / "new.json", "b" * 40,
+                        [("fast[]", 0.5, 5.0), ("slow[]", 2.0, 10.0), ("same[]", 1.05, 10.0),
+                         ("added[]", 1.0, 1.0)])
+    monkeypatch.setattr(sys, "argv", ["compare.py", old, new])
+    compare.main()
+    lines = {line.split()[0]: line for line in capsys.readouterr().out.splitlines()}
+    assert lines["fast[]"].endswith("faster")
+    assert lines["slow[]"].endswith("slower")
+    assert lines["same[]"].split()[-1] == "1.00"
+    assert lines["added[]"].split()[1] == "-"
+    assert lines["1"].startswith("1 cases are slower")
+
+    monkeypatch.setattr(sys, "argv", ["compare.py", old, new, "--fail"])
+    with pytest.raises(SystemExit) as e:
+        compare.main()
+    assert e.value.code == 1
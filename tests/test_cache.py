@@ -0,0 +1,104 @@
+import os
+
+import pandas as pd
+
+from dnb_tool.tabular.cache import ResultCache
+from dnb_tool.tabular.dnb import set_auto_params
+from dnb_tool.tabular.dnb_iterate import dnb_tb_iterate
+
+
+def params(**kwargs):
+    return set_auto_params({"output_metrics": True, **kwargs})
+
+
+def make_key(cache, filename, **kwargs):
+    return cache.make_key(filename, "ctrl", "expr", params(**kwargs))
+
+
+def result(n=3):
+    return pd.DataFrame({"dnb": [f"gene{i}" for i in range(n)], "cluster": [1] * n,
+                         "dev_expr": [float(i) for i in range(n)]})
+
+
+def test_key_is_stable(tmp_path, write_table):
+    filename = write_table("a.csv")
+    key = make_key(ResultCache(str(tmp_path / "cache")), filename)
+    # a new cache, the same content in another file, and parameters in another order
+    cache = ResultCache(str(tmp_path / "cache"))
+    assert make_key(cache, filename) == key
+    assert make_key(cache, write_table("b.csv")) == key
+    assert cache.make_key(filename, "ctrl", "expr",
+                          dict(reversed(list(params().items())))) == key
+    # the plot options do not change the result
+    assert make_key(cache, filename, plot_heatmap=True, plot_file_prefix="p") == key
+
+
+def test_key_changes_with_input_and_parameters(tmp_path, write_table):
+    cache = ResultCache(str(tmp_path / "cache"))
+    filename = write_table("a.csv")
+    key = make_key(cache, filename)
+    cache.save(key, result())
+    assert make_key(cache, filename, thres_gene_filtering=3) != key
+    assert make_key(cache, filename, linkage_metric="pearson") != key
+    assert cache.make_key(filename, "ctrl", "expr", params(),
+                          control_filename=write_table("c.csv")) != key
+    # the file is overwritten by another content
+    write_table("a.csv", seed=1)
+    new_key = make_key(cache, filename)
+    assert new_key != key
+    assert cache.load(new_key) is None
+
+
+def test_save_and_load(tmp_path):
+    cache = ResultCache(str(tmp_path / "cache"))
+    assert cache.load("missing") is None
+    cache.save("k", result())
+    pd.testing.assert_frame_equal(cache.load("k"), result())
+    cache.remove("k")
+    assert cache.load("k") is None
+
+
+def test_least_recently_used_are_evicted(tmp_path):
+    cache = ResultCache(str(tmp_path / "cache"))
+    for i, key in enumerate(["a", "b", "c"]):
+        cache.save(key, result(100))
+        os.utime(cache.path(key), (i, i))
+    # "a" is used, so "b" is the least recently used
+    cache.load("a")
+    size = os.path.getsize(cache.path("a"))
+    cache.max_size = 2 * size + size // 2
+    cache.evict()
+    assert sorted(os.path.basename(p) for p, _, _ in cache.entries()) == ["a.npz", "c.npz"]
+    # a new result makes room for itself
+    cache.save("d", result(100))
+    assert sorted(os.path.basename(p) for p, _, _ in cache.entries()) == ["a.npz", "d.npz"]
+
+
+def test_clear(tmp_path):
+    cache = ResultCache(str(tmp_path / "cache"))
+    for key in ["a", "b"]:
+        cache.save(key, result())
+    cache.clear()
+    assert cache.entries() == []
+    assert cache.load("a") is None
+
+
+def test_cached_run_writes_plots(tmp_path, write_table):
+    filenames = [write_table("d_1.csv"), write_table("d_2.csv", seed=1)]
+    cache = ResultCache(str(tmp_path / "cache"))
+    kwargs = params(plot_correlation=True, plot_heatmap=True,
+                    plot_file_prefix=str(tmp_path / "plots_"))
+    plots = [str(tmp_path / f"plots_{name}_{k}.png")
+             for name in ["correlation", "heatmap"] for k in [1, 2]]
+
+    def run():
+        return dnb_tb_iterate([1, 2], filenames, "ctrl", "expr", kwargs, cache=cache)
+
+    df = run()
+    first = {p: open(p, "rb").read() for p in plots}
+    for p in plots:
+        os.remove(p)
+    assert len(cache.entries()) == 2
+    pd.testing.assert_frame_equal(run(), df)
+    # the plots of the cached results are the same as the first run
+    assert {p: open(p, "rb").read() for p in plots} == first
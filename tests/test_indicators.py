@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+from scipy.stats import skew
+
+from dnb_tool.timeseries.dnb_ts import INDICATORS, EWS_DNB, EWS_indicators, sliding_indicators
+
+WINDOW_SIZE = 15
+
+
+def series(d):
+    rng = np.random.default_rng(d)
+    x = rng.standard_normal((120, d)).cumsum(0) * 0.1 + rng.standard_normal((120, d))
+    # an offset far from 0, which the sums over the windows should not suffer from
+    return x + 1e3
+
+
+def naive_indicators(win):
+    # indicators of a window (steps, or steps x features) computed directly
+    squeeze = win.ndim == 1
+    win = win.reshape(win.shape[0], -1)
+    d = win.shape[1]
+    ret = {
+        "variance": np.mean(win.var(axis=0, ddof=1)),
+        "ac1": np.mean([np.corrcoef(win[:-1, j], win[1:, j])[0, 1] for j in range(d)]),
+        "skewness": np.mean(skew(win, axis=0)),
+    }
+    # the standard deviation for 1 dim input, as `EWS_DNB`
+    ret["lambda_max"] = win[:, 0].std() if squeeze else np.linalg.eigvalsh(np.atleast_2d(np.cov(win.T)))[-1]
+    if d == 1:
+        ret["mean_abs_cross_corr"] = np.nan
+    else:
+        ret["mean_abs_cross_corr"] = np.mean(np.abs(np.corrcoef(win.T)[np.triu_indices(d, k=1)]))
+    return ret
+
+
+@pytest.mark.parametrize("d", [0, 1, 4])
+@pytest.mark.parametrize("block_size", [None, 7])
+def test_indicators_match_each_window(d, block_size):
+    # d = 0: 1 dim input
+    x = series(max(d, 1))
+    if d == 0:
+        x = x[:, 0]
+    ret = sliding_indicators(x, WINDOW_SIZE, block_size=block_size)
+    assert ret.shape == (x.shape[0] - WINDOW_SIZE + 1,)
+    for t in range(ret.shape[0]):
+        expected = naive_indicators(x[t:t + WINDOW_SIZE])
+        for name in INDICATORS:
+            np.testing.assert_allclose(ret[name][t], expected[name], rtol=1e-6, atol=1e-9,
+                                       err_msg=f"{name} at {t}")
+
+
+def test_subset_of_indicators():
+    x = series(3)
+    ret = sliding_indicators(x, WINDOW_SIZE, indicators=["ac1", "variance"])
+    assert ret.dtype.names == ("ac1", "variance")
+    full = sliding_indicators(x, WINDOW_SIZE)
+    np.testing.assert_array_equal(ret["ac1"], full["ac1"])
+    with pytest.raises(NameError):
+        sliding_indicators(x, WINDOW_SIZE, indicators=["kurtosis"])
+
+
+@pytest.mark.parametrize("padding", ["online", "same", "valid"])
+@pytest.mark.parametrize("d", [1, 4])
+def test_lambda_max_is_EWS_DNB(padding, d):
+    x = series(d)
+    if d == 1:
+        x = x[:, 0]
+    ret = EWS_indicators(x, WINDOW_SIZE, padding=padding)
+    np.testing.assert_allclose(ret["lambda_max"], EWS_DNB(x, WINDOW_SIZE, padding=padding),
+                               rtol=1e-8)
@@ -0,0 +1,45 @@
+import sys
+import threading
+
+from dnb_tool import instrument
+from dnb_tool.instrument import Recorder, quiet, record, set_recorder, stage
+
+
+def test_stage_without_resource_module(monkeypatch):
+    # platforms without `resource` (Windows) record the stage without the peak memory
+    monkeypatch.setitem(sys.modules, "resource", None)
+    assert instrument.peak_memory_mb() is None
+    recorder = Recorder()
+    prev = set_recorder(recorder)
+    try:
+        with stage("read"):
+            pass
+    finally:
+        set_recorder(prev)
+    assert recorder.records[0]["event"] == "read"
+    assert recorder.records[0]["peak_memory_mb"] is None
+
+
+def test_quiet_is_per_thread():
+    recorder = Recorder()
+    prev = set_recorder(recorder)
+    inside = threading.Event()
+    recorded = threading.Event()
+
+    def other():
+        inside.wait()
+        record("other")
+        recorded.set()
+
+    thread = threading.Thread(target=other)
+    thread.start()
+    try:
+        with quiet():
+            record("quiet")
+            inside.set()
+            recorded.wait()
+        record("after")
+    finally:
+        thread.join()
+        set_recorder(prev)
+    assert [r["event"] for r in recorder.records] == ["other", "after"]
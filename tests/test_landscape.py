@@ -0,0 +1,51 @@
+import numpy as np
+import pandas as pd
+
+from dnb_tool.tabular.cache import ResultCache
+from dnb_tool.tabular.dnb_iterate import dnb_tb_iterate
+from dnb_tool.tabular.landscape import LandscapeCollector, landscape_iterate, perturbation_scores
+
+
+def naive_scores(arr_ref, y, module, outside):
+    # the standard deviations and correlations recomputed with the sample added to the reference
+    o = np.setdiff1d(outside, module)
+    arr_new = np.hstack([arr_ref, y[:, None]])
+    sd, sd_new = arr_ref.std(axis=1, ddof=1), arr_new.std(axis=1, ddof=1)
+    C, C_new = np.corrcoef(arr_ref), np.corrcoef(arr_new)
+    diff = np.abs(C_new - C)
+    iu = np.triu_indices(len(module), k=1)
+    return (np.mean(np.abs(sd_new - sd)[module]),
+            np.mean(diff[np.ix_(module, module)][iu]),
+            np.mean(diff[np.ix_(module, o)]))
+
+
+def test_rank_one_update_matches_recomputation():
+    rng = np.random.default_rng(0)
+    arr_ref = rng.standard_normal((30, 10))
+    arr_samples = rng.standard_normal((30, 7))
+    modules = [np.array([0, 1, 2, 3]), np.array([5, 9, 20])]
+    outside = np.arange(0, 30, 2)
+    # small batches, so that the samples are processed in several batches
+    sd_in, pcc_in, pcc_out = perturbation_scores(arr_ref, arr_samples, modules, outside, batch_size=3)
+    for s in range(arr_samples.shape[1]):
+        for k, module in enumerate(modules):
+            expected = naive_scores(arr_ref, arr_samples[:, s], module, outside)
+            np.testing.assert_allclose([sd_in[s, k], pcc_in[s, k], pcc_out[s, k]], expected,
+                                       rtol=1e-10)
+
+
+def test_collector_matches_scores_from_result(tmp_path, write_table):
+    keys = [1, 2]
+    filenames = [write_table(f"d_{k}.csv", seed=k) for k in keys]
+    kwargs = {"output_metrics": True}
+    cache = ResultCache(str(tmp_path / "cache"))
+    # the scores of the main pass, and those of cached results (without `df_x`)
+    for _ in range(2):
+        collector = LandscapeCollector(kwargs)
+        result = dnb_tb_iterate(keys, filenames, "ctrl", "expr", kwargs,
+                                cache=cache, on_timepoint=collector)
+        expected = landscape_iterate(keys, filenames, "ctrl", "expr", kwargs,
+                                     result.reset_index(drop=True))
+        df = pd.concat([collector.scores[k] for k in keys]).reset_index(drop=True)
+        assert len(df) > 0
+        pd.testing.assert_frame_equal(df, expected)
@@ -0,0 +1,89 @@
+import json
+import os
+
+import pandas as pd
+import pytest
+
+from dnb_tool.tabular.dnb import set_auto_params
+from dnb_tool.tabular.dnb_iterate import dnb_tb_iterate
+from dnb_tool.tabular.output import ResultWriter, read_result
+
+PARAMS = set_auto_params({"output_metrics": False})
+
+
+def result(k, n=2):
+    return pd.DataFrame({"dnb": [f"gene{i}" for i in range(n)], "time_point": k})
+
+
+def write_all(writer, keys):
+    for k in keys:
+        if writer.claim(k):
+            writer.write(k, result(k))
+    writer.close()
+
+
+@pytest.mark.parametrize("suffix", [".csv", ".parquet"])
+def test_resume_after_partial_manifest(tmp_path, suffix):
+    filename = str(tmp_path / f"output{suffix}")
+    write_all(ResultWriter(filename, PARAMS), [1, 2, 3])
+    expected = read_result(filename)
+
+    # the run is killed while the 2nd timepoint is written, after its rows but before the checkpoint
+    filename = str(tmp_path / f"killed{suffix}")
+    writer = ResultWriter(filename, PARAMS)
+    writer.write(1, result(1))
+    checkpoint = json.dumps(writer.manifest)
+    writer.write(2, result(2))
+    with open(writer.manifest_filename, "w") as f:
+        f.write(checkpoint)
+
+    writer = ResultWriter(filename, PARAMS, resume=True)
+    assert writer.completed() == ["1"]
+    assert not writer.claim(1) and writer.claim(2)
+    write_all(writer, [1, 2, 3])
+    pd.testing.assert_frame_equal(read_result(filename), expected)
+    with open(writer.manifest_filename) as f:
+        manifest = json.load(f)
+    assert manifest["completed"] == [1, 2, 3] and manifest["finished"]
+
+
+def test_resume_with_other_parameters(tmp_path):
+    filename = str(tmp_path / "output.csv")
+    write_all(ResultWriter(filename, PARAMS), [1])
+    # the plot options may be changed
+    ResultWriter(filename, dict(PARAMS, plot_heatmap=True), resume=True)
+    with pytest.raises(ValueError, match="parameters of the previous run"):
+        ResultWriter(filename, dict(PARAMS, linkage_threshold=0.5), resume=True)
+
+
+@pytest.mark.parametrize("damage", ["remove", "truncate"])
+def test_resume_without_output_starts_over(tmp_path, damage):
+    filename = str(tmp_path / "output.csv")
+    write_all(ResultWriter(filename, PARAMS), [1, 2])
+    if damage == "remove":
+        os.remove(filename)
+    else:
+        with open(filename, "r+") as f:
+            f.truncate(os.path.getsize(filename) - 5)
+    writer = ResultWriter(filename, PARAMS, resume=True)
+    assert writer.completed() == []
+    write_all(writer, [1, 2])
+    assert list(read_result(filename)["time_point"]) == [1, 1, 2, 2]
+
+
+def test_iterate_resumes_completed_timepoints(tmp_path, write_table):
+    keys = [1, 2, 3]
+    filenames = [write_table(f"d_{k}.csv", seed=k) for k in keys]
+    kwargs = {"output_metrics": True}
+    expected = dnb_tb_iterate(keys, filenames, "ctrl", "expr", kwargs).reset_index(drop=True)
+
+    filename = str(tmp_path / "output.csv")
+    params = set_auto_params(dict(kwargs))
+    dnb_tb_iterate(keys[:1], filenames[:1], "ctrl", "expr", kwargs,
+                   writer=ResultWriter(filename, params))
+    analyzed = []
+    dnb_tb_iterate(keys, filenames, "ctrl", "expr", kwargs, prefetch=1,
+                   writer=ResultWriter(filename, params, resume=True),
+                   on_timepoint=lambda k, *args: analyzed.append(k))
+    assert analyzed == [2, 3]
+    pd.testing.assert_frame_equal(read_result(filename), expected, check_dtype=False)
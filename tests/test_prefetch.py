@@ -0,0 +1,119 @@
+import time
+
+import pandas as pd
+import pytest
+
+from dnb_tool.instrument import Recorder, context, record, set_recorder
+from dnb_tool.tabular.dnb import set_auto_params
+from dnb_tool.tabular.dnb_iterate import dnb_tb_iterate
+from dnb_tool.tabular.output import BackgroundWriter, ResultWriter, read_result
+from dnb_tool.tabular.prefetch import Prefetcher
+
+
+@pytest.mark.parametrize("depth", [0, 1, 3])
+def test_items_are_prepared_in_order(depth):
+    items = [(i,) for i in range(10)]
+    with Prefetcher(items, lambda i: i * i, depth=depth) as prefetcher:
+        assert list(prefetcher) == [((i,), i * i) for i in range(10)]
+
+
+def test_prepared_ahead_at_most_depth():
+    # the thread waits for a free slot, so it prepares at most `depth` items (and one more) ahead
+    prepared = []
+
+    def prepare(i):
+        prepared.append(i)
+        return i
+
+    with Prefetcher([(i,) for i in range(10)], prepare, depth=2) as prefetcher:
+        for (i,), _ in prefetcher:
+            if i == 0:
+                time.sleep(0.3)
+                assert len(prepared) <= 4
+                break
+    assert len(prepared) <= 4
+
+
+def test_error_is_raised_after_preceding_items():
+    def prepare(i):
+        if i == 2:
+            raise ValueError("broken file")
+        return i
+
+    taken = []
+    with Prefetcher([(i,) for i in range(5)], prepare, depth=2) as prefetcher:
+        with pytest.raises(ValueError, match="broken file"):
+            for (i,), _ in prefetcher:
+                taken.append(i)
+    assert taken == [0, 1]
+
+
+def test_context_is_passed_to_thread():
+    # records of the thread have the fields of the context where the prefetcher is made
+    recorder = Recorder()
+    prev = set_recorder(recorder)
+    try:
+        with context(run="a"):
+            prefetcher = Prefetcher([(0,)], lambda i: record("read"), depth=1)
+        with prefetcher:
+            list(prefetcher)
+    finally:
+        set_recorder(prev)
+    assert recorder.records[0]["run"] == "a"
+
+
+def result(k):
+    return pd.DataFrame({"dnb": ["gene0"], "time_point": k})
+
+
+@pytest.mark.parametrize("background", [True, False])
+def test_background_writer_keeps_order(tmp_path, background):
+    filename = str(tmp_path / "output.csv")
+    writer = ResultWriter(filename, set_auto_params({}))
+    output = BackgroundWriter(writer, background=background)
+    for k in range(10):
+        output.write(k, result(k))
+    output.close()
+    assert list(read_result(filename)["time_point"]) == list(range(10))
+    assert writer.completed() == [str(k) for k in range(10)]
+
+
+def test_background_writer_raises_write_error(tmp_path):
+    class FailingWriter(ResultWriter):
+        def write(self, key, df):
+            if key == 2:
+                raise OSError("disk full")
+            super().write(key, df)
+
+    filename = str(tmp_path / "output.csv")
+    output = BackgroundWriter(FailingWriter(filename, set_auto_params({})))
+    with pytest.raises(OSError, match="disk full"):
+        try:
+            for k in range(6):
+                output.write(k, result(k))
+        finally:
+            output.close()
+    # the writes after the failed one are skipped
+    assert list(read_result(filename)["time_point"]) == [0, 1]
+
+
+@pytest.mark.parametrize("prefetch", [1, 2])
+def test_iterate_with_prefetch(tmp_path, write_table, prefetch):
+    keys = [1, 2, 3, 4]
+    filenames = [write_table(f"d_{k}.csv", seed=k) for k in keys]
+    kwargs = {"output_metrics": True}
+    expected = dnb_tb_iterate(keys, filenames, "ctrl", "expr", kwargs)
+    pd.testing.assert_frame_equal(
+        dnb_tb_iterate(keys, filenames, "ctrl", "expr", kwargs, prefetch=prefetch), expected)
+
+    filename = str(tmp_path / "output.csv")
+    dnb_tb_iterate(keys, filenames, "ctrl", "expr", kwargs, prefetch=prefetch,
+                   writer=ResultWriter(filename, set_auto_params(dict(kwargs))))
+    pd.testing.assert_frame_equal(read_result(filename), expected.reset_index(drop=True),
+                                  check_dtype=False)
+
+
+def test_iterate_stops_at_broken_input(tmp_path, write_table):
+    filenames = [write_table("d_1.csv"), str(tmp_path / "missing.csv")]
+    with pytest.raises(FileNotFoundError):
+        dnb_tb_iterate([1, 2], filenames, "ctrl", "expr", {}, prefetch=1)
@@ -0,0 +1,95 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from dnb_tool.tabular import formats
+from dnb_tool.tabular.formats import find_sidecar, read_index, read_table, sidecar_paths
+from dnb_tool.tabular.read_files import read_csv_and_select, read_csv_and_split, sniff_orientation
+
+
+def write(df, filename):
+    # write the table in the format of the extension
+    if filename.endswith(".csv"):
+        df.to_csv(filename)
+    elif filename.endswith(".parquet"):
+        df.to_parquet(filename)
+    elif filename.endswith(".feather"):
+        df.reset_index().to_feather(filename)
+    else:
+        np.savez(filename, data=df.values, index=df.index.to_numpy(dtype=str),
+                 columns=np.array(df.columns, dtype=str), index_name=df.index.name)
+    return filename
+
+
+def check_groups(df, df_c, df_e):
+    pd.testing.assert_frame_equal(df_c, df.iloc[:, :8], check_names=False)
+    pd.testing.assert_frame_equal(df_e, df.iloc[:, 8:], check_names=False)
+
+
+@pytest.mark.parametrize("suffix", [".csv", ".parquet", ".feather", ".npz"])
+def test_formats(tmp_path, make_table, suffix):
+    if suffix in [".parquet", ".feather"] and not formats.has_pyarrow():
+        pytest.skip("pyarrow is not installed")
+    df = make_table()
+    filename = write(df, str(tmp_path / f"d_1{suffix}"))
+    assert read_index(filename) == list(df.index)
+    check_groups(df, *read_csv_and_split(filename, "ctrl", "expr"))
+    pd.testing.assert_frame_equal(read_table(filename, columns=[1, 3], rows=[0, 5]),
+                                  df.iloc[[0, 5], [1, 3]], check_names=False)
+
+
+def test_orientation_is_sniffed(tmp_path, make_table):
+    df = make_table()
+    columns = write(df, str(tmp_path / "columns.csv"))
+    rows = write(df.T.rename_axis("sample"), str(tmp_path / "rows.csv"))
+    assert sniff_orientation(columns, "ctrl", "expr", True)[0] == "columns"
+    assert sniff_orientation(rows, "ctrl", "expr", True)[0] == "rows"
+    check_groups(df, *read_csv_and_split(rows, "ctrl", "expr"))
+    pd.testing.assert_frame_equal(read_csv_and_select(rows, "ctrl"), df.iloc[:, :8],
+                                  check_names=False)
+
+
+@pytest.mark.parametrize("pyarrow", [True, False])
+def test_conversion_cache(tmp_path, make_table, monkeypatch, pyarrow):
+    # the binary copy is parquet with pyarrow, otherwise npz
+    if pyarrow and not formats.has_pyarrow():
+        pytest.skip("pyarrow is not installed")
+    monkeypatch.setattr(formats, "has_pyarrow", lambda: pyarrow)
+    df = make_table()
+    filename = write(df, str(tmp_path / "d_1.csv"))
+    path, _ = sidecar_paths(filename)
+    assert path.endswith(".parquet" if pyarrow else ".npz")
+    assert find_sidecar(filename) is None
+    check_groups(df, *read_csv_and_split(filename, "ctrl", "expr", conversion_cache=True))
+    assert find_sidecar(filename) == path
+    # the binary copy is read
+    check_groups(df, *read_csv_and_split(filename, "ctrl", "expr", conversion_cache=True))
+
+    # a new content of another size
+    df = make_table(seed=1, n_genes=120)
+    write(df, filename)
+    assert find_sidecar(filename) is None
+    check_groups(df, *read_csv_and_split(filename, "ctrl", "expr", conversion_cache=True))
+    assert find_sidecar(filename) == path
+
+
+def test_conversion_cache_is_invalidated_by_mtime(tmp_path, make_table):
+    filename = write(make_table(), str(tmp_path / "d_1.csv"))
+    read_csv_and_split(filename, "ctrl", "expr", conversion_cache=True)
+    assert find_sidecar(filename) is not None
+    st = os.stat(filename)
+    os.utime(filename, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    assert find_sidecar(filename) is None
+
+
+def test_first_column_is_scanned_again_after_change(tmp_path, make_table):
+    filename = write(make_table(), str(tmp_path / "d_1.csv"))
+    assert read_index(filename)[:2] == ["gene0", "gene1"]
+    df = make_table().rename(index=lambda s: s.replace("gene", "g"))
+    write(df, filename)
+    st = os.stat(filename)
+    os.utime(filename, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    assert read_index(filename)[:2] == ["g0", "g1"]
+    pd.testing.assert_frame_equal(read_table(filename, rows=[1]), df.iloc[[1]])
@@ -0,0 +1,106 @@
+import asyncio
+import os
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from dnb_tool.service import DNBClient, DNBService, Memo
+from dnb_tool.tabular.core import two_step
+from dnb_tool.tabular.dnb import set_auto_params
+from dnb_tool.tabular.read_files import read_csv_and_split
+from dnb_tool.timeseries.dnb_ts import CPD_EWS, EWS_DNB
+
+SAMPLE_DATA = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                           "dnb_tool", "datasets", "data", "sample_data_1.csv")
+
+
+def test_memo_keeps_recently_used_values():
+    memo = Memo(max_size=2)
+    calls = []
+
+    def get(key):
+        return memo.get(key, lambda: calls.append(key) or key.upper())
+
+    assert [get("a"), get("b"), get("a"), get("c")] == ["A", "B", "A", "C"]
+    # "b" is the least recently used
+    assert list(memo.values) == ["a", "c"]
+    assert get("b") == "B"
+    assert calls == ["a", "b", "c", "b"]
+
+
+def test_memo_computes_once_for_concurrent_requests():
+    memo = Memo()
+    calls = []
+
+    def func():
+        calls.append(1)
+        time.sleep(0.1)
+        return 1
+
+    threads = [threading.Thread(target=memo.get, args=("k", func)) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert calls == [1]
+
+
+@pytest.fixture
+def client(tmp_path):
+    # a service on a unix socket, served by an event loop in a background thread
+    address = f"unix:{tmp_path}/dnb.sock"
+    service = DNBService(max_workers=2, memo_size=2)
+    loop = asyncio.new_event_loop()
+    task = loop.create_task(service.serve(address))
+    # the thread ends when the task is cancelled
+    thread = threading.Thread(target=loop.run_until_complete,
+                              args=(asyncio.gather(task, return_exceptions=True),))
+    thread.start()
+    try:
+        while not os.path.exists(f"{tmp_path}/dnb.sock"):
+            assert thread.is_alive()
+            time.sleep(0.01)
+        with DNBClient(address, timeout=60) as c:
+            yield c
+    finally:
+        loop.call_soon_threadsafe(task.cancel)
+        thread.join()
+        loop.close()
+        service.executor.shutdown()
+
+
+def test_dnb_matches_two_step(client):
+    info = client.load_table("t1", SAMPLE_DATA, "ctrl", "expr")
+    df_c, df_e = read_csv_and_split(SAMPLE_DATA, "ctrl", "expr")
+    assert info == {"type": "table", "n_genes": len(df_e),
+                    "n_experimental": df_e.shape[1], "n_control": df_c.shape[1]}
+    # more parameter sets than the memo keeps
+    for params in [{}, {"linkage_threshold": 0.6}, {"thres_gene_filtering": 2.5},
+                   {"linkage_metric": "pearson"}, {}]:
+        params = dict(params, output_metrics=True)
+        ret = client.dnb("t1", **params)
+        expected, _, _ = two_step(df_e, df_c, **set_auto_params(dict(params)))
+        assert len(expected) > 0
+        pd.testing.assert_frame_equal(ret, expected.reset_index(drop=True), check_dtype=False)
+
+
+def test_ews_matches_EWS_DNB(client, tmp_path):
+    rng = np.random.default_rng(0)
+    x = rng.standard_normal((300, 4)).cumsum(0) * 0.1 + rng.standard_normal((300, 4))
+    filename = str(tmp_path / "series.csv")
+    pd.DataFrame(np.hstack([np.arange(300)[:, None], x])).to_csv(filename)
+    client.load_series("s1", filename)
+    for window_size, padding in [(30, "online"), (40, "same"), (30, "valid")]:
+        ret = client.ews("s1", window_size, padding=padding, cfg={"type": "ohtsu"})
+        expected = EWS_DNB(x, window_size, padding=padding)
+        np.testing.assert_allclose(ret["ews"], expected, rtol=1e-12)
+        assert ret["change_point"] == CPD_EWS(expected, cfg={"type": "ohtsu"}, scope_range=np.inf)
+
+
+def test_errors_are_returned(client):
+    with pytest.raises(RuntimeError, match="not loaded"):
+        client.dnb("missing")
+    assert client.request("ping") == "pong"
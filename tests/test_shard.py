@@ -0,0 +1,96 @@
+import json
+import multiprocessing
+import os
+import time
+
+from dnb_tool.shard import ShardDirectory
+
+KEYS = [f"t{i}" for i in range(6)]
+LOCK_TIMEOUT = 1
+
+
+def worker(work_dir, crash=None):
+    # a worker of the work directory. each unit is processed by writing its key.
+    # crash: "unit" to exit after claiming a unit, "merge" to exit in the merge
+    directory = ShardDirectory(work_dir, KEYS, [k + ".csv" for k in KEYS], {"p": 1},
+                               lock_timeout=LOCK_TIMEOUT)
+
+    def work(pending):
+        for k in pending:
+            if not directory.claim(k, ".json"):
+                continue
+            if crash == "unit":
+                os._exit(1)
+            time.sleep(0.05)
+            with open(os.path.join(work_dir, f"processed_{k}_{os.getpid()}"), "w"):
+                pass
+            directory.save(k, ".json", lambda tmp: open(tmp, "w").write(json.dumps(k)))
+
+    def merge():
+        if crash == "merge":
+            os._exit(1)
+        filename = os.path.join(work_dir, "merged.txt")
+        with open(filename, "a") as f:
+            for k in KEYS:
+                with open(directory.result_path(k, ".json")) as g:
+                    f.write(json.load(g) + "\n")
+        return [filename]
+
+    try:
+        directory.run(".json", work, merge)
+    finally:
+        directory.close()
+
+
+def run_workers(work_dir, crashes):
+    ctx = multiprocessing.get_context("spawn")
+    procs = [ctx.Process(target=worker, args=(str(work_dir), c)) for c in crashes]
+    for p in procs:
+        p.start()
+        # the crashing worker starts first, so that it claims a unit
+        time.sleep(0.5 if p is procs[0] else 0)
+    for p in procs:
+        p.join(60)
+        assert not p.is_alive()
+    return [p.exitcode for p in procs]
+
+
+def check_merged(work_dir):
+    with open(os.path.join(work_dir, "merged.txt")) as f:
+        assert f.read().split() == KEYS
+    assert os.path.exists(os.path.join(work_dir, "merged.json"))
+
+
+def test_units_of_crashed_worker_are_taken_over(tmp_path):
+    exitcodes = run_workers(tmp_path, ["unit", None, None, None])
+    assert exitcodes == [1, 0, 0, 0]
+    check_merged(tmp_path)
+
+
+def test_merge_of_crashed_worker_is_taken_over(tmp_path):
+    # the first worker processes all units, then crashes in the merge
+    exitcodes = run_workers(tmp_path, ["merge"])
+    assert exitcodes == [1]
+    assert not os.path.exists(os.path.join(tmp_path, "merged.json"))
+    exitcodes = run_workers(tmp_path, [None, None])
+    assert exitcodes == [0, 0]
+    check_merged(tmp_path)
+
+
+def test_units_are_processed_once_by_live_workers(tmp_path):
+    exitcodes = run_workers(tmp_path, [None, None, None])
+    assert exitcodes == [0, 0, 0]
+    check_merged(tmp_path)
+    processed = [f for f in os.listdir(tmp_path) if f.startswith("processed_")]
+    assert sorted(f.split("_")[1] for f in processed) == KEYS
+
+
+def test_fresh_lock_is_not_taken_over(tmp_path):
+    directory = ShardDirectory(str(tmp_path), KEYS, [k + ".csv" for k in KEYS], {"p": 1},
+                               lock_timeout=LOCK_TIMEOUT)
+    try:
+        assert directory.claim(KEYS[0], ".json")
+        assert not directory.claim(KEYS[0], ".json")
+        assert os.path.exists(directory.lock_path(KEYS[0]))
+    finally:
+        directory.close()
@@ -0,0 +1,29 @@
+import numpy as np
+import pytest
+
+from dnb_tool.timeseries.surrogate import surrogate_test
+from dnb_tool.timeseries_main import valid_index
+
+WINDOW_SIZE = 20
+
+
+def series():
+    rng = np.random.default_rng(0)
+    return rng.standard_normal((200, 3)).cumsum(0) * 0.1 + rng.standard_normal((200, 3))
+
+
+@pytest.mark.parametrize("padding", ["online", "same"])
+@pytest.mark.parametrize("cp", [0, 5, WINDOW_SIZE // 2])
+def test_change_point_in_first_window(padding, cp):
+    end = valid_index(cp, WINDOW_SIZE, padding) + 1
+    with pytest.raises(ValueError, match="first window"):
+        surrogate_test(series(), WINDOW_SIZE, n_surrogates=5, end=end)
+
+
+@pytest.mark.parametrize("statistic", ["peak", "kendall"])
+def test_statistic_up_to_change_point(statistic):
+    end = valid_index(100, WINDOW_SIZE, "online") + 1
+    test = surrogate_test(series(), WINDOW_SIZE, n_surrogates=5, statistic=statistic, end=end)
+    assert np.isfinite(test["statistic"])
+    assert test["null"].shape == (5,)
+    assert 0 < test["p_value"] <= 1
@@ -0,0 +1,58 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from dnb_tool.tabular.tracking import track_clusters, track_summary
+
+
+def result_frame():
+    # two time points: a single-gene cluster (cor_mean is NaN) in both, and a cluster of two genes
+    return pd.DataFrame({
+        "dnb": ["a", "b", "c", "a", "b", "c"],
+        "cluster": [1, 2, 2, 1, 2, 2],
+        "clustersize": [1, 2, 2, 1, 2, 2],
+        "dev_expr": [1.0, 2.0, 3.0, 1.0, 2.0, 2.0],
+        "dev_ctrl": [1.0] * 6,
+        "cor_mean": [np.nan, 0.5, 0.5, np.nan, 0.6, 0.6],
+        "time_point": [1, 1, 1, 2, 2, 2],
+    })
+
+
+def test_tracks_link_identical_clusters():
+    df_tracks = track_clusters(result_frame())
+    assert df_tracks["track"].nunique() == 2
+    linked = df_tracks[df_tracks["time_point"] == 2]
+    assert (linked["jaccard"] == 1.0).all()
+
+
+def test_summary_of_track_without_composite_index():
+    summary = track_summary(track_clusters(result_frame())).set_index("track")
+    assert len(summary) == 2
+    nan_track = summary[summary["max_clustersize"] == 1].iloc[0]
+    assert np.isnan(nan_track["peak_composite_index"])
+    assert np.isnan(nan_track["peak_time_point"])
+    peak = summary[summary["max_clustersize"] == 2].iloc[0]
+    assert peak["peak_time_point"] == 1
+    assert peak["peak_composite_index"] == 1.25
+
+
+def test_tracks_end_at_time_point_without_clusters():
+    # the same clusters at time points 1 and 3, and no cluster at 2
+    df = result_frame()
+    df["time_point"] = [1, 1, 1, 3, 3, 3]
+    df_tracks = track_clusters(df, time_points=[1, 2, 3])
+    assert df_tracks["track"].nunique() == 4
+    assert df_tracks["jaccard"].isna().all()
+    summary = track_summary(df_tracks)
+    assert (summary["length"] == 1).all()
+    # without the time points, the clusters are linked over the gap
+    assert track_clusters(df)["track"].nunique() == 2
+
+
+def test_time_points_are_matched_as_strings():
+    # e.g. keys in the manifest and the output file read back with integers
+    df_tracks = track_clusters(result_frame(), time_points=["1", "2"])
+    assert df_tracks["track"].nunique() == 2
+    assert sorted(df_tracks["time_point"].unique()) == [1, 2]
+    with pytest.raises(ValueError, match="not in the time points"):
+        track_clusters(result_frame(), time_points=[1])
@@ -0,0 +1,127 @@
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+import pytest
+from matplotlib.image import imread
+
+from dnb_tool.tabular.visualize import (PlotWorker, block_mean, normalize_by_control, plot_correlation,
+                                        plot_heatmap, render_correlation, render_heatmap, value_range)
+
+
+def groups_with_nan():
+    # 20 genes, 8 samples in each group. the first gene has no control value,
+    # the second a constant control value, and some others a few missing values.
+    rng = np.random.default_rng(0)
+    arr_e = rng.standard_normal((20, 8))
+    arr_c = rng.standard_normal((20, 8))
+    arr_c[0] = np.nan
+    arr_c[1] = 1.0
+    arr_e[2, :3] = np.nan
+    arr_c[3, 5] = np.nan
+    index = [f"g{i}" for i in range(20)]
+    return pd.DataFrame(arr_e, index=index), pd.DataFrame(arr_c, index=index)
+
+
+def n_colors(filename):
+    image = imread(filename)
+    return len(np.unique(image.reshape(-1, image.shape[-1]), axis=0))
+
+
+def test_normalize_by_control_with_nan():
+    df_e, df_c = groups_with_nan()
+    arr_e, arr_c = normalize_by_control(df_e.values, df_c.values)
+    # only the missing values remain missing
+    assert np.array_equal(np.isnan(arr_e), np.isnan(df_e.values))
+    assert np.array_equal(np.isnan(arr_c), np.isnan(df_c.values))
+    v0, v1 = value_range(arr_e, arr_c)
+    assert np.isfinite(v0) and np.isfinite(v1) and v0 < v1
+    assert value_range(np.full((2, 2), np.nan)) == (None, None)
+
+
+def render(fast, df_e, df_c, df_x, directory):
+    # heatmap and correlation plot of all the genes, returns the filenames
+    df_ret = pd.DataFrame({"dnb": df_e.index})
+    heatmap = str(directory / "heatmap.png")
+    correlation = str(directory / "correlation.png")
+    if fast:
+        render_heatmap(df_e.values, df_c.values, filename=heatmap)
+        render_correlation(df_x.values, filename=correlation)
+    else:
+        plot_heatmap(df_e, df_c, df_ret, filename=heatmap)
+        plot_correlation(df_x, df_ret, filename=correlation)
+    return heatmap, correlation
+
+
+@pytest.mark.parametrize("fast", [True, False])
+def test_plots_with_nan(tmp_path, fast):
+    df_e, df_c = groups_with_nan()
+    (tmp_path / "nan").mkdir()
+    (tmp_path / "const").mkdir()
+    heatmap, correlation = render(fast, df_e, df_c, pd.concat([df_e, df_c], axis=1), tmp_path / "nan")
+    assert os.path.getsize(correlation) > 0
+    # the heatmap of constant values (a single colour) is the reference
+    # of the colours of the background, the axes and the labels.
+    # each cell of the heatmap has its own colour.
+    ones = pd.DataFrame(np.ones(df_e.shape), index=df_e.index)
+    ref, _ = render(fast, ones, ones, df_e, tmp_path / "const")
+    assert n_colors(heatmap) > n_colors(ref) + 100
+
+
+def test_block_mean():
+    arr = np.arange(35.0).reshape(5, 7)
+    assert block_mean(arr, None) is arr
+    # blocks of 2 rows and 3 columns, where the last blocks are smaller
+    small = block_mean(arr, 3)
+    assert small.shape == (3, 3)
+    assert small[0, 0] == arr[:2, :3].mean()
+    assert small[2, 2] == arr[4:, 6:].mean()
+
+
+def test_plot_worker_bounds_pending_plots():
+    worker = PlotWorker(max_workers=1)
+    release = threading.Event()
+    running = []
+
+    def plot(i):
+        running.append(i)
+        release.wait()
+
+    try:
+        for i in range(worker.max_pending):
+            worker.submit(plot, i)
+        # the next plot waits for the oldest one
+        blocked = threading.Thread(target=worker.submit, args=(plot, worker.max_pending))
+        blocked.start()
+        blocked.join(0.2)
+        assert blocked.is_alive()
+        release.set()
+        blocked.join()
+    finally:
+        release.set()
+        worker.close()
+    assert running == list(range(worker.max_pending + 1))
+
+
+@pytest.mark.parametrize("max_workers", [0, 2])
+def test_plot_worker_raises_error(max_workers):
+    def plot(i):
+        if i == 1:
+            raise RuntimeError("cannot write")
+
+    worker = PlotWorker(max_workers=max_workers)
+    with pytest.raises(RuntimeError, match="cannot write"):
+        try:
+            for i in range(3):
+                worker.submit(plot, i)
+        finally:
+            worker.close()
+
+
+def test_plots_are_downsampled(tmp_path):
+    df_e, df_c = groups_with_nan()
+    filename = str(tmp_path / "heatmap.png")
+    render_heatmap(np.tile(df_e.values, (100, 1)), np.tile(df_c.values, (100, 1)),
+                   filename=filename, max_pixels=50)
+    assert os.path.getsize(filename) > 0
@@ -0,0 +1,118 @@
+import logging
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from dnb_tool import tabular_main
+from dnb_tool.tabular.dnb import set_auto_params
+from dnb_tool.tabular.dnb_iterate import dnb_tb_groups, dnb_tb_iterate
+from dnb_tool.tabular.output import ResultWriter, read_result
+from dnb_tool.tabular.read_files import classify_groups, read_wide
+
+KEYS = [1, 2, 10]
+
+
+def wide_table(make_table):
+    # a control group and the experimental groups of the tables of KEYS, in a single table.
+    # the groups are named "expr_t{key}_{sample}"; the samples of group 2 are not consecutive.
+    tables = {k: make_table(seed=k, key_experimental=f"expr_t{k}") for k in KEYS}
+    parts = [tables[KEYS[0]].filter(like="ctrl")]
+    for k in KEYS:
+        parts.append(tables[k].filter(like="expr"))
+    df = pd.concat(parts, axis=1)
+    columns = list(df.columns)
+    moved = columns.pop(columns.index("expr_t2_0"))
+    return df[columns + [moved]], tables
+
+
+def root(arr):
+    # the array that owns the memory of `arr`
+    while arr.base is not None:
+        arr = arr.base
+    return arr
+
+
+def test_classify_groups():
+    labels = ["ctrl_0", "expr_t2_0", "expr_t10_0", "expr_t2_1", "other"]
+    assert classify_groups(labels, r"expr_t(\d+)_", exclude=[0]) == ([2, 10], [[1, 3], [2]])
+    # the first matching expression of a dictionary is used
+    assert classify_groups(labels, {"t2": "early", "expr": "late"}, exclude=[0]) == \
+        (["early", "late"], [[1, 3], [2]])
+
+
+@pytest.mark.parametrize("transposed", [False, True])
+def test_read_wide(tmp_path, make_table, transposed):
+    df, tables = wide_table(make_table)
+    filename = str(tmp_path / "wide.csv")
+    (df.T.rename_axis("sample") if transposed else df).to_csv(filename)
+    df_c, keys, groups = read_wide(filename, "ctrl", r"expr_t(\d+)_")
+    assert keys == KEYS
+    pd.testing.assert_frame_equal(df_c, tables[1].filter(like="ctrl"), check_names=False)
+    for k, df_e in zip(keys, groups):
+        expected = tables[k].filter(like="expr")
+        pd.testing.assert_frame_equal(df_e.sort_index(axis=1), expected.sort_index(axis=1),
+                                      check_names=False)
+    # consecutive columns are views of the table, and the others are copied
+    assert root(groups[0].values) is root(df_c.values)
+    assert root(groups[1].values) is not root(df_c.values)
+    with pytest.raises(ValueError, match="are not found"):
+        read_wide(filename, "ctrl", r"other_(\d+)")
+
+
+def test_groups_match_separate_files(tmp_path, make_table):
+    df, tables = wide_table(make_table)
+    filename = str(tmp_path / "wide.csv")
+    df.to_csv(filename)
+    kwargs = {"output_metrics": True}
+    # the same control group in each separate file
+    ctrl = tables[1].filter(like="ctrl")
+    filenames = []
+    for k in KEYS:
+        filenames.append(str(tmp_path / f"d_{k}.csv"))
+        pd.concat([ctrl, tables[k].filter(like="expr")], axis=1).to_csv(filenames[-1])
+    expected = dnb_tb_iterate(KEYS, filenames, "ctrl", "expr", kwargs)
+    ret = dnb_tb_groups(filename, "ctrl", r"expr_t(\d+)_", kwargs)
+    assert len(ret) > 0
+    # the columns of group 2 are in another order, which does not change the result
+    pd.testing.assert_frame_equal(ret, expected)
+
+    output_filename = str(tmp_path / "output.csv")
+    dnb_tb_groups(filename, "ctrl", r"expr_t(\d+)_", kwargs,
+                  writer=ResultWriter(output_filename, set_auto_params(dict(kwargs))))
+    pd.testing.assert_frame_equal(read_result(output_filename), expected.reset_index(drop=True),
+                                  check_dtype=False)
+
+
+@pytest.fixture
+def restore_logging():
+    # `main` adds a handler of the captured stderr to the logger
+    logger = logging.getLogger("dnb_tool")
+    handlers, level = list(logger.handlers), logger.level
+    yield
+    logger.handlers, logger.level = handlers, level
+
+
+@pytest.mark.parametrize("option", [["--cache_dir", "cache"], ["--prefetch", "2"],
+                                    ["--control_file", "ctrl.csv"], ["--bootstrap", "10"]])
+def test_cli_rejects_options_of_separate_files(tmp_path, make_table, monkeypatch, restore_logging, option):
+    df, _ = wide_table(make_table)
+    df.to_csv(tmp_path / "wide.csv")
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(sys, "argv", ["dnb_tabular", "--wide_file", "wide.csv",
+                                      "--group_pattern", r"expr_t(\d+)_"] + option)
+    with pytest.raises(ValueError, match="--wide_file cannot be used"):
+        tabular_main.main()
+    assert not os.path.exists(tmp_path / "output.csv")
+
+
+def test_cli_wide_mode(tmp_path, make_table, monkeypatch, restore_logging):
+    df, _ = wide_table(make_table)
+    df.to_csv(tmp_path / "wide.csv")
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(sys, "argv", ["dnb_tabular", "--wide_file", "wide.csv", "--group_pattern",
+                                      r"expr_t(\d+)_", "--no-plot_correlation", "--no-plot_heatmap"])
+    tabular_main.main()
+    assert list(read_result(str(tmp_path / "output.csv"))["time_point"].unique()) == KEYS